@@ -0,0 +1,70 @@
+from typing import Dict, List, Optional
+
+import pandas as pd
+from sqlalchemy.orm import Session
+
+import membership_snapshot
+from cache_queries import get_cache_set_nodes, get_membership_version
+from membership_snapshot import get_snapshot_addresses
+
+"""
+In process cache of cache set membership. All cache_set_node rows of a set are
+loaded once with their start_height/end_height so the addresses of the set at
+any height are resolved without a query. The process changing the membership of
+a set invalidates it, every other process (the service loop, the workers) drops
+its cache once per cycle when the version of cache_set_node changed
+(check_membership_version()).
+
+Sets in the membership snapshot attached by the process are resolved from it.
+"""
+
+cache_set_nodes: Dict[int, pd.DataFrame] = {}
+# get_membership_version() cache_set_nodes was loaded at
+membership_version: Optional[tuple] = None
+
+
+def get_cache_set_addresses(
+    session: Session, cache_set_id: int, height: Optional[int] = None
+) -> List[str]:
+    """
+    Addresses of the set at height, or the current members if height is None.
+    """
+    if membership_snapshot.snapshot is not None:
+        addresses = get_snapshot_addresses(
+            membership_snapshot.snapshot, cache_set_id, height
+        )
+        if addresses is not None:
+            return addresses
+    if cache_set_id not in cache_set_nodes:
+        cache_set_nodes[cache_set_id] = get_cache_set_nodes(session, cache_set_id)
+    nodes = cache_set_nodes[cache_set_id]
+
+    has_ended = nodes["end_height"].notna()
+    if height is None:
+        return nodes["address"][~has_ended].tolist()
+    has_started = nodes["start_height"].isna() | (nodes["start_height"] <= height)
+    has_ended &= nodes["end_height"] <= height
+    return nodes["address"][has_started & ~has_ended].tolist()
+
+
+def invalidate_cache_set_addresses(cache_set_id: Optional[int] = None) -> None:
+    """
+    Drop the membership of cache_set_id, or of every set if it is None.
+    """
+    if cache_set_id is None:
+        cache_set_nodes.clear()
+    else:
+        cache_set_nodes.pop(cache_set_id, None)
+
+
+def check_membership_version(session: Session, version: tuple = None) -> tuple:
+    """
+    Drop every cached membership if cache_set_node changed since the last check,
+    version is queried when None. Returns the current version.
+    """
+    global membership_version
+    version = version if version is not None else get_membership_version(session)
+    if version != membership_version:
+        cache_set_nodes.clear()
+        membership_version = version
+    return version
@@ -0,0 +1,330 @@
+import asyncio
+import json
+import typing
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional
+
+import pandas as pd
+from common.db_utils import ConnFactory
+from common.orm.repository import PoktInfoRepository
+from common.orm.schema import (
+    RewardsCacheSet,
+    LatencyCacheSet,
+    ErrorsCacheSet,
+    PoktInfoBase,
+    LatencyCache,
+    RewardsInfo,
+    ErrorsCache,
+)
+from common.utils import get_last_block_height
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, AsyncSession
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.orm import Session
+
+from address_cache import check_membership_version, get_cache_set_addresses
+from bulk_writer import (
+    ORM_BUILDERS,
+    get_upsert_statements,
+    intern_error_groups,
+    prepare_frame,
+)
+from cache_aggregations import (
+    sum_rewards,
+    sum_latency,
+    finalize_latency,
+)
+from cache_queries import get_errors_counts, get_latency_frame, get_rewards_frame
+from cache_service import add_state_range
+from definitions import (
+    ASYNC_CPU_WORKERS,
+    ASYNC_JOBS,
+    ASYNC_POOL_SIZE,
+    BULK_WRITE_MODE,
+    ERROR_GROUPS,
+    LATENCY_SUMS,
+    get_blocks_interval,
+)
+from error_grouping import create_msg_groups_frame
+from loggers import logger, perf_logger
+from worker_pool import get_priority, get_windows
+
+"""
+asyncio mode of the cache service for rewards, latency and errors. All windows
+of a cycle run as coroutines of one process on an asyncpg engine with at most
+ASYNC_POOL_SIZE connections, ASYNC_JOBS of them at once. A window only holds a
+connection while it reads or writes, the pandas aggregation in between runs on
+ASYNC_CPU_WORKERS processes (inline with 0).
+
+Reads and state ranges reuse the sync repository code through
+AsyncSession.run_sync(), writes COPY the frame with asyncpg's
+copy_records_to_table. Node count and location stay on the worker pool.
+"""
+
+ASYNC_DRIVER = "postgresql+asyncpg"
+
+cpu_pool = None
+
+
+def get_cpu_pool() -> Optional[ProcessPoolExecutor]:
+    global cpu_pool
+    if cpu_pool is None and ASYNC_CPU_WORKERS:
+        cpu_pool = ProcessPoolExecutor(max_workers=ASYNC_CPU_WORKERS)
+    return cpu_pool
+
+
+def create_engine_async() -> AsyncEngine:
+    """
+    asyncpg engine on the poktinfo credentials, the engine is bound to the event
+    loop it is first used on.
+    """
+    with open(f"{ConnFactory.creds_directory}poktinfo_creds.json") as f:
+        engine = ConnFactory.get_engine(json.load(f))
+    url = engine.url.set(drivername=ASYNC_DRIVER)
+    engine.dispose()
+    return create_async_engine(url, pool_size=ASYNC_POOL_SIZE, max_overflow=0)
+
+
+def read_rewards(
+    session: Session, cache_set_id: int, from_height: int, to_height: int
+) -> Optional[pd.DataFrame]:
+    if not PoktInfoRepository.does_height_exist(session, to_height, RewardsInfo):
+        return None
+    addresses = get_cache_set_addresses(session, cache_set_id, from_height)
+    return get_rewards_frame(session, from_height, to_height, addresses, [cache_set_id])
+
+
+def read_latency(
+    session: Session, cache_set_id: int, from_height: int, to_height: int
+) -> Optional[pd.DataFrame]:
+    if not PoktInfoRepository.does_height_exist(
+        session, to_height, LatencyCache, is_range=True
+    ):
+        return None
+    addresses = get_cache_set_addresses(session, cache_set_id, from_height)
+    return get_latency_frame(session, from_height, to_height, addresses, [cache_set_id])
+
+
+def read_errors(
+    session: Session, cache_set_id: int, from_height: int, to_height: int
+) -> Optional[pd.DataFrame]:
+    if not PoktInfoRepository.does_height_exist(
+        session, to_height, ErrorsCache, is_range=True
+    ):
+        return None
+    addresses = get_cache_set_addresses(session, cache_set_id, from_height)
+    return get_errors_counts(session, from_height, to_height, addresses, [cache_set_id])
+
+
+def aggregate_rewards(rewards_df: pd.DataFrame) -> pd.DataFrame:
+    return sum_rewards(rewards_df, ["chain"])
+
+
+def aggregate_latency(latency_df: pd.DataFrame) -> pd.DataFrame:
+    return finalize_latency(sum_latency(latency_df, ["region", "chain"]))
+
+
+def aggregate_errors(errors_df: pd.DataFrame) -> pd.DataFrame:
+    return create_msg_groups_frame(errors_df)
+
+
+# service -> (cache set table, read in run_sync, aggregate on the CPU pool)
+ASYNC_SERVICES = {
+    "rewards": (RewardsCacheSet, read_rewards, aggregate_rewards),
+    "latency": (LatencyCacheSet, read_latency, aggregate_latency),
+    "errors": (ErrorsCacheSet, read_errors, aggregate_errors),
+}
+
+
+async def copy_records(
+    connection: AsyncConnection,
+    table_name: str,
+    frame: pd.DataFrame,
+    schema_name: Optional[str] = "public",
+) -> None:
+    raw_connection = await connection.get_raw_connection()
+    records = frame.astype(object).where(frame.notna(), None)
+    await raw_connection.driver_connection.copy_records_to_table(
+        table_name,
+        records=list(records.itertuples(index=False, name=None)),
+        columns=list(frame.columns),
+        schema_name=schema_name,
+    )
+
+
+async def save_cache_sets_async(
+    session: AsyncSession,
+    table_obj: typing.Type[PoktInfoBase],
+    frame: pd.DataFrame,
+    mode: str = None,
+) -> bool:
+    """
+    save_cache_sets() on an async session, "copy" and "upsert" go through
+    asyncpg's COPY and "orm" through save_many in run_sync().
+    """
+    mode = mode if mode is not None else BULK_WRITE_MODE
+    if ERROR_GROUPS and table_obj == ErrorsCacheSet:
+        frame = await session.run_sync(intern_error_groups, frame)
+        # The ORM model has no error_group_id column
+        mode = "copy" if mode == "orm" else mode
+    if LATENCY_SUMS and table_obj == LatencyCacheSet:
+        # Nor the latency sums
+        mode = "copy" if mode == "orm" else mode
+    frame = prepare_frame(table_obj, frame)
+    if mode == "orm":
+        return await session.run_sync(
+            PoktInfoRepository.save_many, ORM_BUILDERS[table_obj](frame)
+        )
+    try:
+        connection = await session.connection()
+        if mode == "upsert":
+            staging_table, create_stmt, insert_stmt = get_upsert_statements(
+                table_obj, list(frame.columns)
+            )
+            await session.execute(text(create_stmt))
+            await copy_records(connection, staging_table, frame, schema_name=None)
+            await session.execute(text(insert_stmt))
+        else:
+            await copy_records(connection, table_obj.__tablename__, frame)
+        await session.commit()
+        return True
+    except Exception as e:
+        await session.rollback()
+        logger.error(
+            f"Failed writing {len(frame)} rows to {table_obj.__tablename__}, {e}"
+        )
+        return False
+
+
+async def cache_window_async(
+    engine: AsyncEngine,
+    service: str,
+    cache_set_id: int,
+    from_height: int,
+    to_height: int,
+) -> bool:
+    """
+    Cache one window, returns False without caching if its source data isn't
+    synced yet.
+    """
+    now = pd.Timestamp.now()
+    table_obj, read, aggregate = ASYNC_SERVICES[service]
+    async with AsyncSession(engine) as session:
+        frame = await session.run_sync(read, cache_set_id, from_height, to_height)
+    if frame is None:
+        logger.info(
+            f"Skipping {service} cache for, {service} not synced yet "
+            f"{from_height, to_height}"
+        )
+        return False
+    if service == "errors" and frame.empty:
+        # Nothing to write, recorded so the window isn't planned again
+        async with AsyncSession(engine) as session:
+            await session.run_sync(
+                add_state_range,
+                table_obj.__tablename__,
+                from_height,
+                to_height,
+                True,
+                cache_set_id,
+            )
+        return True
+
+    if get_cpu_pool() is None:
+        totals = aggregate(frame)
+    else:
+        totals = await asyncio.get_running_loop().run_in_executor(
+            get_cpu_pool(), aggregate, frame
+        )
+    totals = totals.assign(
+        cache_set_id=cache_set_id, start_height=from_height, end_height=to_height
+    )
+    async with AsyncSession(engine) as session:
+        has_added = await save_cache_sets_async(session, table_obj, totals)
+        await session.run_sync(
+            add_state_range,
+            table_obj.__tablename__,
+            from_height,
+            to_height,
+            has_added,
+            cache_set_id,
+        )
+    perf_logger.info(
+        f"Finished async caching {service} for "
+        f"{cache_set_id, from_height, to_height}, {len(totals)} rows, "
+        f"took {pd.Timestamp.now() - now}"
+    )
+    return True
+
+
+async def run_windows_async(
+    engine: AsyncEngine,
+    semaphore: asyncio.Semaphore,
+    cache_set_id: int,
+    service: str,
+    heights: typing.Iterable[int],
+) -> int:
+    """
+    Cache the windows of one (cache_set_id, service) in order until one isn't
+    synced, returns the number of windows run.
+    """
+    jobs = 0
+    for from_height in heights:
+        async with semaphore:
+            try:
+                is_synced = await cache_window_async(
+                    engine,
+                    service,
+                    cache_set_id,
+                    from_height,
+                    from_height + get_blocks_interval(),
+                )
+            except Exception as e:
+                logger.error(
+                    "Failed caching window of "
+                    f"{cache_set_id, service, from_height}, {e}"
+                )
+                is_synced = True
+        jobs += 1
+        if not is_synced:
+            break
+    return jobs
+
+
+async def run_async_cycle(
+    cache_set_ids: List[int], services: List[str] = None, last_height: int = None
+) -> int:
+    """
+    Cache every window of services for cache_set_ids up to last_height in this
+    process, returns the number of windows run. The engine lives for the cycle,
+    asyncpg connections can't outlive their event loop.
+    """
+    now = pd.Timestamp.now()
+    services = services if services is not None else list(ASYNC_SERVICES)
+    last_height = last_height if last_height is not None else get_last_block_height()
+    engine = create_engine_async()
+    try:
+        async with AsyncSession(engine) as session:
+            await session.run_sync(check_membership_version)
+            windows = await session.run_sync(
+                get_windows, cache_set_ids, services, last_height
+            )
+        # Semaphore waiters are served in order, live windows queue first
+        keys = sorted(
+            windows,
+            key=lambda key: (
+                get_priority(windows[key][0] + get_blocks_interval(), last_height),
+                key,
+            ),
+        )
+        semaphore = asyncio.Semaphore(ASYNC_JOBS)
+        jobs = await asyncio.gather(
+            *[run_windows_async(engine, semaphore, *key, windows[key]) for key in keys]
+        )
+    finally:
+        await engine.dispose()
+    perf_logger.info(
+        f"Finished async cycle of {len(cache_set_ids)} cache sets {services} at "
+        f"{last_height}, {sum(jobs)} windows, took {pd.Timestamp.now() - now}"
+    )
+    return sum(jobs)
@@ -0,0 +1,276 @@
+from typing import List, Optional
+
+import pandas as pd
+from common.db_utils import ConnFactory
+from common.orm.repository import PoktInfoRepository
+from common.orm.schema import (
+    RewardsCacheSet,
+    LatencyCacheSet,
+    ErrorsCacheSet,
+    LatencyCache,
+    RewardsInfo,
+    ErrorsCache,
+)
+from common.utils import get_last_block_height
+from sqlalchemy.orm import Session
+
+from address_cache import check_membership_version, get_cache_set_addresses
+from cache_aggregations import (
+    fold_rewards,
+    fold_latency,
+    finalize_latency,
+)
+from cache_queries import get_errors_frame, get_latency_chunks, get_rewards_chunks
+from bulk_writer import save_cache_sets
+from cache_service import add_state_range, get_last_recorded_height
+from definitions import get_blocks_interval
+from error_grouping import create_msg_groups_frame
+from loggers import logger, perf_logger
+from membership_snapshot import expand_membership
+
+"""
+Batched mode of the cache service, every source table is read once per interval
+for the union of the addresses of all cache sets and the rows of all sets are
+produced with a single groupby.
+"""
+
+
+def get_membership(
+    session: Session, cache_set_ids: List[int], height: Optional[int] = None
+) -> pd.DataFrame:
+    """
+    (cache_set_id, address) pairs of the members at height, or of the current
+    members if height is None.
+    """
+    pairs = [
+        (cache_set_id, address)
+        for cache_set_id in cache_set_ids
+        for address in get_cache_set_addresses(session, cache_set_id, height)
+    ]
+    return pd.DataFrame(pairs, columns=["cache_set_id", "address"]).drop_duplicates()
+
+
+def batch_cache_rewards(
+    session: Session,
+    cache_set_ids: List[int],
+    membership: pd.DataFrame,
+    from_height: int,
+    to_height: int,
+) -> bool:
+    now = pd.Timestamp.now()
+    perf_logger.info(
+        f"Batch caching rewards for {len(cache_set_ids), from_height, to_height}"
+    )
+
+    if not PoktInfoRepository.does_height_exist(session, to_height, RewardsInfo):
+        logger.info(
+            "Skipping rewards cache for, rewards not synced yet "
+            f"{from_height, to_height}"
+        )
+        return False
+
+    addresses = membership["address"].unique().tolist()
+    rewards_chunks = get_rewards_chunks(
+        session,
+        from_height,
+        to_height,
+        addresses,
+        membership["cache_set_id"].unique().tolist(),
+    )
+    totals = fold_rewards(
+        (expand_membership(chunk, membership, from_height) for chunk in rewards_chunks),
+        ["cache_set_id", "chain"],
+    ).assign(start_height=from_height, end_height=to_height)
+    has_added = save_cache_sets(session, RewardsCacheSet, totals)
+    for cache_set_id in cache_set_ids:
+        add_state_range(
+            session,
+            "rewards_cache_set",
+            from_height,
+            to_height,
+            has_added,
+            cache_set_id,
+        )
+    perf_logger.info(
+        "Finished batch caching rewards for "
+        f"{len(cache_set_ids), from_height, to_height},"
+        f" {len(totals)} rows, took {pd.Timestamp.now() - now}"
+    )
+    return True
+
+
+def batch_cache_latency(
+    session: Session,
+    cache_set_ids: List[int],
+    membership: pd.DataFrame,
+    from_height: int,
+    to_height: int,
+) -> bool:
+    now = pd.Timestamp.now()
+    perf_logger.info(
+        f"Batch caching latency for {len(cache_set_ids), from_height, to_height}"
+    )
+
+    if not PoktInfoRepository.does_height_exist(
+        session,
+        to_height,
+        LatencyCache,
+        is_range=True,
+    ):
+        logger.info(
+            "Skipping latency cache for, latency not synced yet "
+            f"{from_height, to_height}"
+        )
+        return False
+
+    addresses = membership["address"].unique().tolist()
+    latency_chunks = get_latency_chunks(
+        session,
+        from_height,
+        to_height,
+        addresses,
+        membership["cache_set_id"].unique().tolist(),
+    )
+    averages = finalize_latency(
+        fold_latency(
+            (
+                expand_membership(chunk, membership, from_height)
+                for chunk in latency_chunks
+            ),
+            ["cache_set_id", "region", "chain"],
+        )
+    ).assign(start_height=from_height, end_height=to_height)
+    has_added = save_cache_sets(session, LatencyCacheSet, averages)
+    for cache_set_id in cache_set_ids:
+        add_state_range(
+            session,
+            "latency_cache_set",
+            from_height,
+            to_height,
+            has_added,
+            cache_set_id,
+        )
+    perf_logger.info(
+        "Finished batch caching latency for "
+        f"{len(cache_set_ids), from_height, to_height},"
+        f" {len(averages)} rows, took {pd.Timestamp.now() - now}"
+    )
+    return True
+
+
+def batch_cache_errors(
+    session: Session,
+    cache_set_ids: List[int],
+    membership: pd.DataFrame,
+    from_height: int,
+    to_height: int,
+) -> bool:
+    now = pd.Timestamp.now()
+    perf_logger.info(
+        f"Batch caching errors for {len(cache_set_ids), from_height, to_height}"
+    )
+
+    if not PoktInfoRepository.does_height_exist(
+        session,
+        to_height,
+        ErrorsCache,
+        is_range=True,
+    ):
+        logger.info(
+            f"Skipping errors cache for, errors not synced yet {from_height, to_height}"
+        )
+        return False
+
+    addresses = membership["address"].unique().tolist()
+    errors_df = get_errors_frame(
+        session,
+        from_height,
+        to_height,
+        addresses,
+        membership["cache_set_id"].unique().tolist(),
+    )
+    errors_df = expand_membership(errors_df, membership, from_height)
+    totals = create_msg_groups_frame(errors_df, ["cache_set_id"]).assign(
+        start_height=from_height, end_height=to_height
+    )
+    has_added = (
+        save_cache_sets(session, ErrorsCacheSet, totals) if len(totals) else True
+    )
+    # Sets without errors in the interval are recorded too, like cache_errors()
+    error_set_ids = set(errors_df["cache_set_id"].unique())
+    for cache_set_id in cache_set_ids:
+        add_state_range(
+            session,
+            "errors_cache_set",
+            from_height,
+            to_height,
+            has_added if cache_set_id in error_set_ids else True,
+            cache_set_id,
+        )
+    perf_logger.info(
+        "Finished batch caching errors for "
+        f"{len(cache_set_ids), from_height, to_height},"
+        f" {len(totals)} rows, took {pd.Timestamp.now() - now}"
+    )
+    return True
+
+
+BATCH_SERVICES = {
+    "rewards": (RewardsCacheSet, batch_cache_rewards),
+    "latency": (LatencyCacheSet, batch_cache_latency),
+    "errors": (ErrorsCacheSet, batch_cache_errors),
+}
+
+
+def update_service_batched(
+    session: Session,
+    func,
+    last_recorded_heights: pd.Series,
+    last_height: int,
+) -> None:
+    """
+    Cache every interval from the lowest last recorded height up to last_height,
+    each interval only includes the sets that haven't cached it yet, with their
+    members at its start.
+    """
+    last_recorded_heights -= last_recorded_heights % get_blocks_interval()
+    height = int(last_recorded_heights.min())
+    while height + get_blocks_interval() <= last_height:
+        cache_set_ids = last_recorded_heights.index[
+            last_recorded_heights <= height
+        ].tolist()
+        membership = get_membership(session, cache_set_ids, height)
+        if not func(
+            session,
+            cache_set_ids,
+            membership,
+            height,
+            height + get_blocks_interval(),
+        ):
+            break
+        height += get_blocks_interval()
+
+
+def update_cache_sets_batched(
+    cache_set_ids: List[int], services: List[str] = None, last_height: int = None
+) -> None:
+    if not cache_set_ids:
+        return
+    services = services if services is not None else list(BATCH_SERVICES)
+    logger.info(f"Starting batch update of {len(cache_set_ids)} cache sets {services}")
+    last_height = last_height if last_height is not None else get_last_block_height()
+    with ConnFactory.poktinfo_conn() as session:
+        check_membership_version(session)
+        for service in services:
+            table_obj, func = BATCH_SERVICES[service]
+            last_recorded_heights = pd.Series(
+                {
+                    cache_set_id: get_last_recorded_height(
+                        session, table_obj, cache_set_id, last_height
+                    )
+                    for cache_set_id in cache_set_ids
+                },
+                dtype="int64",
+            )
+            update_service_batched(session, func, last_recorded_heights, last_height)
+    logger.info(f"Finished batch update of {len(cache_set_ids)} cache sets")
@@ -0,0 +1,399 @@
+import io
+import typing
+from typing import List, Tuple
+
+import pandas as pd
+from common.orm.repository import PoktInfoRepository
+from common.orm.schema import (
+    RewardsCacheSet,
+    LatencyCacheSet,
+    ErrorsCacheSet,
+    NodeCountCacheSet,
+    LocationCacheSet,
+    PoktInfoBase,
+)
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from cache_queries import get_error_group_ids
+from definitions import (
+    BULK_WRITE_MODE,
+    ERROR_GROUPS,
+    LATENCY_SUMS,
+    get_blocks_interval,
+)
+from loggers import logger
+
+"""
+Writers of the aggregated cache set frames. The "orm" mode builds a SQLAlchemy
+object per row and saves them with PoktInfoRepository.save_many, the "copy"
+mode streams the frame straight into Postgres with COPY FROM STDIN and the
+"upsert" mode merges it on the natural key of the table (needs the unique
+indexes of scripts/create_indexes.sql).
+"""
+
+CACHE_SET_COLUMNS = {
+    RewardsCacheSet: [
+        "cache_set_id",
+        "rewards_total",
+        "normalized_rewards_total",
+        "relays_total",
+        "chain",
+        "start_height",
+        "end_height",
+        "interval",
+    ],
+    LatencyCacheSet: [
+        "cache_set_id",
+        "total_relays",
+        "region",
+        "chain",
+        "avg_latency",
+        "avg_p90_latency",
+        "avg_weighted_latency",
+        "start_height",
+        "end_height",
+        "interval",
+    ],
+    ErrorsCacheSet: [
+        "cache_set_id",
+        "errors_count",
+        "msg",
+        "chain",
+        "start_height",
+        "end_height",
+        "interval",
+    ],
+    NodeCountCacheSet: [
+        "cache_set_id",
+        "node_count",
+        "chain",
+        "start_height",
+        "end_height",
+        "interval",
+    ],
+    LocationCacheSet: [
+        "cache_set_id",
+        "node_count",
+        "continent",
+        "country",
+        "city",
+        "ip",
+        "isp",
+        "lat",
+        "lon",
+        "start_height",
+        "end_height",
+        "interval",
+    ],
+}
+# Natural keys of the cache set tables, must match the unique indexes of
+# scripts/create_indexes.sql to be usable as ON CONFLICT targets
+CACHE_SET_KEYS = {
+    RewardsCacheSet: [
+        "cache_set_id",
+        "interval",
+        "start_height",
+        "end_height",
+        "chain",
+    ],
+    LatencyCacheSet: [
+        "cache_set_id",
+        "interval",
+        "start_height",
+        "end_height",
+        "region",
+        "chain",
+    ],
+    ErrorsCacheSet: [
+        "cache_set_id",
+        "interval",
+        "start_height",
+        "end_height",
+        "chain",
+        "msg",
+        "error_group_id",
+    ],
+    NodeCountCacheSet: [
+        "cache_set_id",
+        "interval",
+        "start_height",
+        "end_height",
+        "chain",
+    ],
+    LocationCacheSet: [
+        "cache_set_id",
+        "interval",
+        "start_height",
+        "end_height",
+        "continent",
+        "country",
+        "city",
+        "ip",
+        "isp",
+    ],
+}
+# Key columns that are indexed through an expression (long or nullable values),
+# errors are keyed on both msg and error_group_id so one key covers the rows
+# written with and without ERROR_GROUPS
+CACHE_SET_KEY_EXPRESSIONS = {
+    ErrorsCacheSet: {
+        "chain": "(COALESCE(chain, ''))",
+        "msg": "(md5(COALESCE(msg, '')))",
+        "error_group_id": "(COALESCE(error_group_id, 0))",
+    },
+    NodeCountCacheSet: {"chain": "(COALESCE(chain, ''))"},
+}
+
+
+def to_rewards_cache_sets(totals: pd.DataFrame) -> List[RewardsCacheSet]:
+    return [
+        RewardsCacheSet(
+            cache_set_id=int(row.cache_set_id),
+            rewards_total=float(row.rewards_total),
+            normalized_rewards_total=float(row.normalized_rewards_total),
+            relays_total=int(row.relays_total),
+            chain=str(row.chain),
+            start_height=int(row.start_height),
+            end_height=int(row.end_height),
+            interval=int(row.interval),
+        )
+        for row in totals.itertuples(index=False)
+    ]
+
+
+def to_latency_cache_sets(averages: pd.DataFrame) -> List[LatencyCacheSet]:
+    return [
+        LatencyCacheSet(
+            cache_set_id=int(row.cache_set_id),
+            total_relays=int(row.total_relays),
+            region=str(row.region),
+            chain=str(row.chain),
+            avg_latency=float(row.avg_latency),
+            avg_p90_latency=float(row.avg_p90_latency),
+            avg_weighted_latency=float(row.avg_weighted_latency),
+            start_height=int(row.start_height),
+            end_height=int(row.end_height),
+            interval=int(row.interval),
+        )
+        for row in averages.itertuples(index=False)
+    ]
+
+
+def to_errors_cache_sets(totals: pd.DataFrame) -> List[ErrorsCacheSet]:
+    return [
+        ErrorsCacheSet(
+            cache_set_id=int(row.cache_set_id),
+            errors_count=int(row.errors_count),
+            msg=row.msg,
+            start_height=int(row.start_height),
+            end_height=int(row.end_height),
+            chain=row.chain if pd.notna(row.chain) else None,
+            interval=int(row.interval),
+        )
+        for row in totals.itertuples(index=False)
+    ]
+
+
+def to_node_count_cache_sets(node_counts: pd.DataFrame) -> List[NodeCountCacheSet]:
+    return [
+        NodeCountCacheSet(
+            cache_set_id=int(row.cache_set_id),
+            node_count=int(row.node_count),
+            chain=row.chain if pd.notna(row.chain) else None,
+            start_height=int(row.start_height),
+            end_height=int(row.end_height),
+            interval=int(row.interval),
+        )
+        for row in node_counts.itertuples(index=False)
+    ]
+
+
+def to_location_cache_sets(locations: pd.DataFrame) -> List[LocationCacheSet]:
+    return [
+        LocationCacheSet(
+            cache_set_id=int(row.cache_set_id),
+            node_count=int(row.node_count),
+            continent=str(row.continent),
+            country=str(row.country),
+            city=str(row.city),
+            ip=str(row.ip),
+            isp=str(row.isp),
+            lat=str(row.lat),
+            lon=str(row.lon),
+            start_height=int(row.start_height),
+            end_height=int(row.end_height),
+            interval=int(row.interval),
+        )
+        for row in locations.itertuples(index=False)
+    ]
+
+
+# With ERROR_GROUPS errors_cache_set rows reference error_group instead of msg
+ERROR_GROUP_COLUMN = "error_group_id"
+
+
+def with_error_groups(
+    table_obj: typing.Type[PoktInfoBase], columns: List[str]
+) -> List[str]:
+    if ERROR_GROUPS and table_obj == ErrorsCacheSet:
+        return [ERROR_GROUP_COLUMN if column == "msg" else column for column in columns]
+    return columns
+
+
+# With LATENCY_SUMS latency_cache_set rows also store the mergeable aggregates
+LATENCY_SUM_COLUMNS = [
+    "latency_sum",
+    "p90_latency_sum",
+    "weighted_latency_sum",
+    "p90_latency_sketch",
+]
+
+
+def with_latency_sums(
+    table_obj: typing.Type[PoktInfoBase], columns: List[str]
+) -> List[str]:
+    if LATENCY_SUMS and table_obj == LatencyCacheSet:
+        return columns + LATENCY_SUM_COLUMNS
+    return columns
+
+
+def intern_error_groups(session: Session, errors: pd.DataFrame) -> pd.DataFrame:
+    """
+    Add the error_group id of every msg, groups are first seen at the lowest
+    start_height of their rows.
+    """
+    first_seen_heights = errors.groupby("msg", sort=False)["start_height"].min()
+    error_group_ids = get_error_group_ids(
+        session, first_seen_heights.index.tolist(), first_seen_heights.tolist()
+    )
+    return errors.assign(**{ERROR_GROUP_COLUMN: errors["msg"].map(error_group_ids)})
+
+
+ORM_BUILDERS = {
+    RewardsCacheSet: to_rewards_cache_sets,
+    LatencyCacheSet: to_latency_cache_sets,
+    ErrorsCacheSet: to_errors_cache_sets,
+    NodeCountCacheSet: to_node_count_cache_sets,
+    LocationCacheSet: to_location_cache_sets,
+}
+
+
+def prepare_frame(
+    table_obj: typing.Type[PoktInfoBase], frame: pd.DataFrame
+) -> pd.DataFrame:
+    if "interval" not in frame:
+        frame = frame.assign(interval=get_blocks_interval())
+    columns = with_error_groups(table_obj, CACHE_SET_COLUMNS[table_obj])
+    return frame[with_latency_sums(table_obj, columns)]
+
+
+def copy_into(session: Session, table_name: str, frame: pd.DataFrame) -> None:
+    columns = ", ".join(f'"{column}"' for column in frame.columns)
+    buffer = io.StringIO()
+    frame.to_csv(buffer, index=False, header=False)
+    buffer.seek(0)
+    cursor = session.connection().connection.cursor()
+    cursor.copy_expert(
+        f"COPY {table_name} ({columns}) FROM STDIN WITH (FORMAT csv)", buffer
+    )
+
+
+def copy_frame(
+    session: Session, table_obj: typing.Type[PoktInfoBase], frame: pd.DataFrame
+) -> bool:
+    """
+    Stream frame into table_obj's table with COPY FROM STDIN (psycopg2), no ORM
+    objects are created. Empty values are written as NULL.
+    """
+    try:
+        copy_into(session, f"public.{table_obj.__tablename__}", frame)
+        session.commit()
+        return True
+    except Exception as e:
+        session.rollback()
+        logger.error(
+            f"Failed copying {len(frame)} rows to {table_obj.__tablename__}, {e}"
+        )
+        return False
+
+
+def get_upsert_statements(
+    table_obj: typing.Type[PoktInfoBase], frame_columns: List[str]
+) -> Tuple[str, str, str]:
+    """
+    Staging table name, its CREATE and the INSERT ... ON CONFLICT merging it
+    into table_obj's table on the natural key of the table.
+    """
+    table_name = table_obj.__tablename__
+    staging_table = f"staging_{table_name}"
+    columns = ", ".join(f'"{column}"' for column in frame_columns)
+    keys = CACHE_SET_KEYS[table_obj]
+    key_expressions = CACHE_SET_KEY_EXPRESSIONS.get(table_obj, {})
+    conflict_keys = ", ".join(key_expressions.get(key, f'"{key}"') for key in keys)
+    values = [f'"{column}"' for column in frame_columns if column not in keys]
+    stored_values = ", ".join(f"{table_name}.{value}" for value in values)
+    new_values = ", ".join(f"EXCLUDED.{value}" for value in values)
+    create_stmt = (
+        f"CREATE TEMP TABLE {staging_table} ON COMMIT DROP AS "
+        f"SELECT {columns} FROM public.{table_name} WITH NO DATA"
+    )
+    insert_stmt = (
+        f"INSERT INTO public.{table_name} ({columns}) "
+        f"SELECT {columns} FROM {staging_table} "
+        f"ON CONFLICT ({conflict_keys}) DO UPDATE "
+        f"SET ({', '.join(values)}) = ROW({new_values}) "
+        f"WHERE ROW({stored_values}) IS DISTINCT FROM ROW({new_values})"
+    )
+    return staging_table, create_stmt, insert_stmt
+
+
+def upsert_frame(
+    session: Session, table_obj: typing.Type[PoktInfoBase], frame: pd.DataFrame
+) -> bool:
+    """
+    COPY frame into a temporary table and merge it with INSERT ... ON CONFLICT
+    on the natural key of the table. Rows that are already stored with the same
+    values are left untouched, so reruns are no-ops.
+    """
+    staging_table, create_stmt, insert_stmt = get_upsert_statements(
+        table_obj, list(frame.columns)
+    )
+    try:
+        session.execute(text(create_stmt))
+        copy_into(session, staging_table, frame)
+        session.execute(text(insert_stmt))
+        session.commit()
+        return True
+    except Exception as e:
+        session.rollback()
+        logger.error(
+            f"Failed upserting {len(frame)} rows to {table_obj.__tablename__}, {e}"
+        )
+        return False
+
+
+def save_cache_sets(
+    session: Session,
+    table_obj: typing.Type[PoktInfoBase],
+    frame: pd.DataFrame,
+    mode: str = None,
+) -> bool:
+    """
+    Save an aggregated frame with one row per cache set row, mode defaults to
+    BULK_WRITE_MODE.
+    """
+    mode = mode if mode is not None else BULK_WRITE_MODE
+    if ERROR_GROUPS and table_obj == ErrorsCacheSet:
+        frame = intern_error_groups(session, frame)
+        # The ORM model has no error_group_id column
+        mode = "copy" if mode == "orm" else mode
+    if LATENCY_SUMS and table_obj == LatencyCacheSet:
+        # Nor the latency sums
+        mode = "copy" if mode == "orm" else mode
+    frame = prepare_frame(table_obj, frame)
+    if mode == "copy":
+        return copy_frame(session, table_obj, frame)
+    if mode == "upsert":
+        return upsert_frame(session, table_obj, frame)
+    return PoktInfoRepository.save_many(session, ORM_BUILDERS[table_obj](frame))
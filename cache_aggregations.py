@@ -0,0 +1,253 @@
+import hashlib
+from typing import Iterable, List
+
+import numpy as np
+import pandas as pd
+from common.utils import POKT_MULTIPLIER
+
+from definitions import LATENCY_SUMS
+from latency_sketch import merge_sketch_frame, sketch_frame
+
+LATENCY_SKETCH_COLUMN = "p90_latency_sketch"
+# Additive columns of sum_rewards() and sum_latency()
+REWARDS_TOTALS = ["rewards_total", "normalized_rewards_total", "relays_total"]
+LATENCY_TOTALS = [
+    "total_relays",
+    "latency_sum",
+    "p90_latency_sum",
+    "weighted_latency_sum",
+]
+REWARDS_COLUMNS = [
+    "height",
+    "address",
+    "rewards",
+    "chain",
+    "relays",
+    "token_multiplier",
+    "percentage",
+    "stake_weight",
+]
+LATENCY_COLUMNS = [
+    "address",
+    "total_relays",
+    "region",
+    "start_height",
+    "end_height",
+    "avg_latency",
+    "avg_p90_latency",
+    "avg_weighted_latency",
+    "chain",
+]
+ERRORS_COLUMNS = [
+    "address",
+    "errors_count",
+    "chain",
+    "msg",
+    "start_height",
+    "end_height",
+]
+LOCATION_COLUMNS = [
+    "id",
+    "address",
+    "ip",
+    "height",
+    "start_height",
+    "end_height",
+    "city",
+    "continent",
+    "country",
+    "region",
+    "lat",
+    "lon",
+    "isp",
+    "org",
+    "as_",
+    "date_created",
+    "ran_from",
+]
+LOCATION_KEYS = ["continent", "country", "city", "ip", "isp"]
+# Continent -> ran_from of the location_info instance closest to it, "na" for
+# the ones missing
+CONTINENT_MAP = {
+    "North America": "na",
+    "Europe": "eu",
+    "Asia": "sg",
+}
+
+
+def expand_to_sets(df: pd.DataFrame, membership: pd.DataFrame) -> pd.DataFrame:
+    """
+    Attach cache_set_id to every row of df, duplicating rows of addresses that
+    belong to more than one set. membership has (cache_set_id, address) columns.
+    """
+    return df.merge(membership, on="address", how="inner", copy=False)
+
+
+def assign_windows(
+    df: pd.DataFrame, heights: pd.Series, from_height: int, interval: int
+) -> pd.DataFrame:
+    """
+    Set start_height/end_height of every row to the bounds of the interval
+    window its height falls in, windows are aligned to from_height.
+    """
+    start_heights = (
+        from_height + (heights.to_numpy() - from_height) // interval * interval
+    )
+    return df.assign(start_height=start_heights, end_height=start_heights + interval)
+
+
+def assign_source_windows(
+    df: pd.DataFrame, from_height: int, interval: int
+) -> pd.DataFrame:
+    """
+    assign_windows() of start_height/end_height ranged source rows, rows ending
+    past the end of their window are dropped like the per interval reads
+    (end_height <= to_height) drop them.
+    """
+    windows = assign_windows(df, df["start_height"], from_height, interval)
+    return windows[df["end_height"].to_numpy() <= windows["end_height"].to_numpy()]
+
+
+def sum_rewards(rewards_df: pd.DataFrame, keys: List[str]) -> pd.DataFrame:
+    """
+    Sum rewards, per 15k normalized rewards and relays by keys in one pass.
+    Rewards are normalized by stake_weight / token_multiplier, rows without a
+    usable weight count as is. Totals are returned in POKT, not uPOKT.
+    """
+    # Empty frames of the ORM rows have object columns
+    weight = (rewards_df["stake_weight"] / rewards_df["token_multiplier"]).astype(
+        "float64"
+    )
+    weight = weight.where(np.isfinite(weight) & (weight > 0), 1)
+    rewards_df = rewards_df.assign(normalized_rewards=rewards_df["rewards"] / weight)
+    totals = rewards_df.groupby(keys, sort=False).agg(
+        rewards_total=("rewards", "sum"),
+        normalized_rewards_total=("normalized_rewards", "sum"),
+        relays_total=("relays", "sum"),
+    )
+    totals["rewards_total"] /= POKT_MULTIPLIER
+    totals["normalized_rewards_total"] /= POKT_MULTIPLIER
+    return totals.reset_index()
+
+
+def sum_latency(latency_df: pd.DataFrame, keys: List[str]) -> pd.DataFrame:
+    """
+    Sum relays and relay weighted latencies by keys. The sums are additive, use
+    finalize_latency() to turn them into averages. With LATENCY_SUMS the p90
+    latencies are also sketched weighted by relays, see latency_sketch.py.
+    """
+    relays = latency_df["total_relays"]
+    latency_df = latency_df.assign(
+        latency_sum=latency_df["avg_latency"] * relays,
+        p90_latency_sum=latency_df["avg_p90_latency"] * relays,
+        weighted_latency_sum=latency_df["avg_weighted_latency"] * relays,
+    )
+    # numeric_only=False keeps the object columns of empty windows
+    latency_sums = (
+        latency_df.groupby(keys, sort=False)[LATENCY_TOTALS]
+        .sum(numeric_only=False)
+        .reset_index()
+    )
+    if LATENCY_SUMS:
+        sketches = sketch_frame(
+            latency_df, keys, "avg_p90_latency", "total_relays", LATENCY_SKETCH_COLUMN
+        )
+        latency_sums = latency_sums.merge(sketches, on=keys, how="left")
+    return latency_sums
+
+
+def fold_rewards(chunks: Iterable[pd.DataFrame], keys: List[str]) -> pd.DataFrame:
+    """
+    sum_rewards() of all chunks, the totals of every chunk are added up as it
+    comes so only one chunk is held at a time.
+    """
+    totals = None
+    for chunk in chunks:
+        chunk_totals = sum_rewards(chunk, keys)
+        if totals is not None:
+            chunk_totals = (
+                pd.concat([totals, chunk_totals], ignore_index=True)
+                .groupby(keys, sort=False)[REWARDS_TOTALS]
+                .sum()
+                .reset_index()
+            )
+        totals = chunk_totals
+    if totals is None:
+        return sum_rewards(pd.DataFrame(columns=REWARDS_COLUMNS), keys)
+    return totals
+
+
+def fold_latency(chunks: Iterable[pd.DataFrame], keys: List[str]) -> pd.DataFrame:
+    """
+    sum_latency() of all chunks, folded like fold_rewards(). With LATENCY_SUMS
+    the sketches of the chunks are merged.
+    """
+    latency_sums = None
+    for chunk in chunks:
+        chunk_sums = sum_latency(chunk, keys)
+        if latency_sums is not None:
+            chunk_sums = pd.concat([latency_sums, chunk_sums], ignore_index=True)
+            sums = (
+                chunk_sums.groupby(keys, sort=False)[LATENCY_TOTALS].sum().reset_index()
+            )
+            if LATENCY_SUMS:
+                sketches = merge_sketch_frame(chunk_sums, keys, LATENCY_SKETCH_COLUMN)
+                sums = sums.merge(sketches, on=keys, how="left")
+            chunk_sums = sums
+        latency_sums = chunk_sums
+    if latency_sums is None:
+        return sum_latency(pd.DataFrame(columns=LATENCY_COLUMNS), keys)
+    return latency_sums
+
+
+def finalize_latency(latency_sums: pd.DataFrame) -> pd.DataFrame:
+    """
+    Turn the output of sum_latency() into relay weighted averages, dropping
+    groups without relays.
+    """
+    latency_sums = latency_sums[latency_sums["total_relays"] > 0]
+    total_relays = latency_sums["total_relays"]
+    return latency_sums.assign(
+        avg_latency=latency_sums["latency_sum"] / total_relays,
+        avg_p90_latency=latency_sums["p90_latency_sum"] / total_relays,
+        avg_weighted_latency=latency_sums["weighted_latency_sum"] / total_relays,
+    )
+
+
+def aggregate_locations(locations_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Count the nodes of every (continent, country, city, ip, isp) with the lat
+    and lon of the first row, values are returned as strings. An ip located by
+    the location_info instance of its own continent (ran_from) only keeps the
+    rows of that instance, e.g. an ip in North America found from na and sg
+    only counts the na rows.
+    """
+    locations_df = locations_df.dropna(subset=LOCATION_KEYS[:-1])
+    is_local = locations_df["ran_from"] == (
+        locations_df["continent"].map(CONTINENT_MAP).fillna("na")
+    )
+    has_local = is_local.groupby(
+        [locations_df[key] for key in LOCATION_KEYS[:-1]], sort=False
+    ).transform("any")
+    locations_df = locations_df[is_local | ~has_local].dropna(subset=LOCATION_KEYS)
+
+    node_counts = locations_df.groupby(LOCATION_KEYS)["address"].count()
+    first_rows = locations_df.drop_duplicates(LOCATION_KEYS).set_index(LOCATION_KEYS)[
+        ["lat", "lon"]
+    ]
+    locations = (
+        node_counts.rename("node_count").to_frame().join(first_rows).reset_index()
+    )
+    return locations.astype({key: str for key in LOCATION_KEYS + ["lat", "lon"]})
+
+
+def fingerprint_locations(locations: pd.DataFrame) -> str:
+    """
+    Digest of the output of aggregate_locations(), the same for the same rows in
+    any order.
+    """
+    columns = LOCATION_KEYS + ["node_count", "lat", "lon"]
+    rows = locations[columns].astype(str).sort_values(columns)
+    return hashlib.md5(
+        pd.util.hash_pandas_object(rows, index=False).to_numpy().tobytes()
+    ).hexdigest()
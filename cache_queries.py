@@ -0,0 +1,654 @@
+from typing import Dict, Iterator, List, Optional
+
+import pandas as pd
+from common.orm.repository import PoktInfoRepository
+from common.orm.schema import (
+    CacheSetNode,
+    CacheSetStateRangeEntry,
+    ErrorsCache,
+    LatencyCache,
+    LocationCacheSet,
+    RewardsInfo,
+)
+from sqlalchemy import (
+    Integer,
+    String,
+    any_,
+    bindparam,
+    distinct,
+    func,
+    or_,
+    select,
+    text,
+)
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.orm import Session
+
+from cache_aggregations import (
+    ERRORS_COLUMNS,
+    LATENCY_COLUMNS,
+    LOCATION_KEYS,
+    REWARDS_COLUMNS,
+)
+from definitions import (
+    ADDRESS_FILTER_MODE,
+    ERROR_GROUPS,
+    LATENCY_SUMS,
+    STREAM_READ_CHUNK,
+)
+
+CACHE_SET_NODE_COLUMNS = ["address", "start_height", "end_height"]
+# rewards_info columns of the REWARDS_COLUMNS named differently in the table
+REWARDS_INFO_COLUMNS = {"rewards": "reward", "chain": "chain_id"}
+# Process local copy of error_group, ids never change once a group is interned
+error_group_ids: Dict[str, int] = {}
+# latency_cache_set sums of the roll-up, the stored sums with LATENCY_SUMS
+# (scripts/add_latency_sums.sql fills them for older rows), otherwise rebuilt
+# from the averages like sum_latency() does
+if LATENCY_SUMS:
+    LATENCY_ROLLUP_SUMS = {
+        "latency_sum": "CAST(SUM(latency_sum) AS float8)",
+        "p90_latency_sum": "CAST(SUM(p90_latency_sum) AS float8)",
+        "weighted_latency_sum": "CAST(SUM(weighted_latency_sum) AS float8)",
+    }
+else:
+    LATENCY_ROLLUP_SUMS = {
+        "latency_sum": "CAST(SUM(avg_latency * total_relays) AS float8)",
+        "p90_latency_sum": "CAST(SUM(avg_p90_latency * total_relays) AS float8)",
+        "weighted_latency_sum": (
+            "CAST(SUM(avg_weighted_latency * total_relays) AS float8)"
+        ),
+    }
+# cache set table -> (keys, summed columns) of the roll-up of its rows, latency
+# is summed relay weighted like sum_latency()
+ROLLUP_COLUMNS = {
+    "rewards_cache_set": (
+        ["chain"],
+        {
+            "rewards_total": "CAST(SUM(rewards_total) AS float8)",
+            "normalized_rewards_total": "CAST(SUM(normalized_rewards_total) AS float8)",
+            "relays_total": "CAST(SUM(relays_total) AS bigint)",
+        },
+    ),
+    "latency_cache_set": (
+        ["region", "chain"],
+        {
+            "total_relays": "CAST(SUM(total_relays) AS bigint)",
+            **LATENCY_ROLLUP_SUMS,
+        },
+    ),
+    "errors_cache_set": (
+        ["chain", "msg"],
+        {"errors_count": "CAST(SUM(errors_count) AS bigint)"},
+    ),
+}
+
+"""
+Queries used by the cache service on top of the ones in PoktInfoRepository,
+results are returned as DataFrames instead of ORM objects.
+"""
+
+
+def get_address_filter(
+    column,
+    addresses: List[str],
+    cache_set_ids: Optional[List[int]] = None,
+    mode: str = None,
+    height: Optional[int] = None,
+):
+    """
+    Filter of column on the addresses of the cache sets, mode defaults to
+    ADDRESS_FILTER_MODE. "in" inlines addresses as IN (...), "any" binds them
+    as one array parameter and "join" semi-joins the members of cache_set_ids
+    at height (the current ones if None) from cache_set_node, like
+    address_cache.get_cache_set_addresses(), no address is sent at all.
+    """
+    mode = mode if mode is not None else ADDRESS_FILTER_MODE
+    if mode == "any":
+        return column == any_(bindparam("addresses", addresses, type_=ARRAY(String)))
+    if mode == "join":
+        if cache_set_ids is None:
+            raise ValueError("The join address filter needs the cache_set_ids")
+        members = select(CacheSetNode.address).where(
+            CacheSetNode.cache_set_id
+            == any_(bindparam("cache_set_ids", cache_set_ids, type_=ARRAY(Integer)))
+        )
+        if height is None:
+            members = members.where(CacheSetNode.end_height.is_(None))
+        else:
+            members = members.where(
+                or_(
+                    CacheSetNode.start_height.is_(None),
+                    CacheSetNode.start_height <= height,
+                ),
+                or_(
+                    CacheSetNode.end_height.is_(None), CacheSetNode.end_height > height
+                ),
+            )
+        return column.in_(members)
+    return column.in_(addresses)
+
+
+def get_rewards_frame(
+    session: Session,
+    from_height: int,
+    to_height: int,
+    addresses: List[str],
+    cache_set_ids: Optional[List[int]] = None,
+    mode: str = None,
+) -> pd.DataFrame:
+    """
+    rewards_info rows of the addresses, PoktInfoRepository.get_rewards_info()
+    with the address filter of mode.
+    """
+    mode = mode if mode is not None else ADDRESS_FILTER_MODE
+    if mode == "in":
+        rewards_info = PoktInfoRepository.get_rewards_info(
+            session, from_height, to_height, addresses
+        )
+    else:
+        rewards_info = session.query(RewardsInfo).filter(
+            RewardsInfo.height >= from_height,
+            RewardsInfo.height < to_height,
+            get_address_filter(
+                RewardsInfo.address, addresses, cache_set_ids, mode, from_height
+            ),
+        )
+    return pd.DataFrame(
+        data=[reward.__to_dict__() for reward in rewards_info],
+        columns=REWARDS_COLUMNS,
+    )
+
+
+def get_latency_frame(
+    session: Session,
+    from_height: int,
+    to_height: int,
+    addresses: List[str],
+    cache_set_ids: Optional[List[int]] = None,
+    mode: str = None,
+) -> pd.DataFrame:
+    """
+    latency_cache rows of the addresses, PoktInfoRepository.get_latency_cache()
+    with the address filter of mode.
+    """
+    mode = mode if mode is not None else ADDRESS_FILTER_MODE
+    if mode == "in":
+        latency_cache = PoktInfoRepository.get_latency_cache(
+            session, from_height, to_height, addresses
+        )
+    else:
+        latency_cache = session.query(LatencyCache).filter(
+            LatencyCache.start_height >= from_height,
+            # Implied by end_height <= to_height, bounds the partitions scanned
+            LatencyCache.start_height < to_height,
+            LatencyCache.end_height <= to_height,
+            get_address_filter(
+                LatencyCache.address, addresses, cache_set_ids, mode, from_height
+            ),
+        )
+    return pd.DataFrame(
+        data=[latency.__to_dict__() for latency in latency_cache],
+        columns=LATENCY_COLUMNS,
+    )
+
+
+def stream_frames(
+    session: Session, query, columns: List[str], chunk_rows: int
+) -> Iterator[pd.DataFrame]:
+    """
+    Rows of query in frames of chunk_rows through a server side cursor, rows are
+    fetched as plain tuples.
+    """
+    query = query.execution_options(stream_results=True)
+    for rows in session.execute(query).partitions(chunk_rows):
+        yield pd.DataFrame(rows, columns=columns)
+
+
+def stream_rewards(
+    session: Session,
+    from_height: int,
+    to_height: int,
+    addresses: List[str],
+    cache_set_ids: Optional[List[int]] = None,
+    mode: str = None,
+    chunk_rows: int = None,
+) -> Iterator[pd.DataFrame]:
+    """
+    get_rewards_frame() in frames of chunk_rows (STREAM_READ_CHUNK), without
+    ORM objects.
+    """
+    table = RewardsInfo.__table__
+    query = select(
+        *[
+            table.c[REWARDS_INFO_COLUMNS.get(column, column)]
+            for column in REWARDS_COLUMNS
+        ]
+    ).where(
+        table.c.height >= from_height,
+        table.c.height < to_height,
+        get_address_filter(
+            table.c.address, addresses, cache_set_ids, mode, from_height
+        ),
+    )
+    chunk_rows = chunk_rows if chunk_rows is not None else STREAM_READ_CHUNK
+    return stream_frames(session, query, REWARDS_COLUMNS, chunk_rows)
+
+
+def stream_latency(
+    session: Session,
+    from_height: int,
+    to_height: int,
+    addresses: List[str],
+    cache_set_ids: Optional[List[int]] = None,
+    mode: str = None,
+    chunk_rows: int = None,
+) -> Iterator[pd.DataFrame]:
+    """
+    get_latency_frame() in frames of chunk_rows (STREAM_READ_CHUNK), without
+    ORM objects.
+    """
+    table = LatencyCache.__table__
+    query = select(*[table.c[column] for column in LATENCY_COLUMNS]).where(
+        table.c.start_height >= from_height,
+        table.c.start_height < to_height,
+        table.c.end_height <= to_height,
+        get_address_filter(
+            table.c.address, addresses, cache_set_ids, mode, from_height
+        ),
+    )
+    chunk_rows = chunk_rows if chunk_rows is not None else STREAM_READ_CHUNK
+    return stream_frames(session, query, LATENCY_COLUMNS, chunk_rows)
+
+
+def get_rewards_chunks(
+    session: Session,
+    from_height: int,
+    to_height: int,
+    addresses: List[str],
+    cache_set_ids: Optional[List[int]] = None,
+) -> Iterator[pd.DataFrame]:
+    """
+    rewards_info rows of the addresses, streamed in chunks with
+    STREAM_READ_CHUNK or else the whole window as one frame.
+    """
+    if STREAM_READ_CHUNK:
+        return stream_rewards(session, from_height, to_height, addresses, cache_set_ids)
+    return iter(
+        [get_rewards_frame(session, from_height, to_height, addresses, cache_set_ids)]
+    )
+
+
+def get_latency_chunks(
+    session: Session,
+    from_height: int,
+    to_height: int,
+    addresses: List[str],
+    cache_set_ids: Optional[List[int]] = None,
+) -> Iterator[pd.DataFrame]:
+    """
+    latency_cache rows of the addresses, like get_rewards_chunks().
+    """
+    if STREAM_READ_CHUNK:
+        return stream_latency(session, from_height, to_height, addresses, cache_set_ids)
+    return iter(
+        [get_latency_frame(session, from_height, to_height, addresses, cache_set_ids)]
+    )
+
+
+def get_errors_counts(
+    session: Session,
+    from_height: int,
+    to_height: int,
+    addresses: List[str],
+    cache_set_ids: Optional[List[int]] = None,
+    mode: str = None,
+) -> pd.DataFrame:
+    """
+    (errors_count, chain, msg) of the addresses, PoktInfoRepository.get_errors_dict()
+    with the address filter of mode.
+    """
+    mode = mode if mode is not None else ADDRESS_FILTER_MODE
+    if mode == "in":
+        errors_dict = PoktInfoRepository.get_errors_dict(
+            session, from_height, to_height, addresses
+        )
+    else:
+        errors_dict = (
+            session.query(
+                func.sum(ErrorsCache.errors_count), ErrorsCache.chain, ErrorsCache.msg
+            )
+            .filter(
+                ErrorsCache.start_height >= from_height,
+                ErrorsCache.start_height < to_height,
+                ErrorsCache.end_height <= to_height,
+                get_address_filter(
+                    ErrorsCache.provider, addresses, cache_set_ids, mode, from_height
+                ),
+            )
+            .group_by(ErrorsCache.chain, ErrorsCache.msg)
+            .all()
+        )
+    return pd.DataFrame(errors_dict, columns=["errors_count", "chain", "msg"])
+
+
+def get_errors_frame(
+    session: Session,
+    from_height: int,
+    to_height: int,
+    addresses: List[str],
+    cache_set_ids: Optional[List[int]] = None,
+    mode: str = None,
+) -> pd.DataFrame:
+    query = session.query(
+        ErrorsCache.provider,
+        ErrorsCache.errors_count,
+        ErrorsCache.chain,
+        ErrorsCache.msg,
+        ErrorsCache.start_height,
+        ErrorsCache.end_height,
+    ).filter(
+        ErrorsCache.start_height >= from_height,
+        # Implied by end_height <= to_height, bounds the partitions scanned
+        ErrorsCache.start_height < to_height,
+        ErrorsCache.end_height <= to_height,
+        get_address_filter(
+            ErrorsCache.provider, addresses, cache_set_ids, mode, from_height
+        ),
+    )
+    return pd.DataFrame(query.all(), columns=ERRORS_COLUMNS)
+
+
+def get_node_counts(
+    session: Session,
+    from_height: int,
+    to_height: int,
+    addresses: List[str],
+    cache_set_ids: Optional[List[int]] = None,
+    mode: str = None,
+) -> Dict[Optional[str], int]:
+    """
+    Number of nodes of every chain plus the total across chains (key None)
+    with a single ROLLUP query.
+    """
+    is_total = func.grouping(RewardsInfo.chain)
+    query = (
+        session.query(
+            RewardsInfo.chain, is_total, func.count(distinct(RewardsInfo.address))
+        )
+        .filter(
+            RewardsInfo.height >= from_height,
+            RewardsInfo.height < to_height,
+            get_address_filter(
+                RewardsInfo.address, addresses, cache_set_ids, mode, from_height
+            ),
+        )
+        .group_by(func.rollup(RewardsInfo.chain))
+    )
+    return {
+        None if total else chain: int(node_count)
+        for chain, total, node_count in query.all()
+    }
+
+
+def get_cache_set_nodes(session: Session, cache_set_id: int) -> pd.DataFrame:
+    query = session.query(
+        CacheSetNode.address, CacheSetNode.start_height, CacheSetNode.end_height
+    ).filter(CacheSetNode.cache_set_id == cache_set_id)
+    return pd.DataFrame(query.all(), columns=CACHE_SET_NODE_COLUMNS)
+
+
+def get_all_cache_set_nodes(session: Session) -> pd.DataFrame:
+    query = session.query(
+        CacheSetNode.cache_set_id,
+        CacheSetNode.address,
+        CacheSetNode.start_height,
+        CacheSetNode.end_height,
+    )
+    return pd.DataFrame(query.all(), columns=["cache_set_id"] + CACHE_SET_NODE_COLUMNS)
+
+
+def get_last_cached_heights(
+    session: Session, cache_set_ids: List[int], services: List[str], interval: int
+) -> Dict[tuple, int]:
+    """
+    (cache_set_id, service) -> end of the last window cached successfully, from
+    cache_set_state_range_entry so windows that wrote no rows count too.
+    """
+    query = (
+        session.query(
+            CacheSetStateRangeEntry.cache_set_id,
+            CacheSetStateRangeEntry.service,
+            func.max(CacheSetStateRangeEntry.end_height),
+        )
+        .filter(
+            CacheSetStateRangeEntry.cache_set_id.in_(cache_set_ids),
+            CacheSetStateRangeEntry.service.in_(services),
+            CacheSetStateRangeEntry.interval == interval,
+            CacheSetStateRangeEntry.status == "success",
+        )
+        .group_by(CacheSetStateRangeEntry.cache_set_id, CacheSetStateRangeEntry.service)
+    )
+    return {
+        (cache_set_id, service): end_height
+        for cache_set_id, service, end_height in query.all()
+    }
+
+
+def get_membership_version(session: Session) -> tuple:
+    """
+    Cheap fingerprint of cache_set_node, added and ended members change it.
+    """
+    return tuple(
+        session.query(
+            func.count(),
+            func.count(CacheSetNode.end_height),
+            func.max(CacheSetNode.start_height),
+            func.max(CacheSetNode.end_height),
+        ).one()
+    )
+
+
+def get_error_group_ids(
+    session: Session, msgs: List[str], first_seen_heights: List[int]
+) -> Dict[str, int]:
+    """
+    error_group ids of the normalized msgs, groups that don't exist yet are
+    created with their first_seen_height. Groups already in error_group_ids
+    are answered without a query.
+    """
+    missing = [
+        (msg, height)
+        for msg, height in zip(msgs, first_seen_heights)
+        if msg not in error_group_ids
+    ]
+    if missing:
+        params = {
+            "msgs": [msg for msg, _ in missing],
+            "heights": [int(height) for _, height in missing],
+        }
+        session.execute(
+            text(
+                "INSERT INTO public.error_group (msg, first_seen_height) "
+                "SELECT * FROM unnest("
+                "CAST(:msgs AS text[]), CAST(:heights AS integer[])) "
+                "ON CONFLICT ((md5(msg))) DO UPDATE "
+                "SET first_seen_height = EXCLUDED.first_seen_height "
+                "WHERE EXCLUDED.first_seen_height < error_group.first_seen_height"
+            ),
+            params,
+        )
+        rows = session.execute(
+            text(
+                "SELECT id, msg FROM public.error_group "
+                "WHERE md5(msg) IN (SELECT md5(unnest(CAST(:msgs AS text[]))))"
+            ),
+            params,
+        ).all()
+        session.commit()
+        error_group_ids.update({msg: error_group_id for error_group_id, msg in rows})
+    return {msg: error_group_ids[msg] for msg in msgs}
+
+
+def get_rollup_frame(
+    session: Session,
+    table_name: str,
+    cache_set_ids: List[int],
+    interval: int,
+    from_height: int,
+    to_height: int,
+) -> pd.DataFrame:
+    """
+    Sums of the interval rows of table_name between from_height and to_height
+    per cache set and keys, see ROLLUP_COLUMNS.
+    """
+    keys, sums = ROLLUP_COLUMNS[table_name]
+    keys = ["cache_set_id"] + keys
+    source = table_name
+    if ERROR_GROUPS and table_name == "errors_cache_set":
+        # Messages are interned, the view joins their text back
+        source = "errors_cache_set_msg"
+    columns = keys + [f"{expression} AS {name}" for name, expression in sums.items()]
+    rows = session.execute(
+        text(
+            f"SELECT {', '.join(columns)} FROM public.{source} "
+            f'WHERE "interval" = :interval '
+            "AND start_height >= :from_height AND end_height <= :to_height "
+            "AND cache_set_id = ANY(:cache_set_ids) "
+            f"GROUP BY {', '.join(keys)}"
+        ),
+        {
+            "interval": interval,
+            "from_height": from_height,
+            "to_height": to_height,
+            "cache_set_ids": list(cache_set_ids),
+        },
+    ).all()
+    return pd.DataFrame(rows, columns=keys + list(sums))
+
+
+def get_latency_sketches(
+    session: Session,
+    cache_set_ids: List[int],
+    interval: int,
+    from_height: int,
+    to_height: int,
+) -> pd.DataFrame:
+    """
+    p90 latency sketches of the interval rows of latency_cache_set between
+    from_height and to_height (LATENCY_SUMS).
+    """
+    rows = session.execute(
+        text(
+            "SELECT cache_set_id, region, chain, p90_latency_sketch "
+            "FROM public.latency_cache_set "
+            'WHERE "interval" = :interval '
+            "AND start_height >= :from_height AND end_height <= :to_height "
+            "AND cache_set_id = ANY(:cache_set_ids) "
+            "AND p90_latency_sketch IS NOT NULL"
+        ),
+        {
+            "interval": interval,
+            "from_height": from_height,
+            "to_height": to_height,
+            "cache_set_ids": list(cache_set_ids),
+        },
+    ).all()
+    return pd.DataFrame(
+        rows, columns=["cache_set_id", "region", "chain", "p90_latency_sketch"]
+    )
+
+
+def get_location_snapshot(
+    session: Session, cache_set_id: int, interval: int, height: int
+) -> pd.DataFrame:
+    """
+    Location rows of a set valid at height, rows are valid from their
+    start_height up to before their end_height. Pass height - 1 for the snapshot
+    ending at height.
+    """
+    columns = LOCATION_KEYS + ["node_count", "lat", "lon"]
+    query = session.query(
+        *[getattr(LocationCacheSet, column) for column in columns]
+    ).filter(
+        LocationCacheSet.cache_set_id == cache_set_id,
+        LocationCacheSet.interval == interval,
+        LocationCacheSet.end_height > height,
+        LocationCacheSet.start_height <= height,
+    )
+    return pd.DataFrame(query.all(), columns=columns)
+
+
+def extend_location_snapshot(
+    session: Session, cache_set_id: int, interval: int, from_height: int, to_height: int
+) -> int:
+    """
+    Move the end_height of the snapshot of a set ending at from_height to
+    to_height, returns the number of rows extended.
+    """
+    return (
+        session.query(LocationCacheSet)
+        .filter(
+            LocationCacheSet.cache_set_id == cache_set_id,
+            LocationCacheSet.interval == interval,
+            LocationCacheSet.end_height == from_height,
+        )
+        .update({LocationCacheSet.end_height: to_height}, synchronize_session=False)
+    )
+
+
+def clear_location_range(
+    session: Session, cache_set_id: int, interval: int, from_height: int, to_height: int
+) -> None:
+    """
+    Clip the location rows of a set out of [from_height, to_height) before a
+    new snapshot is saved there (retried or overlapping windows). Rows crossing
+    the range keep their parts before and after it, rows inside it are removed.
+    Not committed, the save of the new snapshot commits it.
+    """
+    params = {
+        "cache_set_id": cache_set_id,
+        "interval": interval,
+        "from_height": from_height,
+        "to_height": to_height,
+    }
+    is_set = 'cache_set_id = :cache_set_id AND "interval" = :interval'
+    columns = ", ".join(
+        ["cache_set_id", '"interval"', "node_count", "lat", "lon"] + LOCATION_KEYS
+    )
+    # Part after the range of the rows covering all of it
+    session.execute(
+        text(
+            "INSERT INTO public.location_cache_set "
+            f"({columns}, start_height, end_height) "
+            f"SELECT {columns}, :to_height, end_height "
+            "FROM public.location_cache_set "
+            f"WHERE {is_set} AND start_height < :from_height "
+            "AND end_height > :to_height"
+        ),
+        params,
+    )
+    session.execute(
+        text(
+            f"UPDATE public.location_cache_set SET start_height = :to_height "
+            f"WHERE {is_set} AND start_height >= :from_height "
+            "AND start_height < :to_height AND end_height > :to_height"
+        ),
+        params,
+    )
+    session.execute(
+        text(
+            f"UPDATE public.location_cache_set SET end_height = :from_height "
+            f"WHERE {is_set} AND start_height < :from_height "
+            "AND end_height > :from_height"
+        ),
+        params,
+    )
+    session.execute(
+        text(
+            f"DELETE FROM public.location_cache_set "
+            f"WHERE {is_set} AND start_height >= :from_height "
+            "AND start_height < :to_height"
+        ),
+        params,
+    )
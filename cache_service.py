@@ -1,4 +1,3 @@
-import ast
 import typing
 from concurrent.futures import ProcessPoolExecutor as Pool, as_completed
 from typing import List
@@ -22,18 +21,47 @@ from common.orm.schema import (
     RewardsInfo,
     ErrorsCache,
 )
-from common.utils import get_last_block_height, POKT_MULTIPLIER, get_param
+from common.utils import get_last_block_height
 from sqlalchemy.orm import Session
 
-from definitions import IS_TEST, LOOK_BACK, get_blocks_interval, STUCK_TOLERANCE
-from error_grouping import create_msg_groups
+from address_cache import get_cache_set_addresses, invalidate_cache_set_addresses
+from cache_aggregations import (
+    LOCATION_COLUMNS,
+    aggregate_locations,
+    fingerprint_locations,
+    assign_windows,
+    assign_source_windows,
+    fold_rewards,
+    fold_latency,
+    finalize_latency,
+)
+from bulk_writer import CACHE_SET_COLUMNS, save_cache_sets
+from cache_queries import (
+    clear_location_range,
+    extend_location_snapshot,
+    get_errors_counts,
+    get_errors_frame,
+    get_latency_chunks,
+    get_location_snapshot,
+    get_node_counts,
+    get_rewards_chunks,
+)
+from definitions import (
+    HISTORICAL_IN_SERVICE,
+    IS_TEST,
+    LOCATION_SNAPSHOTS,
+    LOOK_BACK,
+    RANGED_BACKFILL,
+    get_blocks_interval,
+    STUCK_TOLERANCE,
+)
+from error_grouping import create_msg_groups_frame
 from loggers import logger, perf_logger, stuck_logger
+from param_cache import get_supported_chains
 
-CONTINENT_MAP = {
-    "North America": "na",
-    "Europe": "eu",
-    "Asia": "sg",
-}
+# (cache_set_id, interval) -> (end_height, fingerprint) of the last location
+# snapshot saved by this process
+location_fingerprints: typing.Dict[typing.Tuple[int, int], typing.Tuple[int, str]] = {}
 
 
 def add_state_range(
@@ -43,6 +71,7 @@ def add_state_range(
     end_height: int,
     has_added: bool,
     cache_set_id: int,
+    interval: int = None,
 ):
     if not has_added:
         logger.error(f"Failed adding {service, start_height, end_height, cache_set_id}")
@@ -54,70 +83,44 @@ def add_state_range(
         start_height=start_height,
         end_height=end_height,
         status=status,
-        interval=get_blocks_interval(),
+        interval=interval if interval is not None else get_blocks_interval(),
     )
     PoktInfoRepository.upsert(session, cache_set_state_range)
 
 
 def cache_rewards(
-    session: Session, cache_set_id: int, from_height: int, to_height: int
+    session: Session,
+    cache_set_id: int,
+    from_height: int,
+    to_height: int,
+    check_synced: bool = True,
 ):
     now = pd.Timestamp.now()
     perf_logger.info(f"Caching rewards for {cache_set_id, from_height, to_height}")
 
-    if not PoktInfoRepository.does_height_exist(session, to_height, RewardsInfo):
+    if check_synced and not PoktInfoRepository.does_height_exist(
+        session, to_height, RewardsInfo
+    ):
         logger.info(
-            f"Skipping rewards cache for, rewards not synced yet {from_height, to_height}"
+            "Skipping rewards cache for, rewards not synced yet "
+            f"{from_height, to_height}"
         )
         return
 
-    addresses = PoktInfoRepository.get_cache_set_addresses(session, cache_set_id)
-    rewards_info = PoktInfoRepository.get_rewards_info(
-        session, from_height, to_height, addresses
-    )
-    rewards_info = [reward.__to_dict__() for reward in rewards_info]
-    rewards_df = pd.DataFrame(
-        data=rewards_info,
-        columns=[
-            "height",
-            "address",
-            "rewards",
-            "chain",
-            "relays",
-            "token_multiplier",
-            "percentage",
-            "stake_weight",
-        ],
+    addresses = get_cache_set_addresses(session, cache_set_id, from_height)
+    rewards_chunks = get_rewards_chunks(
+        session, from_height, to_height, addresses, [cache_set_id]
     )
 
-    rewards_cache_sets = []
-    chain_groups = rewards_df.groupby([rewards_df["chain"]])
-    for chain, group in chain_groups:
-        rewards_total = group["rewards"].sum()
-        relays_total = group["relays"].sum()
-        normalized_rewards_total = (
-            PoktInfoRepository.get_rewards_total_per15k(
-                session, from_height, to_height, addresses, chain=str(chain)
-            )
-            / POKT_MULTIPLIER
-        )
-        rewards_total /= POKT_MULTIPLIER
-        rewards_cache_sets.append(
-            RewardsCacheSet(
-                cache_set_id=cache_set_id,
-                rewards_total=float(rewards_total),
-                normalized_rewards_total=float(normalized_rewards_total),
-                relays_total=int(relays_total),
-                chain=str(chain),
-                start_height=int(from_height),
-                end_height=int(to_height),
-                interval=int(get_blocks_interval()),
-            )
-        )
-
-    has_added = PoktInfoRepository.save_many(session, rewards_cache_sets)
+    # Per 15k normalized totals come from the loaded rows, see
+    # scripts/verify_rewards_parity.py for the check against get_rewards_total_per15k
+    totals = fold_rewards(rewards_chunks, ["chain"]).assign(
+        cache_set_id=cache_set_id, start_height=from_height, end_height=to_height
+    )
+    has_added = save_cache_sets(session, RewardsCacheSet, totals)
     print(
-        f"Added rewards: {has_added}, {len(rewards_cache_sets), from_height, to_height, get_blocks_interval()}"
+        f"Added rewards: {has_added}, "
+        f"{len(totals), from_height, to_height, get_blocks_interval()}"
     )
     add_state_range(
         session, "rewards_cache_set", from_height, to_height, has_added, cache_set_id
@@ -129,83 +132,39 @@ def cache_rewards(
 
 
 def cache_latency(
-    session: Session, cache_set_id: int, from_height: int, to_height: int
+    session: Session,
+    cache_set_id: int,
+    from_height: int,
+    to_height: int,
+    check_synced: bool = True,
 ):
     now = pd.Timestamp.now()
     perf_logger.info(
-        f"Caching latency for {cache_set_id, from_height, to_height, get_blocks_interval()}"
+        "Caching latency for "
+        f"{cache_set_id, from_height, to_height, get_blocks_interval()}"
     )
 
-    if not PoktInfoRepository.does_height_exist(
+    if check_synced and not PoktInfoRepository.does_height_exist(
         session,
         to_height,
         LatencyCache,
         is_range=True,
     ):
         logger.info(
-            f"Skipping latency cache for, latency not synced yet {from_height, to_height}"
+            "Skipping latency cache for, latency not synced yet "
+            f"{from_height, to_height}"
         )
         return
 
-    addresses = PoktInfoRepository.get_cache_set_addresses(session, cache_set_id)
-    latency_cache = PoktInfoRepository.get_latency_cache(
-        session, from_height, to_height, addresses
-    )
-    latency_cache = [latency.__to_dict__() for latency in latency_cache]
-    latency_df = pd.DataFrame(
-        data=latency_cache,
-        columns=[
-            "address",
-            "total_relays",
-            "region",
-            "start_height",
-            "end_height",
-            "avg_latency",
-            "avg_p90_latency",
-            "avg_weighted_latency",
-            "chain",
-        ],
+    addresses = get_cache_set_addresses(session, cache_set_id, from_height)
+    latency_chunks = get_latency_chunks(
+        session, from_height, to_height, addresses, [cache_set_id]
     )
-    region_groups = latency_df.groupby([latency_df["region"]])
-    latency_sets = []
-    for name, group in region_groups:
-        region = str(name)
-        chain_groups = group.groupby([group["chain"]])
-        for chain, chain_group in chain_groups:
-            chain = str(chain)
-            total_relays = chain_group["total_relays"].sum()
-            if total_relays > 0:
-                avg_latency = float(
-                    (chain_group["avg_latency"] * chain_group["total_relays"]).sum()
-                    / total_relays
-                )
-                avg_weighted_latency = float(
-                    (
-                        chain_group["avg_weighted_latency"]
-                        * chain_group["total_relays"]
-                    ).sum()
-                    / total_relays
-                )
-                avg_p90_latency = float(
-                    (chain_group["avg_p90_latency"] * chain_group["total_relays"]).sum()
-                    / total_relays
-                )
-                latency_sets.append(
-                    LatencyCacheSet(
-                        cache_set_id=cache_set_id,
-                        total_relays=int(total_relays),
-                        region=region,
-                        chain=chain,
-                        avg_latency=float(avg_latency),
-                        avg_p90_latency=float(avg_p90_latency),
-                        avg_weighted_latency=float(avg_weighted_latency),
-                        start_height=int(from_height),
-                        end_height=int(to_height),
-                        interval=int(get_blocks_interval()),
-                    )
-                )
-    has_added = PoktInfoRepository.save_many(session, latency_sets)
-    print(f"Added latency: {has_added}, {len(latency_sets), from_height, to_height}")
+    averages = finalize_latency(
+        fold_latency(latency_chunks, ["region", "chain"])
+    ).assign(cache_set_id=cache_set_id, start_height=from_height, end_height=to_height)
+    has_added = save_cache_sets(session, LatencyCacheSet, averages)
+    print(f"Added latency: {has_added}, {len(averages), from_height, to_height}")
     add_state_range(
         session,
         "latency_cache_set",
@@ -220,13 +179,20 @@ def cache_latency(
     )
 
 
-def cache_errors(session: Session, cache_set_id: int, from_height: int, to_height: int):
+def cache_errors(
+    session: Session,
+    cache_set_id: int,
+    from_height: int,
+    to_height: int,
+    check_synced: bool = True,
+):
     now = pd.Timestamp.now()
     perf_logger.info(
-        f"Caching errors for {cache_set_id, from_height, to_height, get_blocks_interval()}"
+        "Caching errors for "
+        f"{cache_set_id, from_height, to_height, get_blocks_interval()}"
     )
 
-    if not PoktInfoRepository.does_height_exist(
+    if check_synced and not PoktInfoRepository.does_height_exist(
         session,
         to_height,
         ErrorsCache,
@@ -237,29 +203,16 @@ def cache_errors(session: Session, cache_set_id: int, from_height: int, to_heigh
         )
         return
 
-    addresses = PoktInfoRepository.get_cache_set_addresses(session, cache_set_id)
-    errors_dict = PoktInfoRepository.get_errors_dict(
-        session, from_height, to_height, addresses
-    )
-    if errors_dict:
-        error_sets = []
-        chain_msg_groups = create_msg_groups(errors_dict)
-        for chain in chain_msg_groups:
-            for msg in chain_msg_groups[chain]:
-                errors_count = chain_msg_groups[chain][msg]
-                error_sets.append(
-                    ErrorsCacheSet(
-                        cache_set_id=cache_set_id,
-                        errors_count=int(errors_count),
-                        msg=msg,
-                        start_height=from_height,
-                        end_height=to_height,
-                        chain=chain,
-                        interval=get_blocks_interval(),
-                    )
-                )
-        has_added = PoktInfoRepository.save_many(session, error_sets)
-        print(f"Added errors: {has_added}, {len(error_sets), from_height, to_height}")
+    addresses = get_cache_set_addresses(session, cache_set_id, from_height)
+    errors_df = get_errors_counts(
+        session, from_height, to_height, addresses, [cache_set_id]
+    )
+    if not errors_df.empty:
+        totals = create_msg_groups_frame(errors_df).assign(
+            cache_set_id=cache_set_id, start_height=from_height, end_height=to_height
+        )
+        has_added = save_cache_sets(session, ErrorsCacheSet, totals)
+        print(f"Added errors: {has_added}, {len(totals), from_height, to_height}")
         add_state_range(
             session, "errors_cache_set", from_height, to_height, has_added, cache_set_id
         )
@@ -268,6 +221,10 @@ def cache_errors(session: Session, cache_set_id: int, from_height: int, to_heigh
             f"{cache_set_id, from_height, to_height}, took {pd.Timestamp.now() - now}"
         )
     else:
+        # Nothing to write, recorded so the window isn't planned again
+        add_state_range(
+            session, "errors_cache_set", from_height, to_height, True, cache_set_id
+        )
         perf_logger.info(
             f"Skipped caching errors for "
             f"{cache_set_id, from_height, to_height}, took {pd.Timestamp.now() - now}"
@@ -279,47 +236,27 @@ def cache_node_count(
 ):
     now = pd.Timestamp.now()
     perf_logger.info(
-        f"Caching node count for {cache_set_id, from_height, to_height, get_blocks_interval()}"
+        "Caching node count for "
+        f"{cache_set_id, from_height, to_height, get_blocks_interval()}"
     )
 
-    node_cache_sets = []
-    chains = get_param(from_height, "pocketcore/SupportedBlockchains")
-    chains = ast.literal_eval(chains)
-    addresses = PoktInfoRepository.get_cache_set_addresses(session, cache_set_id)
+    chains = get_supported_chains(from_height)
+    addresses = get_cache_set_addresses(session, cache_set_id, from_height)
 
-    node_count = PoktInfoRepository.get_node_count(
-        session, from_height, to_height, addresses
+    node_counts = get_node_counts(
+        session, from_height, to_height, addresses, [cache_set_id]
     )
-    if node_count is None or node_count < 0:
-        node_count = 0
-    node_cache_sets.append(
-        NodeCountCacheSet(
-            cache_set_id=cache_set_id,
-            node_count=int(node_count),
-            chain=None,
-            start_height=from_height,
-            end_height=to_height,
-            interval=get_blocks_interval(),
-        )
-    )
-
-    for chain in chains:
-        node_count = PoktInfoRepository.get_node_count(
-            session, from_height, to_height, addresses, chain=chain
-        )
-        if node_count > 0:
-            node_cache_sets.append(
-                NodeCountCacheSet(
-                    cache_set_id=cache_set_id,
-                    node_count=int(node_count),
-                    chain=chain,
-                    start_height=from_height,
-                    end_height=to_height,
-                    interval=get_blocks_interval(),
-                )
-            )
+    node_counts_df = pd.DataFrame(
+        [(None, max(node_counts.get(None, 0), 0))]
+        + [
+            (chain, node_counts[chain])
+            for chain in chains
+            if node_counts.get(chain, 0) > 0
+        ],
+        columns=["chain", "node_count"],
+    ).assign(cache_set_id=cache_set_id, start_height=from_height, end_height=to_height)
 
-    has_added = PoktInfoRepository.save_many(session, node_cache_sets)
+    has_added = save_cache_sets(session, NodeCountCacheSet, node_counts_df)
     add_state_range(
         session, "node_count_cache_set", from_height, to_height, has_added, cache_set_id
     )
@@ -334,76 +271,26 @@ def cache_locations(
 ):
     now = pd.Timestamp.now()
     perf_logger.info(
-        f"Caching locations for {cache_set_id, from_height, to_height, get_blocks_interval()}"
+        "Caching locations for "
+        f"{cache_set_id, from_height, to_height, get_blocks_interval()}"
     )
 
-    addresses = PoktInfoRepository.get_cache_set_addresses(session, cache_set_id)
+    addresses = get_cache_set_addresses(session, cache_set_id, from_height)
     locations_dict = PoktInfoRepository.get_locations_dict(session, addresses)
     locations_dict = [location.__to_dict__() for location in locations_dict]
-    locations_df = pd.DataFrame(
-        data=locations_dict,
-        columns=[
-            "id",
-            "address",
-            "ip",
-            "height",
-            "start_height",
-            "end_height",
-            "city",
-            "continent",
-            "country",
-            "region",
-            "lat",
-            "lon",
-            "isp",
-            "org",
-            "as_",
-            "date_created",
-            "ran_from",
-        ],
-    )
-    location_cache_sets = []
-    continent_groups = locations_df.groupby([locations_df["continent"]])
-    for continent, continent_group in continent_groups:
-        country_groups = continent_group.groupby([continent_group["country"]])
-        for country, country_group in country_groups:
-            city_groups = country_group.groupby([country_group["city"]])
-            for city, city_group in city_groups:
-                ip_groups = city_group.groupby([city_group["ip"]])
-                for ip, ip_group in ip_groups:
-                    ran_froms = ip_group["ran_from"].tolist()
-                    # Filter out duplicate ips from different locations
-                    # (e.g. sg & na = ip & continent = na -> remove sg)
-                    for ran_from in ran_froms:
-                        continent_id = (
-                            CONTINENT_MAP[continent]
-                            if continent in CONTINENT_MAP
-                            else "na"
-                        )
-                        if continent_id == ran_from:
-                            ip_group = ip_group[ip_group["ran_from"] == ran_from]
-
-                    isp_groups = ip_group.groupby([ip_group["isp"]])
-                    for isp, isp_group in isp_groups:
-                        node_count = isp_group["address"].count()
-                        lat, lon = isp_group["lat"].iloc[0], isp_group["lon"].iloc[0]
-                        location_cache_sets.append(
-                            LocationCacheSet(
-                                cache_set_id=cache_set_id,
-                                node_count=int(node_count),
-                                continent=str(continent),
-                                country=str(country),
-                                city=str(city),
-                                ip=str(ip),
-                                isp=str(isp),
-                                lat=str(lat),
-                                lon=str(lon),
-                                start_height=from_height,
-                                end_height=to_height,
-                                interval=get_blocks_interval(),
-                            )
-                        )
-    has_added = PoktInfoRepository.save_many(session, location_cache_sets)
+    locations_df = pd.DataFrame(data=locations_dict, columns=LOCATION_COLUMNS)
+    location_cache_sets = aggregate_locations(locations_df).assign(
+        cache_set_id=cache_set_id,
+        start_height=from_height,
+        end_height=to_height,
+        interval=get_blocks_interval(),
+    )[CACHE_SET_COLUMNS[LocationCacheSet]]
+    if LOCATION_SNAPSHOTS:
+        has_added = save_location_snapshot(
+            session, cache_set_id, location_cache_sets, from_height, to_height
+        )
+    else:
+        has_added = save_cache_sets(session, LocationCacheSet, location_cache_sets)
     add_state_range(
         session, "location_cache_set", from_height, to_height, has_added, cache_set_id
     )
@@ -413,6 +300,55 @@ def cache_locations(
     )
 
 
+def save_location_snapshot(
+    session: Session,
+    cache_set_id: int,
+    locations: pd.DataFrame,
+    from_height: int,
+    to_height: int,
+) -> bool:
+    """
+    Extend the location snapshot of the set ending at from_height up to
+    to_height if the locations didn't change, save them as a new snapshot
+    otherwise.
+    """
+    key = (cache_set_id, get_blocks_interval())
+    fingerprint = fingerprint_locations(locations)
+    last_height, last_fingerprint = location_fingerprints.get(key, (None, None))
+    # Whether this process saved the snapshot ending at from_height itself
+    is_next_window = last_height == from_height
+    if not is_next_window:
+        last_fingerprint = fingerprint_locations(
+            get_location_snapshot(
+                session, cache_set_id, get_blocks_interval(), from_height - 1
+            )
+        )
+
+    try:
+        if not is_next_window:
+            # Retried or overlapping windows can be covered by rows extended
+            # past from_height already, they are clipped to end at from_height
+            clear_location_range(
+                session, cache_set_id, get_blocks_interval(), from_height, to_height
+            )
+        if fingerprint != last_fingerprint:
+            # Commits the clipping with the rows
+            has_added = save_cache_sets(session, LocationCacheSet, locations)
+        else:
+            extend_location_snapshot(
+                session, cache_set_id, get_blocks_interval(), from_height, to_height
+            )
+            session.commit()
+            has_added = True
+    except Exception as e:
+        session.rollback()
+        logger.error(f"Failed saving locations of {cache_set_id} to {to_height}, {e}")
+        has_added = False
+    if has_added:
+        location_fingerprints[key] = (to_height, fingerprint)
+    return has_added
+
+
 def create_cache_set(
     user_id: int,
     set_name: str,
@@ -446,6 +382,7 @@ def create_cache_set(
                     )
                 )
             PoktInfoRepository.save_many(session, nodes)
+            invalidate_cache_set_addresses(cache_set_id)
     return has_added
 
 
@@ -468,32 +405,166 @@ def update_cache_set_addresses(
                 )
             )
         PoktInfoRepository.save_many(session, nodes)
+    invalidate_cache_set_addresses(cache_set_id)
 
 
-def create_service_cache(func, cache_set_id: int) -> None:
+def get_backfill_heights() -> List[int]:
     last_height = get_last_block_height()
     from_height = last_height - LOOK_BACK
     # Force start_block to be divisible by get_blocks_interval()
     leftover = from_height % get_blocks_interval() if not IS_TEST else 0
-    with ConnFactory.poktinfo_conn() as session:
-        for height in range(
+    return list(
+        range(
             from_height - leftover,
             last_height - get_blocks_interval(),
             get_blocks_interval(),
-        ):
+        )
+    )
+
+
+def create_service_cache(func, cache_set_id: int) -> None:
+    with ConnFactory.poktinfo_conn() as session:
+        for height in get_backfill_heights():
             func(session, cache_set_id, height, height + get_blocks_interval())
 
 
+def get_synced_heights(
+    session: Session,
+    heights: List[int],
+    table_obj: typing.Type[PoktInfoBase],
+    is_range: bool = False,
+) -> List[int]:
+    """
+    Drop the trailing interval start heights whose end isn't synced yet.
+    """
+    heights = list(heights)
+    while heights and not PoktInfoRepository.does_height_exist(
+        session, heights[-1] + get_blocks_interval(), table_obj, is_range=is_range
+    ):
+        heights.pop()
+    return heights
+
+
+def save_backfill(
+    session: Session,
+    table_obj: typing.Type[PoktInfoBase],
+    cache_set_id: int,
+    frame: pd.DataFrame,
+    heights: List[int],
+) -> None:
+    service = table_obj.__tablename__
+    has_added = save_cache_sets(session, table_obj, frame) if len(frame) else True
+    logger.info(f"Added {service}: {has_added}, {len(frame), len(heights)} intervals")
+    for height in heights:
+        add_state_range(
+            session,
+            service,
+            height,
+            height + get_blocks_interval(),
+            has_added,
+            cache_set_id,
+        )
+
+
+def backfill_rewards(session: Session, cache_set_id: int, heights: List[int]) -> None:
+    heights = get_synced_heights(session, heights, RewardsInfo)
+    if not heights:
+        return
+    from_height, to_height = heights[0], heights[-1] + get_blocks_interval()
+
+    addresses = get_cache_set_addresses(session, cache_set_id, from_height)
+    rewards_chunks = (
+        assign_windows(chunk, chunk["height"], from_height, get_blocks_interval())
+        for chunk in get_rewards_chunks(
+            session, from_height, to_height, addresses, [cache_set_id]
+        )
+    )
+    totals = fold_rewards(rewards_chunks, ["start_height", "end_height", "chain"])
+    totals = totals.assign(cache_set_id=cache_set_id)
+    save_backfill(
+        session,
+        RewardsCacheSet,
+        cache_set_id,
+        totals,
+        heights,
+    )
+
+
+def backfill_latency(session: Session, cache_set_id: int, heights: List[int]) -> None:
+    heights = get_synced_heights(session, heights, LatencyCache, is_range=True)
+    if not heights:
+        return
+    from_height, to_height = heights[0], heights[-1] + get_blocks_interval()
+
+    addresses = get_cache_set_addresses(session, cache_set_id, from_height)
+    latency_chunks = (
+        assign_source_windows(chunk, from_height, get_blocks_interval())
+        for chunk in get_latency_chunks(
+            session, from_height, to_height, addresses, [cache_set_id]
+        )
+    )
+    averages = finalize_latency(
+        fold_latency(latency_chunks, ["start_height", "end_height", "region", "chain"])
+    )
+    averages = averages.assign(cache_set_id=cache_set_id)
+    save_backfill(
+        session,
+        LatencyCacheSet,
+        cache_set_id,
+        averages,
+        heights,
+    )
+
+
+def backfill_errors(session: Session, cache_set_id: int, heights: List[int]) -> None:
+    heights = get_synced_heights(session, heights, ErrorsCache, is_range=True)
+    if not heights:
+        return
+    from_height, to_height = heights[0], heights[-1] + get_blocks_interval()
+
+    addresses = get_cache_set_addresses(session, cache_set_id, from_height)
+    errors_df = get_errors_frame(
+        session, from_height, to_height, addresses, [cache_set_id]
+    )
+    errors_df = assign_source_windows(errors_df, from_height, get_blocks_interval())
+    totals = create_msg_groups_frame(errors_df, ["start_height", "end_height"])
+    totals = totals.assign(cache_set_id=cache_set_id)
+    # Intervals without errors are recorded too, like cache_errors()
+    save_backfill(session, ErrorsCacheSet, cache_set_id, totals, heights)
+
+
+def create_service_cache_ranged(func, cache_set_id: int) -> None:
+    """
+    Backfill the whole LOOK_BACK range with one read per source table, the rows
+    are split into intervals in memory and saved with a single write.
+    """
+    now = pd.Timestamp.now()
+    with ConnFactory.poktinfo_conn() as session:
+        func(session, cache_set_id, get_backfill_heights())
+    perf_logger.info(
+        f"Finished {func.__name__} for {cache_set_id}, took {pd.Timestamp.now() - now}"
+    )
+
+
 def create_rewards_cache(cache_set_id: int) -> None:
-    create_service_cache(cache_rewards, cache_set_id)
+    if RANGED_BACKFILL:
+        create_service_cache_ranged(backfill_rewards, cache_set_id)
+    else:
+        create_service_cache(cache_rewards, cache_set_id)
 
 
 def create_errors_cache(cache_set_id: int) -> None:
-    create_service_cache(cache_errors, cache_set_id)
+    if RANGED_BACKFILL:
+        create_service_cache_ranged(backfill_errors, cache_set_id)
+    else:
+        create_service_cache(cache_errors, cache_set_id)
 
 
 def create_latency_cache(cache_set_id: int) -> None:
-    create_service_cache(cache_latency, cache_set_id)
+    if RANGED_BACKFILL:
+        create_service_cache_ranged(backfill_latency, cache_set_id)
+    else:
+        create_service_cache(cache_latency, cache_set_id)
 
 
 def update_rewards_cache(cache_set_id: int):
@@ -592,10 +663,10 @@ def update_errors_cache(cache_set_id: int):
     logger.debug(f"Finished updating errors cache set for {cache_set_id}")
 
 
-def update_node_count(cache_set_id: int):
+def update_node_count(cache_set_id: int, last_height: int = None):
     logger.debug(f"Updating node count cache set for {cache_set_id}")
     table_obj = NodeCountCacheSet
-    last_height = get_last_block_height()
+    last_height = last_height if last_height is not None else get_last_block_height()
     with ConnFactory.poktinfo_conn() as session:
         last_recorded_height = get_last_recorded_height(
             session, table_obj, cache_set_id, last_height
@@ -624,10 +695,10 @@ def update_node_count(cache_set_id: int):
     logger.debug(f"Finished updating node count cache set for {cache_set_id}")
 
 
-def update_location_cache(cache_set_id: int):
+def update_location_cache(cache_set_id: int, last_height: int = None):
     logger.debug(f"Updating location cache set for {cache_set_id}")
     table_obj = LocationCacheSet
-    last_height = get_last_block_height()
+    last_height = last_height if last_height is not None else get_last_block_height()
     with ConnFactory.poktinfo_conn() as session:
         last_recorded_height = get_last_recorded_height(
             session, table_obj, cache_set_id, last_height
@@ -677,6 +748,10 @@ def cache_set_historical(user_id: int, set_name: str) -> None:
         cache_set_id = PoktInfoRepository.get_cache_set_by_user_id_set_name(
             session, user_id, set_name
         ).id
+    if HISTORICAL_IN_SERVICE:
+        # Planned as backfill windows by the next cycle of the live service
+        logger.info(f"Historical data of {cache_set_id} left to the cache service")
+        return
     run_historical(cache_set_id)
     print("Finished caching historical data")
 
@@ -697,16 +772,18 @@ def get_last_recorded_height(
     table_obj: typing.Type[PoktInfoBase],
     cache_set_id: int,
     last_height: int,
+    interval: int = None,
 ) -> int:
+    interval = interval if interval is not None else get_blocks_interval()
     last_recorded_height = PoktInfoRepository.get_last_recorded_service_height(
         session,
         table_obj,
         is_range=True,
         cache_set_id=cache_set_id,
-        interval=get_blocks_interval(),
+        interval=interval,
     )
     if last_recorded_height is None:
-        leftover = (last_height - LOOK_BACK) % get_blocks_interval()
+        leftover = (last_height - LOOK_BACK) % interval
         last_recorded_height = last_height - LOOK_BACK - leftover
     return last_recorded_height
 
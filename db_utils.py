@@ -1,4 +1,38 @@
-from common.db_utils import fetch_all, execute_stmt, fetch_one
+import json
+from contextlib import contextmanager
+
+from common.db_utils import ConnFactory, fetch_all, execute_stmt, fetch_one
+from sqlalchemy.orm import Session
+
+# Engine of the current process once init_engine() ran (worker_pool.py workers)
+engine = None
+
+
+def init_engine() -> None:
+    """
+    Create one pooled engine for this process, poktinfo_conn() sessions reuse
+    its connections instead of connecting per session.
+    """
+    global engine
+    with open(f"{ConnFactory.creds_directory}poktinfo_creds.json") as f:
+        engine = ConnFactory.get_engine(json.load(f))
+
+
+@contextmanager
+def poktinfo_conn():
+    """
+    Session on the engine of the process, ConnFactory.poktinfo_conn() if
+    init_engine() wasn't called.
+    """
+    if engine is None:
+        with ConnFactory.poktinfo_conn() as session:
+            yield session
+        return
+    session = Session(bind=engine)
+    try:
+        yield session
+    finally:
+        session.close()
 
 
 def add_cache_set_entry(conn, user_id: int, set_name: str):
@@ -2,6 +2,88 @@ IS_TEST = False
 LOOK_BACK = 1000
 BLOCKS_INTERVAL = 4
 STUCK_TOLERANCE = 1
+# Backfill new cache sets with one read per source table instead of per interval
+RANGED_BACKFILL = True
+# Chain params are fetched once per span of PARAM_CACHE_BLOCKS heights, at its
+# first height, a multiple of every interval so windows never straddle two spans
+PARAM_CACHE_BLOCKS = 96
+# How cache set rows are written, "upsert" (COPY + ON CONFLICT, needs the unique
+# keys of scripts/create_indexes.sql, scripts/dedupe_cache_tables.sql on existing
+# tables), "copy" (COPY FROM STDIN) or "orm" (save_many). Only "upsert" makes
+# retried and overlapping windows no-ops, the others fail on the unique keys
+BULK_WRITE_MODE = "upsert"
+# Store errors_cache_set messages as error_group ids instead of text, needs
+# scripts/migrate_error_groups.sql applied, errors are then written with COPY
+ERROR_GROUPS = False
+# Also store the relay weighted latency sums and a p90 latency sketch in
+# latency_cache_set, needs scripts/add_latency_sums.sql applied, latency is then
+# written with COPY
+LATENCY_SUMS = False
+# Only write location_cache_set rows when the locations of a set change, the
+# rows of unchanged intervals extend the end_height of the previous snapshot
+LOCATION_SNAPSHOTS = False
+# Build a columnar snapshot of all cache set memberships once per cycle that the
+# workers map instead of loading the members of their sets (membership_snapshot.py)
+MEMBERSHIP_SNAPSHOT = False
+MEMBERSHIP_SNAPSHOT_DIR = "/dev/shm/poktinfo_cache_membership"
+# How source table reads filter on the addresses of cache sets, "in" (inline
+# IN (...) list), "any" (one array parameter) or "join" (semi-join of the
+# members at the window start in cache_set_node, no addresses are sent)
+ADDRESS_FILTER_MODE = "in"
+# Rows per chunk of the rewards and latency reads of the cache service, chunks
+# are streamed through a server side cursor and folded into the sums one at a
+# time so memory doesn't grow with the window, 0 reads a window at once
+STREAM_READ_CHUNK = 0
+# Streaming errors mode (errors_stream.py), rows read per chunk and poll period
+ERRORS_STREAM_CHUNK = 50000
+ERRORS_STREAM_POLL_SECONDS = 5
+# errors_cache ids re-read behind the high water mark every poll, ids are taken
+# at insert and rows can commit after higher ones
+ERRORS_STREAM_ID_OVERLAP = 10000
+# Processes of the long lived worker pool (worker_pool.py) running the cache
+# windows of the live loop, 0 uses the per cycle nested process pools
+WORKER_POOL_SIZE = 8
+# Windows ending less than RECENT_BLOCKS behind the tip are recent catch-up,
+# older ones deep backfill, both wait for live windows and are throttled when the
+# source sync check gets slower than DB_LATENCY_TARGET seconds
+RECENT_BLOCKS = 96
+DB_LATENCY_TARGET = 0.2
+# Leave the historical backfill of new cache sets to the worker pool of the
+# running service instead of caching it from the scripts
+HISTORICAL_IN_SERVICE = False
+# asyncio mode (async_cache_service.py), asyncpg connections, windows run at
+# once and processes aggregating their frames (0 aggregates in the event loop)
+ASYNC_POOL_SIZE = 10
+ASYNC_JOBS = 32
+ASYNC_CPU_WORKERS = 2
+# Roll-up mode (rollup.py), interval -> finer interval its rows are summed from,
+# every interval must be a multiple of its finer one
+ROLLUP_INTERVALS = {
+    24: 4,
+    96: 24,
+}
+# Event driven mode (scheduler.py), upstream service -> cache services it feeds
+# Must match the argument of the triggers of scripts/create_notify_triggers.sql
+SCHEDULER_CHANNEL = "services_state"
+SCHEDULER_POLL_SECONDS = 60
+SCHEDULER_SOURCES = {
+    "rewards": ["rewards", "node_count"],
+    "latency": ["latency"],
+    "errors": ["errors"],
+    "location": ["location"],
+}
+# Height partitioning of rewards_info, latency_cache and errors_cache, the live
+# loop creates partitions ahead of the tip and drops the expired ones. Without
+# it every row goes to the DEFAULT partition of the table
+MANAGE_PARTITIONS = False
+PARTITION_BLOCKS = 1000
+PARTITIONS_AHEAD = 2
+# Blocks of data kept per partitioned table, None keeps everything
+PARTITION_RETENTION = {
+    "rewards_info": None,
+    "latency_cache": None,
+    "errors_cache": 5000,
+}
 
 
 def set_blocks_interval(interval: int) -> None:
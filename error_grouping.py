@@ -1,4 +1,8 @@
 import re
+from functools import lru_cache
+from typing import List
+
+import pandas as pd
 
 MODE = "first"
 SAVED_PHRASES = {
@@ -20,6 +24,27 @@ SAVED_PHRASES = {
     "getdeletestateobject error": "cut_middle",
     '{"response"': "second",
 }
+# Raw messages repeat a lot, normalized ones are memoized per (msg, mode)
+MSG_CACHE_SIZE = 2**16
+NUMBERS_TABLE = str.maketrans("", "", "0123456789")
+LOWER_SAVED_PHRASES = tuple(
+    (saved_phrase.lower(), phrase_mode)
+    for saved_phrase, phrase_mode in SAVED_PHRASES.items()
+)
+HEAD_PHRASES_RE = re.compile(
+    "|".join(
+        re.escape(saved_phrase)
+        for saved_phrase, phrase_mode in LOWER_SAVED_PHRASES
+        if phrase_mode != "cut_middle"
+    )
+)
+CUT_PHRASES_RE = re.compile(
+    "|".join(
+        re.escape(saved_phrase)
+        for saved_phrase, phrase_mode in LOWER_SAVED_PHRASES
+        if phrase_mode == "cut_middle"
+    )
+)
 
 
 def filter_msg_for_mode(msg: str, mode: str, phrase: str = None):
@@ -33,22 +58,26 @@ def filter_msg_for_mode(msg: str, mode: str, phrase: str = None):
     return None
 
 
-def is_saved_phrase_in_msg(saved_phrase: str, msg: str, mode: str):
-    if mode == "cut_middle":
-        split_msg = msg.split(" ")
-        split_msg = [split_msg[0]] + split_msg[2:]
-        return saved_phrase in " ".join(split_msg)
-    return saved_phrase in msg
+def cut_middle(msg: str) -> str:
+    """
+    msg without its second word, phrases of "cut_middle" mode are matched
+    against it.
+    """
+    split_msg = msg.split(" ")
+    return " ".join([split_msg[0]] + split_msg[2:])
 
 
+@lru_cache(maxsize=MSG_CACHE_SIZE)
 def filter_error_msg(msg: str, mode: str = "first"):
-    numbers_re = r"[0-9]"
-    msg = re.sub(numbers_re, "", msg).lower()
-    for saved_phrase in SAVED_PHRASES:
-        phrase_mode = SAVED_PHRASES[saved_phrase]
-        saved_phrase = saved_phrase.lower()
-        if is_saved_phrase_in_msg(saved_phrase, msg.split(":")[0], phrase_mode):
-            return filter_msg_for_mode(msg, phrase_mode, saved_phrase)
+    msg = msg.translate(NUMBERS_TABLE).lower()
+    head = msg.split(":", 1)[0]
+    cut_head = cut_middle(head)
+    # One regex pass rejects messages without any saved phrase, the ones that
+    # have some are matched in SAVED_PHRASES order as the first match wins
+    if HEAD_PHRASES_RE.search(head) or CUT_PHRASES_RE.search(cut_head):
+        for saved_phrase, phrase_mode in LOWER_SAVED_PHRASES:
+            if saved_phrase in (cut_head if phrase_mode == "cut_middle" else head):
+                return filter_msg_for_mode(msg, phrase_mode, saved_phrase)
     return filter_msg_for_mode(msg, mode)
 
 
@@ -66,3 +95,27 @@ def create_msg_groups(errors_dict):
             else:
                 chain_msg_groups[chain][error_msg] = errors_count
     return chain_msg_groups
+
+
+def create_msg_groups_frame(
+    errors_df: pd.DataFrame, keys: List[str] = None
+) -> pd.DataFrame:
+    """
+    DataFrame version of create_msg_groups(), errors_df has errors_count, chain
+    and msg columns. Sums errors_count by keys + [chain, msg] with msg replaced
+    by its group, messages that don't belong to any group are dropped. Only the
+    distinct messages are normalized.
+    """
+    keys = keys if keys is not None else []
+    codes, msgs = pd.factorize(errors_df["msg"])
+    # Code -1 (missing msg) picks the trailing None
+    msg_groups = pd.array(
+        [filter_error_msg(msg, MODE) for msg in msgs] + [None], dtype=object
+    )
+    errors_df = errors_df.assign(msg=msg_groups[codes])
+    return (
+        errors_df.dropna(subset=["msg"])
+        .groupby(keys + ["chain", "msg"], sort=False, dropna=False)["errors_count"]
+        .sum()
+        .reset_index()
+    )
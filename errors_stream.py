@@ -0,0 +1,326 @@
+from time import sleep
+from typing import Iterator, List, Set, Tuple
+
+import pandas as pd
+from common.db_utils import ConnFactory
+from common.orm.repository import PoktInfoRepository
+from common.orm.schema import ErrorsCache, ErrorsCacheSet
+from common.utils import get_last_block_height
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from address_cache import check_membership_version
+from batch_cache_service import get_membership, update_cache_sets_batched
+from bulk_writer import save_cache_sets
+from cache_aggregations import assign_source_windows
+from cache_queries import get_last_cached_heights
+from cache_service import add_state_range, cache_errors, get_last_recorded_height
+from definitions import (
+    ERRORS_STREAM_CHUNK,
+    ERRORS_STREAM_ID_OVERLAP,
+    ERRORS_STREAM_POLL_SECONDS,
+    get_blocks_interval,
+)
+from error_grouping import create_msg_groups_frame
+from loggers import logger, perf_logger
+from membership_snapshot import expand_membership
+
+"""
+Streaming mode of the errors cache. Instead of re-querying errors_cache once
+per interval, rows past a high water mark on errors_cache.id are read in chunks
+through a server side cursor and folded into partial sums per set and interval.
+An interval is flushed to errors_cache_set as soon as errors are synced past its
+end (the check cache_errors() does), so the lag is the poll period instead of an
+interval plus the sleep of the live loop.
+
+errors_cache.id is taken at insert, so a row can commit after rows with higher
+ids. Every poll re-reads the last ERRORS_STREAM_ID_OVERLAP ids and skips the
+ones it has seen. A late row of an interval that was already flushed is logged
+and the interval is cached again for its sets with cache_errors().
+
+Nothing is persisted besides errors_cache_set, on start every set is caught up
+with the batched mode and resumes from its own last cached interval. Rows the
+catch up already cached for a set are skipped, only rows inserted after it
+began count as late.
+"""
+
+ERRORS_STREAM_COLUMNS = [
+    "id",
+    "address",
+    "errors_count",
+    "chain",
+    "msg",
+    "start_height",
+    "end_height",
+]
+PARTIAL_SUMS_KEYS = ["cache_set_id", "start_height", "end_height", "chain", "msg"]
+
+
+def get_stream_start_id(session: Session, from_height: int) -> int:
+    """
+    High water mark to stream the rows starting at from_height from, the id
+    right before the first of them.
+    """
+    first_id = (
+        session.query(func.min(ErrorsCache.id))
+        .filter(ErrorsCache.start_height >= from_height)
+        .scalar()
+    )
+    if first_id is None:
+        first_id = (session.query(func.max(ErrorsCache.id)).scalar() or 0) + 1
+    return first_id - 1
+
+
+def read_errors_chunks(session: Session, last_id: int) -> Iterator[pd.DataFrame]:
+    query = (
+        select(
+            ErrorsCache.id,
+            ErrorsCache.provider,
+            ErrorsCache.errors_count,
+            ErrorsCache.chain,
+            ErrorsCache.msg,
+            ErrorsCache.start_height,
+            ErrorsCache.end_height,
+        )
+        .where(ErrorsCache.id > last_id)
+        .order_by(ErrorsCache.id)
+        .execution_options(stream_results=True)
+    )
+    for rows in session.execute(query).partitions(ERRORS_STREAM_CHUNK):
+        yield pd.DataFrame(rows, columns=ERRORS_STREAM_COLUMNS)
+
+
+def drop_seen_rows(chunk: pd.DataFrame, seen_ids: Set[int]) -> pd.DataFrame:
+    """
+    Rows of chunk not streamed yet, their ids are added to seen_ids.
+    """
+    chunk = chunk[~chunk["id"].isin(seen_ids)]
+    seen_ids.update(chunk["id"].tolist())
+    return chunk
+
+
+def fold_errors(
+    partial_sums: pd.DataFrame,
+    chunk: pd.DataFrame,
+    membership: pd.DataFrame,
+    flushed_heights: pd.Series,
+    flushed_height: int,
+    caught_up_heights: pd.Series = None,
+    catch_up_id: int = 0,
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Add the errors of chunk to partial_sums. Rows are windowed like
+    cache_errors() reads them, rows crossing the end of their interval are
+    dropped. Rows up to catch_up_id of intervals below the height a set was
+    caught up to (caught_up_heights) were cached by the catch up and are
+    skipped. Rows of intervals a set has already flushed (flushed_height for
+    sets missing from flushed_heights) are late, returns the partial sums and
+    the (cache_set_id, start_height, end_height) intervals of the late rows.
+    """
+    windows = assign_source_windows(chunk, 0, get_blocks_interval())
+    errors_df = expand_membership(windows, membership)
+    if caught_up_heights is not None:
+        is_cached = (errors_df["id"] <= catch_up_id) & (
+            errors_df["start_height"]
+            < errors_df["cache_set_id"].map(caught_up_heights).fillna(0)
+        )
+        errors_df = errors_df[~is_cached]
+    set_flushed_heights = (
+        errors_df["cache_set_id"].map(flushed_heights).fillna(flushed_height)
+    )
+    is_late = errors_df["start_height"] < set_flushed_heights
+    late_windows = errors_df.loc[
+        is_late, ["cache_set_id", "start_height", "end_height"]
+    ].drop_duplicates()
+    sums = create_msg_groups_frame(
+        errors_df[~is_late], ["cache_set_id", "start_height", "end_height"]
+    )
+    partial_sums = (
+        pd.concat([partial_sums, sums], ignore_index=True)
+        .groupby(PARTIAL_SUMS_KEYS, sort=False, dropna=False)["errors_count"]
+        .sum()
+        .reset_index()
+    )
+    return partial_sums, late_windows
+
+
+def recache_late_windows(session: Session, late_windows: pd.DataFrame) -> None:
+    """
+    Cache again the flushed intervals late rows were streamed for, the rows
+    saved by the flush are replaced (BULK_WRITE_MODE "upsert").
+    """
+    logger.warning(
+        f"Late errors rows for {len(late_windows)} flushed intervals, caching "
+        f"them again, {late_windows.to_dict('records')}"
+    )
+    for row in late_windows.itertuples(index=False):
+        cache_errors(
+            session, int(row.cache_set_id), int(row.start_height), int(row.end_height)
+        )
+
+
+def flush_errors(
+    session: Session,
+    partial_sums: pd.DataFrame,
+    flushed_heights: pd.Series,
+    flushed_height: int,
+    streamed_height: int,
+    cache_set_ids: List[int],
+) -> Tuple[pd.DataFrame, int]:
+    """
+    Save every interval from flushed_height on whose errors are synced, in
+    order, for the sets that have not flushed it yet (flushed_heights). An
+    interval is only complete once a row starting at or after its end has been
+    streamed (streamed_height), rows are inserted in height order. Returns the
+    partial sums left and the new flushed height.
+    """
+    while flushed_height + get_blocks_interval() <= streamed_height and (
+        PoktInfoRepository.does_height_exist(
+            session,
+            flushed_height + get_blocks_interval(),
+            ErrorsCache,
+            is_range=True,
+        )
+    ):
+        from_height, to_height = flushed_height, flushed_height + get_blocks_interval()
+        window_set_ids = [
+            cache_set_id
+            for cache_set_id in cache_set_ids
+            if flushed_heights.get(cache_set_id, flushed_height) <= from_height
+        ]
+        is_window = partial_sums["start_height"] == from_height
+        totals = partial_sums[
+            is_window & partial_sums["cache_set_id"].isin(window_set_ids)
+        ]
+        has_added = (
+            save_cache_sets(session, ErrorsCacheSet, totals) if len(totals) else True
+        )
+        # Sets without errors in the interval are recorded too, like cache_errors()
+        error_set_ids = set(totals["cache_set_id"].unique())
+        for cache_set_id in window_set_ids:
+            add_state_range(
+                session,
+                "errors_cache_set",
+                from_height,
+                to_height,
+                has_added if cache_set_id in error_set_ids else True,
+                cache_set_id,
+            )
+        partial_sums = partial_sums[~is_window]
+        flushed_height = to_height
+    return partial_sums, flushed_height
+
+
+def run_errors_stream() -> None:
+    with ConnFactory.poktinfo_conn() as session:
+        cache_set_ids = [
+            cache_set.id for cache_set in PoktInfoRepository.get_cache_sets(session)
+        ]
+        # Taken before the catch up, later rows may not have been read by it
+        catch_up_id = session.query(func.max(ErrorsCache.id)).scalar() or 0
+    update_cache_sets_batched(cache_set_ids, services=["errors"])
+
+    last_height = get_last_block_height()
+    with ConnFactory.poktinfo_conn() as session:
+        last_cached_heights = get_last_cached_heights(
+            session, cache_set_ids, ["errors_cache_set"], get_blocks_interval()
+        )
+        flushed_heights = pd.Series(
+            {
+                cache_set_id: max(
+                    get_last_recorded_height(
+                        session, ErrorsCacheSet, cache_set_id, last_height
+                    ),
+                    last_cached_heights.get((cache_set_id, "errors_cache_set"), 0),
+                )
+                for cache_set_id in cache_set_ids
+            },
+            dtype="int64",
+        )
+        flushed_heights -= flushed_heights % get_blocks_interval()
+        caught_up_heights = flushed_heights.copy()
+        flushed_height = (
+            int(flushed_heights.min())
+            if len(flushed_heights)
+            else (last_height - last_height % get_blocks_interval())
+        )
+        last_id = get_stream_start_id(session, flushed_height)
+    # Rows up to it were cached by the catch up, the overlap never goes below it
+    start_id = last_id
+    streamed_height = flushed_height
+    partial_sums = pd.DataFrame(
+        {
+            "cache_set_id": pd.Series(dtype="int64"),
+            "start_height": pd.Series(dtype="int64"),
+            "end_height": pd.Series(dtype="int64"),
+            "chain": pd.Series(dtype="object"),
+            "msg": pd.Series(dtype="object"),
+            "errors_count": pd.Series(dtype="int64"),
+        }
+    )
+    seen_ids = set()
+    logger.info(f"Streaming errors from id {last_id}, height {flushed_height}")
+
+    while True:
+        try:
+            now = pd.Timestamp.now()
+            with ConnFactory.poktinfo_conn() as session:
+                cache_set_ids = [
+                    cache_set.id
+                    for cache_set in PoktInfoRepository.get_cache_sets(session)
+                ]
+                check_membership_version(session)
+                membership = get_membership(session, cache_set_ids)
+            rows = 0
+            late_windows = []
+            with ConnFactory.poktinfo_conn() as session:
+                chunks = read_errors_chunks(
+                    session, max(start_id, last_id - ERRORS_STREAM_ID_OVERLAP)
+                )
+                for chunk in chunks:
+                    chunk = drop_seen_rows(chunk, seen_ids)
+                    if chunk.empty:
+                        continue
+                    partial_sums, chunk_late_windows = fold_errors(
+                        partial_sums,
+                        chunk,
+                        membership,
+                        flushed_heights,
+                        flushed_height,
+                        caught_up_heights,
+                        catch_up_id,
+                    )
+                    late_windows.append(chunk_late_windows)
+                    last_id = max(last_id, int(chunk["id"].max()))
+                    streamed_height = max(
+                        streamed_height, int(chunk["start_height"].max())
+                    )
+                    rows += len(chunk)
+            seen_ids = {
+                id_ for id_ in seen_ids if id_ > last_id - ERRORS_STREAM_ID_OVERLAP
+            }
+            # Writes go through another session, committing would close the cursor
+            with ConnFactory.poktinfo_conn() as session:
+                previous_height = flushed_height
+                partial_sums, flushed_height = flush_errors(
+                    session,
+                    partial_sums,
+                    flushed_heights,
+                    flushed_height,
+                    streamed_height,
+                    cache_set_ids,
+                )
+                if late_windows:
+                    late_windows = pd.concat(late_windows).drop_duplicates()
+                    if len(late_windows):
+                        recache_late_windows(session, late_windows)
+            if flushed_height > previous_height:
+                flushed_heights = flushed_heights.clip(lower=flushed_height)
+            perf_logger.info(
+                f"Streamed {rows} errors rows up to id {last_id}, flushed up to "
+                f"{flushed_height}, {len(partial_sums)} partial sums, "
+                f"took {pd.Timestamp.now() - now}"
+            )
+        except Exception as e:
+            logger.error(f"Failed streaming errors after id {last_id}, {e}")
+        sleep(ERRORS_STREAM_POLL_SECONDS)
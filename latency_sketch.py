@@ -0,0 +1,134 @@
+import base64
+import math
+from typing import List, Tuple
+
+import numpy as np
+import pandas as pd
+
+"""
+Mergeable quantile sketch of latencies (DDSketch). A value is counted in the
+bucket ceil(log_gamma(value)), any quantile read back is within
+SKETCH_RELATIVE_ACCURACY of an actual value, and two sketches merge by adding
+the weights of their buckets, so sketches of cached windows or cache sets can be
+combined without the source rows.
+
+Sketches are stored as base64 text of the int16 bucket indexes followed by the
+float32 weights, at most SKETCH_MAX_BUCKETS buckets (the lowest ones are folded
+together past that, only the low quantiles lose accuracy).
+"""
+
+SKETCH_RELATIVE_ACCURACY = 0.01
+SKETCH_MAX_BUCKETS = 512
+# Values below are counted as SKETCH_MIN_VALUE
+SKETCH_MIN_VALUE = 1e-6
+
+GAMMA = (1 + SKETCH_RELATIVE_ACCURACY) / (1 - SKETCH_RELATIVE_ACCURACY)
+LOG_GAMMA = math.log(GAMMA)
+BUCKET_COLUMN = "sketch_bucket"
+WEIGHT_COLUMN = "sketch_weight"
+
+
+def get_bucket_indexes(values: np.ndarray) -> np.ndarray:
+    values = np.maximum(np.asarray(values, dtype="float64"), SKETCH_MIN_VALUE)
+    return np.ceil(np.log(values) / LOG_GAMMA).astype("int64")
+
+
+def get_bucket_values(indexes: np.ndarray) -> np.ndarray:
+    return 2 * np.power(GAMMA, indexes) / (GAMMA + 1)
+
+
+def encode_sketch(indexes: np.ndarray, weights: np.ndarray) -> str:
+    """
+    indexes have to be unique and sorted.
+    """
+    if len(indexes) > SKETCH_MAX_BUCKETS:
+        folded = len(indexes) - SKETCH_MAX_BUCKETS + 1
+        weights = np.concatenate([[weights[:folded].sum()], weights[folded:]])
+        indexes = indexes[folded - 1 :]
+    return base64.b64encode(
+        np.asarray(indexes, dtype="<i2").tobytes()
+        + np.asarray(weights, dtype="<f4").tobytes()
+    ).decode()
+
+
+def decode_sketch(sketch: str) -> Tuple[np.ndarray, np.ndarray]:
+    data = base64.b64decode(sketch)
+    buckets = len(data) // 6
+    indexes = np.frombuffer(data, dtype="<i2", count=buckets).astype("int64")
+    weights = np.frombuffer(data, dtype="<f4", offset=2 * buckets).astype("float64")
+    return indexes, weights
+
+
+def encode_buckets(buckets: pd.DataFrame, keys: List[str], name: str) -> pd.DataFrame:
+    """
+    One sketch per keys of a (keys, BUCKET_COLUMN, WEIGHT_COLUMN) frame.
+    """
+    buckets = (
+        buckets[buckets[WEIGHT_COLUMN] > 0]
+        .groupby(keys + [BUCKET_COLUMN], sort=True)[WEIGHT_COLUMN]
+        .sum()
+        .reset_index()
+    )
+    rows = []
+    by = keys[0] if len(keys) == 1 else keys
+    for group, group_buckets in buckets.groupby(by, sort=False):
+        group = group if isinstance(group, tuple) else (group,)
+        sketch = encode_sketch(
+            group_buckets[BUCKET_COLUMN].to_numpy(),
+            group_buckets[WEIGHT_COLUMN].to_numpy(),
+        )
+        rows.append((*group, sketch))
+    return pd.DataFrame(rows, columns=keys + [name])
+
+
+def sketch_frame(
+    df: pd.DataFrame,
+    keys: List[str],
+    value_column: str,
+    weight_column: str,
+    name: str,
+) -> pd.DataFrame:
+    """
+    Sketch of value_column weighted by weight_column per keys, in column name.
+    """
+    df = df[df[value_column].notna()]
+    buckets = df[keys].assign(
+        **{
+            BUCKET_COLUMN: get_bucket_indexes(df[value_column].to_numpy()),
+            WEIGHT_COLUMN: df[weight_column].to_numpy(dtype="float64"),
+        }
+    )
+    return encode_buckets(buckets, keys, name)
+
+
+def merge_sketch_frame(
+    sketches: pd.DataFrame, keys: List[str], sketch_column: str
+) -> pd.DataFrame:
+    """
+    Merge the sketches of sketch_column per keys, rows without a sketch are
+    skipped.
+    """
+    sketches = sketches[sketches[sketch_column].notna()].reset_index(drop=True)
+    decoded = [decode_sketch(sketch) for sketch in sketches[sketch_column]]
+    lengths = [len(indexes) for indexes, _ in decoded]
+    buckets = sketches[keys].loc[sketches.index.repeat(lengths)]
+    buckets = buckets.assign(
+        **{
+            BUCKET_COLUMN: np.concatenate(
+                [np.zeros(0, dtype="int64")] + [indexes for indexes, _ in decoded]
+            ),
+            WEIGHT_COLUMN: np.concatenate(
+                [np.zeros(0)] + [weights for _, weights in decoded]
+            ),
+        }
+    )
+    return encode_buckets(buckets, keys, sketch_column)
+
+
+def get_quantile(sketch: str, quantile: float) -> float:
+    indexes, weights = decode_sketch(sketch)
+    if not len(weights):
+        return math.nan
+    cumulative = np.cumsum(weights)
+    bucket = np.searchsorted(cumulative, quantile * cumulative[-1], side="left")
+    return float(get_bucket_values(indexes[min(bucket, len(indexes) - 1)]))
@@ -0,0 +1,252 @@
+import os
+import shutil
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from sqlalchemy.orm import Session
+
+from cache_aggregations import expand_to_sets
+from cache_queries import get_all_cache_set_nodes
+from definitions import MEMBERSHIP_SNAPSHOT_DIR
+from loggers import perf_logger
+
+"""
+Columnar snapshot of the membership of all cache sets, built once per cycle by
+the service and attached by every worker instead of each of them loading the
+cache_set_node rows of its sets.
+
+Addresses are interned to int32 ids (their position in the sorted addresses),
+the cache_set_node rows are sorted by cache set so the rows of the i-th set are
+set_offsets[i]:set_offsets[i + 1] (CSR), and address_offsets/address_entries
+index the same rows by address id the other way around. Every array is an .npy
+file of a generation directory under MEMBERSHIP_SNAPSHOT_DIR (tmpfs by default),
+workers map them read only so all processes share the same pages.
+
+The per set cache paths only read the address list of their set from it
+(get_snapshot_addresses()), the source reads still filter on those addresses in
+SQL. The batched and streaming errors modes, which read the rows of every set at
+once, expand them to their sets with a searchsorted of their addresses and
+gathers over the reverse index (expand_membership()) instead of a merge on
+address strings.
+"""
+
+SNAPSHOT_ARRAYS = [
+    "addresses",
+    "set_ids",
+    "set_offsets",
+    "address_ids",
+    "start_heights",
+    "end_heights",
+    "address_offsets",
+    "address_entries",
+]
+# start_height/end_height of the rows without one
+NO_HEIGHT = -1
+
+# Snapshot attached by this process and the directory it was loaded from
+snapshot: Optional[Dict[str, np.ndarray]] = None
+snapshot_path: Optional[str] = None
+
+
+def build_snapshot_arrays(nodes: pd.DataFrame) -> Dict[str, np.ndarray]:
+    """
+    Snapshot arrays of a (cache_set_id, address, start_height, end_height) frame.
+    """
+    nodes = nodes.sort_values(["cache_set_id", "address"], kind="stable")
+    addresses, address_ids = np.unique(
+        nodes["address"].to_numpy(dtype=str), return_inverse=True
+    )
+    set_ids, set_starts = np.unique(
+        nodes["cache_set_id"].to_numpy(dtype="int64"), return_index=True
+    )
+    address_entries = np.argsort(address_ids, kind="stable")
+    address_offsets = np.searchsorted(
+        address_ids[address_entries], np.arange(len(addresses) + 1)
+    )
+    return {
+        "addresses": np.char.encode(addresses, "utf-8").astype("S"),
+        "set_ids": set_ids,
+        "set_offsets": np.append(set_starts, len(nodes)).astype("int64"),
+        "address_ids": address_ids.astype("int32"),
+        "start_heights": nodes["start_height"]
+        .fillna(NO_HEIGHT)
+        .to_numpy(dtype="int64"),
+        "end_heights": nodes["end_height"].fillna(NO_HEIGHT).to_numpy(dtype="int64"),
+        "address_offsets": address_offsets.astype("int64"),
+        "address_entries": address_entries.astype("int32"),
+    }
+
+
+def write_snapshot(arrays: Dict[str, np.ndarray], directory: str) -> str:
+    """
+    Write arrays as a new generation under directory and remove the older ones,
+    returns its path. Workers still mapping an older generation keep reading it
+    until they attach the new one.
+    """
+    os.makedirs(directory, exist_ok=True)
+    generation = str(time.time_ns())
+    staging_path = os.path.join(directory, f".{generation}")
+    os.makedirs(staging_path)
+    for name in SNAPSHOT_ARRAYS:
+        np.save(os.path.join(staging_path, f"{name}.npy"), arrays[name])
+    path = os.path.join(directory, generation)
+    os.rename(staging_path, path)
+    for entry in os.listdir(directory):
+        if entry != generation:
+            shutil.rmtree(os.path.join(directory, entry), ignore_errors=True)
+    return path
+
+
+def attach_snapshot(path: str) -> Dict[str, np.ndarray]:
+    """
+    Map the snapshot at path into this process, a no-op if it is attached
+    already.
+    """
+    global snapshot, snapshot_path
+    if path != snapshot_path:
+        snapshot = {
+            name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+            for name in SNAPSHOT_ARRAYS
+        }
+        snapshot_path = path
+    return snapshot
+
+
+def refresh_snapshot(session: Session, directory: str = None) -> str:
+    """
+    Build the snapshot of the current cache_set_node rows and attach it, returns
+    its path for the workers to attach.
+    """
+    now = pd.Timestamp.now()
+    directory = directory if directory is not None else MEMBERSHIP_SNAPSHOT_DIR
+    nodes = get_all_cache_set_nodes(session)
+    path = write_snapshot(build_snapshot_arrays(nodes), directory)
+    attach_snapshot(path)
+    perf_logger.info(
+        f"Built membership snapshot of {len(snapshot['set_ids'])} cache sets, "
+        f"{len(snapshot['addresses'])} addresses, {len(nodes)} rows, "
+        f"took {pd.Timestamp.now() - now}"
+    )
+    return path
+
+
+def get_active_rows(
+    arrays: Dict[str, np.ndarray], rows: np.ndarray, height: Optional[int] = None
+) -> np.ndarray:
+    """
+    Mask of the cache_set_node rows that are members at height, or current
+    members if height is None, like address_cache.get_cache_set_addresses().
+    """
+    end_heights = arrays["end_heights"][rows]
+    has_ended = end_heights != NO_HEIGHT
+    if height is None:
+        return ~has_ended
+    start_heights = arrays["start_heights"][rows]
+    has_started = (start_heights == NO_HEIGHT) | (start_heights <= height)
+    return has_started & ~(has_ended & (end_heights <= height))
+
+
+def get_set_rows(arrays: Dict[str, np.ndarray], cache_set_id: int) -> Optional[slice]:
+    position = np.searchsorted(arrays["set_ids"], cache_set_id)
+    if (
+        position == len(arrays["set_ids"])
+        or arrays["set_ids"][position] != cache_set_id
+    ):
+        return None
+    set_offsets = arrays["set_offsets"]
+    return slice(int(set_offsets[position]), int(set_offsets[position + 1]))
+
+
+def has_cache_sets(arrays: Dict[str, np.ndarray], cache_set_ids: List[int]) -> bool:
+    return bool(np.isin(cache_set_ids, arrays["set_ids"]).all())
+
+
+def get_snapshot_addresses(
+    arrays: Dict[str, np.ndarray], cache_set_id: int, height: Optional[int] = None
+) -> Optional[List[str]]:
+    """
+    Addresses of the set at height, None if the set isn't in the snapshot.
+    """
+    rows = get_set_rows(arrays, cache_set_id)
+    if rows is None:
+        return None
+    rows = np.arange(rows.start, rows.stop)
+    address_ids = arrays["address_ids"][rows[get_active_rows(arrays, rows, height)]]
+    return [address.decode() for address in arrays["addresses"][address_ids].tolist()]
+
+
+def get_member_index(
+    arrays: Dict[str, np.ndarray],
+    cache_set_ids: List[int],
+    height: Optional[int] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Reverse index restricted to the members of cache_set_ids at height, the
+    cache set ids of address id i are set_ids[offsets[i]:offsets[i + 1]].
+    """
+    entries = arrays["address_entries"]
+    set_positions = np.searchsorted(arrays["set_offsets"], entries, side="right") - 1
+    is_member = np.isin(arrays["set_ids"], cache_set_ids)[set_positions]
+    is_member &= get_active_rows(arrays, entries, height)
+    members_before = np.concatenate([[0], np.cumsum(is_member)])
+    return (
+        members_before[arrays["address_offsets"]],
+        arrays["set_ids"][set_positions[is_member]],
+    )
+
+
+def get_address_ids(arrays: Dict[str, np.ndarray], addresses: pd.Series) -> np.ndarray:
+    """
+    Interned id of every address, -1 for addresses outside the snapshot.
+    """
+    codes, uniques = pd.factorize(addresses)
+    encoded = np.char.encode(uniques.to_numpy(dtype=str), "utf-8").astype("S")
+    unique_ids = np.searchsorted(arrays["addresses"], encoded)
+    is_known = unique_ids < len(arrays["addresses"])
+    is_known[is_known] = arrays["addresses"][unique_ids[is_known]] == encoded[is_known]
+    unique_ids = np.where(is_known, unique_ids, -1)
+    return np.where(codes >= 0, unique_ids[codes], -1)
+
+
+def expand_to_snapshot_sets(
+    arrays: Dict[str, np.ndarray],
+    df: pd.DataFrame,
+    cache_set_ids: List[int],
+    height: Optional[int] = None,
+) -> pd.DataFrame:
+    """
+    expand_to_sets() of df to the members of cache_set_ids at height through the
+    reverse index, rows of addresses outside the snapshot are dropped.
+    """
+    offsets, member_set_ids = get_member_index(arrays, cache_set_ids, height)
+    address_ids = get_address_ids(arrays, df["address"])
+    source_rows = np.flatnonzero(address_ids >= 0)
+    address_ids = address_ids[source_rows]
+
+    # Gather the sets of every source row, rows repeat once per set
+    starts = offsets[address_ids]
+    counts = offsets[address_ids + 1] - starts
+    source_rows = np.repeat(source_rows, counts)
+    first_rows = np.repeat(np.cumsum(counts) - counts, counts)
+    members = np.repeat(starts, counts) + np.arange(len(source_rows)) - first_rows
+    return (
+        df.iloc[source_rows]
+        .assign(cache_set_id=member_set_ids[members])
+        .reset_index(drop=True)
+    )
+
+
+def expand_membership(
+    df: pd.DataFrame, membership: pd.DataFrame, height: Optional[int] = None
+) -> pd.DataFrame:
+    """
+    expand_to_sets() through the attached snapshot when it has every set of
+    membership, membership holds the members at height (current members if
+    None).
+    """
+    cache_set_ids = membership["cache_set_id"].unique()
+    if snapshot is None or not has_cache_sets(snapshot, cache_set_ids):
+        return expand_to_sets(df, membership)
+    return expand_to_snapshot_sets(snapshot, df, cache_set_ids, height)
@@ -0,0 +1,97 @@
+import ast
+import fcntl
+import json
+import os
+from bisect import bisect_right
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import List
+
+from common.utils import get_param
+
+from definitions import PARAM_CACHE_BLOCKS
+
+"""
+On disk cache of chain params shared by all the cache service processes.
+
+Heights are looked up at the start of their span of PARAM_CACHE_BLOCKS, so a
+param is fetched at most once per span and a change inside a span takes effect
+at the next one. Every param is stored as sorted [start_height, end_height,
+value] segments of those span starts, a height inside a segment is answered
+without an RPC. A lookup past the known heights fetches the param once and
+either extends the last segment (same value) or starts a new one (the param
+changed in between).
+
+A value fetched for a height is never refreshed, params of past heights don't
+change. Extending a segment assumes the param didn't change and change back
+between its end and the new height, such a round trip is missed. Delete
+param_cache.json to start over.
+"""
+
+path = os.path.dirname(os.path.realpath(__file__))
+PARAM_CACHE_PATH = os.path.join(path, "param_cache.json")
+SUPPORTED_CHAINS_PARAM = "pocketcore/SupportedBlockchains"
+
+
+@contextmanager
+def locked_params(exclusive: bool = False):
+    with open(f"{PARAM_CACHE_PATH}.lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            try:
+                with open(PARAM_CACHE_PATH) as f:
+                    params = json.load(f)
+            except (FileNotFoundError, ValueError):
+                params = {}
+            yield params
+            if exclusive:
+                tmp_path = f"{PARAM_CACHE_PATH}.{os.getpid()}.tmp"
+                with open(tmp_path, "w") as f:
+                    json.dump(params, f)
+                os.replace(tmp_path, PARAM_CACHE_PATH)
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def find_segment(segments: List[list], height: int):
+    index = bisect_right([segment[0] for segment in segments], height) - 1
+    if index >= 0 and segments[index][1] >= height:
+        return segments[index]
+    return None
+
+
+def add_segment(segments: List[list], height: int, value: str) -> None:
+    index = bisect_right([segment[0] for segment in segments], height)
+    previous = segments[index - 1] if index > 0 else None
+    following = segments[index] if index < len(segments) else None
+    if previous is not None and previous[2] == value:
+        previous[1] = max(previous[1], height)
+        if following is not None and following[2] == value:
+            previous[1] = following[1]
+            segments.remove(following)
+    elif following is not None and following[2] == value:
+        following[0] = height
+    else:
+        segments.insert(index, [height, height, value])
+
+
+def get_cached_param(height: int, key: str) -> str:
+    height -= height % PARAM_CACHE_BLOCKS
+    with locked_params() as params:
+        segment = find_segment(params.get(key, []), height)
+    if segment is not None:
+        return segment[2]
+
+    value = get_param(height, key)
+    with locked_params(exclusive=True) as params:
+        add_segment(params.setdefault(key, []), height, value)
+    return value
+
+
+@lru_cache(maxsize=16)
+def parse_chains(chains: str) -> List[str]:
+    return ast.literal_eval(chains)
+
+
+def get_supported_chains(height: int) -> List[str]:
+    return list(parse_chains(get_cached_param(height, SUPPORTED_CHAINS_PARAM)))
@@ -0,0 +1,263 @@
+import re
+from typing import List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from definitions import PARTITION_BLOCKS, PARTITIONS_AHEAD, PARTITION_RETENTION
+from loggers import logger
+
+"""
+Maintenance of the height partitioned source tables (see
+scripts/create_cache_tables.sql). Partitions are PARTITION_BLOCKS wide and
+aligned to multiples of it, they are created PARTITIONS_AHEAD partitions past
+the chain tip so the writers rarely hit a missing one, and partitions older than
+PARTITION_RETENTION blocks are detached and dropped.
+
+Rows outside of every height partition land in the DEFAULT partition of the
+table. A new partition whose range already has rows there is filled with them
+before being attached, Postgres refuses to create it over them otherwise.
+"""
+
+# Partitioned table -> partition key
+PARTITIONED_TABLES = {
+    "rewards_info": "height",
+    "latency_cache": "start_height",
+    "errors_cache": "start_height",
+}
+PARTITION_BOUNDS = re.compile(r"FROM \((\w+)\) TO \((\w+)\)")
+
+
+def partition_name(table_name: str, from_height: int) -> str:
+    return f"{table_name}_p{from_height}"
+
+
+def get_partitions(
+    session: Session, table_name: str
+) -> List[Tuple[str, Optional[int], Optional[int]]]:
+    """
+    (name, from_height, to_height) of every partition of table_name sorted by
+    from_height, MINVALUE/MAXVALUE bounds are returned as None.
+    """
+    rows = session.execute(
+        text(
+            "SELECT child.relname, pg_get_expr(child.relpartbound, child.oid) "
+            "FROM pg_inherits "
+            "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+            "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+            "WHERE parent.relname = :table_name"
+        ),
+        {"table_name": table_name},
+    ).all()
+    partitions = []
+    for name, bounds in rows:
+        match = PARTITION_BOUNDS.search(bounds)
+        if match is None:
+            continue
+        from_height, to_height = (
+            int(bound) if bound.lstrip("-").isdigit() else None
+            for bound in match.groups()
+        )
+        partitions.append((name, from_height, to_height))
+    return sorted(partitions, key=lambda p: -1 if p[1] is None else p[1])
+
+
+def default_partition_name(table_name: str) -> str:
+    return f"{table_name}_default"
+
+
+def has_default_partition(session: Session, table_name: str) -> bool:
+    return (
+        session.execute(
+            text("SELECT to_regclass(:name)"),
+            {"name": f"public.{default_partition_name(table_name)}"},
+        ).scalar()
+        is not None
+    )
+
+
+def create_partition(
+    session: Session, table_name: str, from_height: int, has_default: bool
+) -> None:
+    """
+    Create the [from_height, from_height + PARTITION_BLOCKS) partition of
+    table_name, moving the rows of its range out of the default partition.
+    """
+    name = partition_name(table_name, from_height)
+    to_height = from_height + PARTITION_BLOCKS
+    bounds = f"FOR VALUES FROM ({from_height}) TO ({to_height})"
+    if not has_default:
+        session.execute(
+            text(
+                f"CREATE TABLE IF NOT EXISTS public.{name} "
+                f"PARTITION OF public.{table_name} {bounds}"
+            )
+        )
+        return
+    key = PARTITIONED_TABLES[table_name]
+    default_name = default_partition_name(table_name)
+    in_range = f"{key} >= {from_height} AND {key} < {to_height}"
+    session.execute(
+        text(
+            f"CREATE TABLE public.{name} "
+            f"(LIKE public.{table_name} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+        )
+    )
+    moved = session.execute(
+        text(
+            f"WITH moved AS (DELETE FROM public.{default_name} WHERE {in_range} "
+            f"RETURNING *) INSERT INTO public.{name} SELECT * FROM moved"
+        )
+    ).rowcount
+    # Lets ATTACH PARTITION skip scanning the new partition
+    session.execute(
+        text(
+            f"ALTER TABLE public.{name} ADD CONSTRAINT {name}_bounds "
+            f"CHECK ({key} IS NOT NULL AND {in_range})"
+        )
+    )
+    session.execute(
+        text(f"ALTER TABLE public.{table_name} ATTACH PARTITION public.{name} {bounds}")
+    )
+    session.execute(text(f"ALTER TABLE public.{name} DROP CONSTRAINT {name}_bounds"))
+    if moved:
+        logger.info(f"Moved {moved} rows of {table_name} from {default_name} to {name}")
+
+
+def create_partitions(session: Session, table_name: str, height: int) -> int:
+    """
+    Create the partitions of table_name up to PARTITIONS_AHEAD partitions past
+    height, starting at the end of the last existing partition.
+    """
+    partitions = get_partitions(session, table_name)
+    last_to_height = max(
+        (p[2] for p in partitions if p[2] is not None),
+        default=height // PARTITION_BLOCKS * PARTITION_BLOCKS,
+    )
+    target_height = (height // PARTITION_BLOCKS + 1 + PARTITIONS_AHEAD) * (
+        PARTITION_BLOCKS
+    )
+    has_default = has_default_partition(session, table_name)
+    created = 0
+    for from_height in range(last_to_height, target_height, PARTITION_BLOCKS):
+        create_partition(session, table_name, from_height, has_default)
+        created += 1
+    session.commit()
+    return created
+
+
+def drop_expired_partitions(session: Session, table_name: str, height: int) -> int:
+    """
+    Detach and drop the partitions of table_name that end more than
+    PARTITION_RETENTION[table_name] blocks before height.
+    """
+    retention = PARTITION_RETENTION.get(table_name)
+    if retention is None:
+        return 0
+    dropped = 0
+    for name, _, to_height in get_partitions(session, table_name):
+        if to_height is None or to_height > height - retention:
+            continue
+        session.execute(
+            text(f"ALTER TABLE public.{table_name} DETACH PARTITION {name}")
+        )
+        session.execute(text(f"DROP TABLE {name}"))
+        dropped += 1
+    session.commit()
+    return dropped
+
+
+def maintain_partitions(session: Session, height: int) -> None:
+    for table_name in PARTITIONED_TABLES:
+        created = create_partitions(session, table_name, height)
+        dropped = drop_expired_partitions(session, table_name, height)
+        if created or dropped:
+            logger.info(
+                f"Partitions of {table_name} at {height}, created {created}, "
+                f"dropped {dropped}"
+            )
+
+
+def migrate_to_partitioned(session: Session, table_name: str, height: int) -> None:
+    """
+    Turn an existing heap table into a partitioned one. The old table is kept
+    as a single partition ending at the partition boundary after height, so
+    rows keep being written to it until the first regular partition starts.
+    Indexes of the old table are renamed with a _legacy suffix, running
+    scripts/create_indexes.sql afterwards attaches them to the partitioned
+    indexes instead of building new ones.
+    """
+    key = PARTITIONED_TABLES[table_name]
+    legacy_table = f"{table_name}_legacy"
+    to_height = (height // PARTITION_BLOCKS + 1) * PARTITION_BLOCKS
+
+    # Validated CHECK constraint lets ATTACH PARTITION skip scanning the table
+    session.execute(
+        text(
+            f"ALTER TABLE public.{table_name} "
+            f"ADD CONSTRAINT {table_name}_partition_check "
+            f"CHECK ({key} IS NOT NULL AND {key} < {to_height}) NOT VALID"
+        )
+    )
+    session.commit()
+    session.execute(
+        text(
+            f"ALTER TABLE public.{table_name} "
+            f"VALIDATE CONSTRAINT {table_name}_partition_check"
+        )
+    )
+    session.commit()
+
+    primary_key = session.execute(
+        text(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE conrelid = CAST(:table_name AS regclass) AND contype = 'p'"
+        ),
+        {"table_name": f"public.{table_name}"},
+    ).first()
+    index_names = session.execute(
+        text(
+            "SELECT indexname FROM pg_indexes "
+            "WHERE schemaname = 'public' AND tablename = :table_name"
+        ),
+        {"table_name": table_name},
+    ).all()
+
+    session.execute(text(f"ALTER TABLE public.{table_name} RENAME TO {legacy_table}"))
+    for (index_name,) in index_names:
+        session.execute(
+            text(f"ALTER INDEX public.{index_name} RENAME TO {index_name}_legacy")
+        )
+    session.execute(
+        text(
+            f"CREATE TABLE public.{table_name} "
+            f"(LIKE public.{legacy_table} INCLUDING DEFAULTS) "
+            f"PARTITION BY RANGE ({key})"
+        )
+    )
+    if primary_key is not None:
+        # The partition key has to be part of the primary key
+        name, definition = primary_key
+        columns = re.search(r"\((.*)\)", definition).group(1)
+        session.execute(
+            text(
+                f"ALTER TABLE public.{table_name} ADD CONSTRAINT {name} "
+                f"PRIMARY KEY ({columns}, {key})"
+            )
+        )
+    session.execute(
+        text(
+            f"ALTER TABLE public.{table_name} ATTACH PARTITION public.{legacy_table} "
+            f"FOR VALUES FROM (MINVALUE) TO ({to_height})"
+        )
+    )
+    session.execute(
+        text(
+            f"CREATE TABLE public.{default_partition_name(table_name)} "
+            f"PARTITION OF public.{table_name} DEFAULT"
+        )
+    )
+    session.commit()
+    logger.info(
+        f"Migrated {table_name} to partitions, {legacy_table} ends at {to_height}"
+    )
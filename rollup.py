@@ -0,0 +1,246 @@
+import typing
+from typing import List
+
+import pandas as pd
+from common.orm.repository import PoktInfoRepository
+from common.orm.schema import (
+    RewardsCacheSet,
+    LatencyCacheSet,
+    ErrorsCacheSet,
+    PoktInfoBase,
+)
+from sqlalchemy.orm import Session
+
+from bulk_writer import save_cache_sets
+from cache_aggregations import LATENCY_SKETCH_COLUMN, finalize_latency
+from cache_queries import get_latency_sketches, get_rollup_frame
+from cache_service import add_state_range, get_last_recorded_height
+from db_utils import poktinfo_conn
+from definitions import LATENCY_SUMS, LOOK_BACK, ROLLUP_INTERVALS
+from latency_sketch import get_quantile, merge_sketch_frame
+from loggers import logger, perf_logger
+
+"""
+Roll-up of coarser intervals from the cache set rows of finer ones. Rewards,
+relays and errors are summed, latency is summed relay weighted and averaged
+again, so e.g. the 24 block rows come from the 4 block rows and the 96 block
+rows from the 24 block ones instead of reading the source tables again.
+
+A coarse window of a set is only rolled up once the finer interval recorded
+past its end, with LATENCY_SUMS the p90 latency sketches of the finer rows are
+merged too. Sets without errors in a window write no errors rows, so
+errors go by the furthest any set recorded. Node count and location count
+distinct nodes and can't be rolled up, they're cached at every interval.
+"""
+
+ROLLUP_TABLES = [RewardsCacheSet, LatencyCacheSet, ErrorsCacheSet]
+
+
+def merge_latency_sketches(
+    session: Session,
+    latency: pd.DataFrame,
+    cache_set_ids: List[int],
+    interval: int,
+    from_height: int,
+    to_height: int,
+    keys: List[str] = None,
+) -> pd.DataFrame:
+    """
+    Add the merged p90 latency sketch of the interval rows between from_height
+    and to_height to every keys row of latency.
+    """
+    keys = keys if keys is not None else ["cache_set_id", "region", "chain"]
+    sketches = get_latency_sketches(
+        session, cache_set_ids, interval, from_height, to_height
+    )
+    sketches = merge_sketch_frame(sketches, keys, LATENCY_SKETCH_COLUMN)
+    return latency.merge(sketches, on=keys, how="left")
+
+
+def get_latency_range(
+    session: Session,
+    cache_set_ids: List[int],
+    interval: int,
+    from_height: int,
+    to_height: int,
+) -> pd.DataFrame:
+    """
+    Latency of the union of cache_set_ids between from_height and to_height per
+    region and chain, merged from their interval rows instead of latency_cache.
+    With LATENCY_SUMS p90_latency is the relay weighted p90 of the node p90s.
+
+    The rows of every set are added up, a node in several of the sets counts
+    once per set. The result is only exact for disjoint sets, a single set is
+    always exact.
+    """
+    keys = ["region", "chain"]
+    latency_sums = get_rollup_frame(
+        session, "latency_cache_set", cache_set_ids, interval, from_height, to_height
+    )
+    latency = finalize_latency(
+        latency_sums.groupby(keys, sort=False)[
+            ["total_relays", "latency_sum", "p90_latency_sum", "weighted_latency_sum"]
+        ]
+        .sum()
+        .reset_index()
+    )
+    if LATENCY_SUMS:
+        latency = merge_latency_sketches(
+            session, latency, cache_set_ids, interval, from_height, to_height, keys
+        )
+        latency = latency.assign(
+            p90_latency=[
+                get_quantile(sketch, 0.9) if pd.notna(sketch) else None
+                for sketch in latency[LATENCY_SKETCH_COLUMN]
+            ]
+        )
+    return latency
+
+
+def rollup_window(
+    session: Session,
+    table_obj: typing.Type[PoktInfoBase],
+    cache_set_ids: List[int],
+    interval: int,
+    fine_interval: int,
+    from_height: int,
+) -> None:
+    to_height = from_height + interval
+    totals = get_rollup_frame(
+        session,
+        table_obj.__tablename__,
+        cache_set_ids,
+        fine_interval,
+        from_height,
+        to_height,
+    )
+    if table_obj == LatencyCacheSet:
+        totals = finalize_latency(totals)
+        if LATENCY_SUMS:
+            totals = merge_latency_sketches(
+                session, totals, cache_set_ids, fine_interval, from_height, to_height
+            )
+    totals = totals.assign(
+        start_height=from_height, end_height=to_height, interval=interval
+    )
+    has_added = save_cache_sets(session, table_obj, totals) if len(totals) else True
+    # The finer rows are complete, sets without rows are recorded too
+    for cache_set_id in cache_set_ids:
+        add_state_range(
+            session,
+            table_obj.__tablename__,
+            from_height,
+            to_height,
+            has_added,
+            cache_set_id,
+            interval=interval,
+        )
+
+
+def get_rollup_start_height(
+    session: Session,
+    table_obj: typing.Type[PoktInfoBase],
+    cache_set_id: int,
+    last_height: int,
+    interval: int,
+) -> int:
+    last_recorded_height = PoktInfoRepository.get_last_recorded_service_height(
+        session,
+        table_obj,
+        is_range=True,
+        cache_set_id=cache_set_id,
+        interval=interval,
+    )
+    if last_recorded_height is None:
+        # First window after the LOOK_BACK start of the finer interval
+        return -(-(last_height - LOOK_BACK) // interval) * interval
+    return last_recorded_height - last_recorded_height % interval
+
+
+def update_rollup(
+    session: Session,
+    table_obj: typing.Type[PoktInfoBase],
+    cache_set_ids: List[int],
+    interval: int,
+    fine_interval: int,
+    last_height: int,
+) -> int:
+    """
+    Roll up every complete window of interval up to last_height, each window
+    only includes the sets that haven't cached it yet. Returns the number of
+    windows rolled up.
+    """
+    last_recorded_heights = pd.Series(
+        {
+            cache_set_id: get_rollup_start_height(
+                session, table_obj, cache_set_id, last_height, interval
+            )
+            for cache_set_id in cache_set_ids
+        },
+        dtype="int64",
+    )
+    fine_heights = pd.Series(
+        {
+            cache_set_id: get_last_recorded_height(
+                session, table_obj, cache_set_id, last_height, fine_interval
+            )
+            for cache_set_id in cache_set_ids
+        },
+        dtype="int64",
+    )
+    if table_obj == ErrorsCacheSet:
+        fine_heights = fine_heights.clip(lower=fine_heights.max())
+
+    windows = 0
+    height = int(last_recorded_heights.min())
+    while height + interval <= last_height:
+        is_complete = fine_heights >= height + interval
+        if not is_complete.any():
+            break
+        window_set_ids = last_recorded_heights.index[
+            is_complete & (last_recorded_heights <= height)
+        ].tolist()
+        if window_set_ids:
+            rollup_window(
+                session, table_obj, window_set_ids, interval, fine_interval, height
+            )
+            windows += 1
+        height += interval
+    return windows
+
+
+def update_rollups(cache_set_ids: List[int], last_height: int) -> None:
+    """
+    Roll up every ROLLUP_INTERVALS interval from its finer one, finer intervals
+    first so they are complete for the coarser ones in the same pass.
+    """
+    if not cache_set_ids:
+        return
+    for interval, fine_interval in sorted(ROLLUP_INTERVALS.items()):
+        if interval % fine_interval:
+            raise ValueError(f"Interval {interval} isn't a multiple of {fine_interval}")
+    with poktinfo_conn() as session:
+        for interval, fine_interval in sorted(ROLLUP_INTERVALS.items()):
+            for table_obj in ROLLUP_TABLES:
+                now = pd.Timestamp.now()
+                try:
+                    windows = update_rollup(
+                        session,
+                        table_obj,
+                        cache_set_ids,
+                        interval,
+                        fine_interval,
+                        last_height,
+                    )
+                except Exception as e:
+                    session.rollback()
+                    logger.error(
+                        f"Failed rolling up {table_obj.__tablename__} {interval} "
+                        f"from {fine_interval}, {e}"
+                    )
+                    continue
+                perf_logger.info(
+                    f"Rolled up {windows} windows of {table_obj.__tablename__} "
+                    f"{interval} from {fine_interval} for {len(cache_set_ids)} "
+                    f"cache sets, took {pd.Timestamp.now() - now}"
+                )
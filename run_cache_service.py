@@ -1,3 +1,4 @@
+import asyncio
 import sys
 from concurrent.futures import ProcessPoolExecutor as Pool, as_completed
 from time import sleep
@@ -7,24 +8,56 @@ from common.orm.repository import PoktInfoRepository
 from common.price_utils import record_pocket_price
 from common.utils import get_last_block_height
 
-from definitions import IS_TEST, set_blocks_interval, get_blocks_interval
+from definitions import (
+    IS_TEST,
+    MANAGE_PARTITIONS,
+    MEMBERSHIP_SNAPSHOT,
+    WORKER_POOL_SIZE,
+    set_blocks_interval,
+    get_blocks_interval,
+)
 
 if len(sys.argv) > 1:
     set_blocks_interval(int(sys.argv[1]))
 if len(sys.argv) > 2:
-    mode = str(sys.argv[1])
+    mode = str(sys.argv[2])
 else:
     mode = None
 
+from async_cache_service import run_async_cycle
+from batch_cache_service import update_cache_sets_batched
 from cache_service import (
     update_cache_set,
     update_rewards_cache,
     update_errors_cache,
     update_latency_cache,
+    update_node_count,
+    update_location_cache,
 )
+from errors_stream import run_errors_stream
 from loggers import logger
+from membership_snapshot import refresh_snapshot
+from scheduler import run_scheduler
+from worker_pool import run_cycle
+from partitions import maintain_partitions
+from rollup import update_rollups
+
+# Services run by the worker pool per mode, all of them by default
+MODE_SERVICES = {
+    "rewards": ["rewards"],
+    "errors": ["errors"],
+    "latency": ["latency"],
+    "batch": ["node_count", "location"],
+    "async": ["node_count", "location"],
+}
 
 if __name__ == "__main__":
+    if mode == "stream":
+        # Errors only, consumes errors_cache as it is written
+        run_errors_stream()
+    elif mode == "events":
+        # Caches intervals as the upstream services complete them
+        run_scheduler()
     coin, currency = "pokt", "usd"
     last_recorded_height = get_last_block_height() - get_blocks_interval()
     while True:
@@ -42,6 +75,15 @@ if __name__ == "__main__":
                         f"Failed recording price for {coin} at {last_height}, {e}"
                     )
 
+                if MANAGE_PARTITIONS:
+                    try:
+                        with ConnFactory.poktinfo_conn() as session:
+                            maintain_partitions(session, last_height)
+                    except Exception as e:
+                        logger.error(
+                            f"Failed maintaining partitions at {last_height}, {e}"
+                        )
+
                 logger.info(
                     f"Updating for {last_height}, Blocks interval - {get_blocks_interval()}"
                 )
@@ -49,22 +91,40 @@ if __name__ == "__main__":
                     with ConnFactory.poktinfo_conn() as session:
                         cache_sets = PoktInfoRepository.get_cache_sets(session)
                         cache_set_ids = [cache_set.id for cache_set in cache_sets]
+                        if MEMBERSHIP_SNAPSHOT:
+                            # Shared by the workers of this cycle
+                            refresh_snapshot(session)
 
                     futures = []
-                    with Pool(max_workers=8) as tp:
-                        for cache_set_id in cache_set_ids:
-                            func = update_cache_set
-                            if mode == "rewards":
-                                func = update_rewards_cache
-                            elif mode == "errors":
-                                func = update_errors_cache
-                            elif mode == "latency":
-                                func = update_latency_cache
-                            futures.append(tp.submit(func, cache_set_id))
+                    if mode == "batch":
+                        # Rewards, latency and errors of all sets in one pass
+                        update_cache_sets_batched(cache_set_ids)
+                    elif mode == "async":
+                        # Rewards, latency and errors as coroutines of this process
+                        asyncio.run(run_async_cycle(cache_set_ids, None, last_height))
+                    if WORKER_POOL_SIZE:
+                        run_cycle(cache_set_ids, MODE_SERVICES.get(mode), last_height)
+                    else:
+                        with Pool(max_workers=8) as tp:
+                            for cache_set_id in cache_set_ids:
+                                funcs = [update_cache_set]
+                                if mode == "rewards":
+                                    funcs = [update_rewards_cache]
+                                elif mode == "errors":
+                                    funcs = [update_errors_cache]
+                                elif mode == "latency":
+                                    funcs = [update_latency_cache]
+                                elif mode in ["batch", "async"]:
+                                    funcs = [update_node_count, update_location_cache]
+                                for func in funcs:
+                                    futures.append(tp.submit(func, cache_set_id))
 
-                        for future in as_completed(futures):
-                            future.result()
+                            for future in as_completed(futures):
+                                future.result()
 
+                    if mode == "rollup":
+                        # Coarser intervals from the rows just cached
+                        update_rollups(cache_set_ids, last_height)
                     last_recorded_height = last_height
                     sleep(60 * 15 if mode != "fast" else 1)
         except Exception as e:
@@ -0,0 +1,201 @@
+import json
+import select
+from concurrent.futures import ProcessPoolExecutor as Pool, as_completed
+from time import sleep
+from typing import Dict, List
+
+from common.db_utils import ConnFactory
+from common.orm.repository import PoktInfoRepository
+from common.price_utils import record_pocket_price
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from batch_cache_service import BATCH_SERVICES, update_cache_sets_batched
+from cache_service import update_node_count, update_location_cache
+from definitions import (
+    SCHEDULER_CHANNEL,
+    SCHEDULER_POLL_SECONDS,
+    SCHEDULER_SOURCES,
+    get_blocks_interval,
+)
+from loggers import logger
+
+"""
+Event driven scheduler of the cache service. The upstream services record their
+progress in services_state/services_state_range, the triggers of
+scripts/create_notify_triggers.sql NOTIFY every change on SCHEDULER_CHANNEL.
+Each notification schedules the cache services fed by that source
+(SCHEDULER_SOURCES) for the intervals that just became complete, instead of
+waiting for the chain height to line up with the interval.
+
+Without notifications (triggers missing, connection lost) the scheduler falls
+back to polling the services state tables every SCHEDULER_POLL_SECONDS, which
+also picks up anything a dropped notification missed.
+"""
+
+NOTIFY_TRIGGERS = ["services_state_notify", "services_state_range_notify"]
+
+PER_SET_SERVICES = {
+    "node_count": update_node_count,
+    "location": update_location_cache,
+}
+
+
+def listen(channel: str):
+    """
+    Raw psycopg2 connection LISTENing on channel, notifications are only
+    delivered outside of transactions so it runs in autocommit. The connection
+    is detached from the pool, it stays open for the life of the scheduler.
+    """
+    with ConnFactory.poktinfo_conn() as session:
+        engine = session.get_bind()
+    connection = engine.raw_connection()
+    connection.detach()
+    connection.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+    connection.cursor().execute(f"LISTEN {channel}")
+    return connection
+
+
+def check_notify_triggers(session: Session, channel: str) -> bool:
+    """
+    Whether every trigger of scripts/create_notify_triggers.sql exists and
+    notifies on channel, logs the ones that don't.
+    """
+    rows = session.execute(
+        text("SELECT tgname, tgargs FROM pg_trigger WHERE tgname = ANY(:names)"),
+        {"names": NOTIFY_TRIGGERS},
+    ).all()
+    # tgargs holds the trigger arguments, each terminated by a NUL byte
+    channels = {name: bytes(args).split(b"\x00")[0].decode() for name, args in rows}
+    is_valid = True
+    for name in NOTIFY_TRIGGERS:
+        if channels.get(name) != channel:
+            is_valid = False
+            logger.error(
+                f"Trigger {name} notifies on {channels.get(name)} instead of "
+                f"{channel}, apply scripts/create_notify_triggers.sql with it"
+            )
+    return is_valid
+
+
+def wait_for_notifies(connection, timeout: float) -> Dict[str, int]:
+    """
+    Highest height of every source notified within timeout, empty if none was.
+    """
+    heights = {}
+    if select.select([connection], [], [], timeout) == ([], [], []):
+        return heights
+    connection.poll()
+    while connection.notifies:
+        payload = json.loads(connection.notifies.pop(0).payload)
+        heights[payload["service"]] = max(
+            heights.get(payload["service"], 0), int(payload["height"])
+        )
+    return heights
+
+
+def get_source_heights(session: Session) -> Dict[str, int]:
+    """
+    Polling fallback, highest height of every source in both state tables.
+    """
+    rows = session.execute(
+        text(
+            "SELECT service, MAX(height) FROM public.services_state GROUP BY service "
+            "UNION ALL "
+            "SELECT service, MAX(end_height) FROM public.services_state_range "
+            "GROUP BY service"
+        )
+    ).all()
+    heights = {}
+    for service, height in rows:
+        if height is not None:
+            heights[service] = max(heights.get(service, 0), int(height))
+    return heights
+
+
+def get_due_jobs(
+    source_heights: Dict[str, int], scheduled_heights: Dict[str, int]
+) -> Dict[str, int]:
+    """
+    (cache service, last height to cache) of the services whose sources
+    completed intervals they haven't been scheduled for yet.
+    """
+    jobs = {}
+    for source, height in source_heights.items():
+        to_height = height - height % get_blocks_interval()
+        for service in SCHEDULER_SOURCES.get(source, []):
+            if to_height > scheduled_heights.get(service, -1):
+                jobs[service] = max(jobs.get(service, 0), to_height)
+    return jobs
+
+
+def run_job(service: str, cache_set_ids: List[int], last_height: int) -> None:
+    if service in BATCH_SERVICES:
+        update_cache_sets_batched(cache_set_ids, [service], last_height)
+        return
+    with Pool(max_workers=8) as tp:
+        futures = [
+            tp.submit(PER_SET_SERVICES[service], cache_set_id, last_height)
+            for cache_set_id in cache_set_ids
+        ]
+        for future in as_completed(futures):
+            future.result()
+
+
+def run_jobs(jobs: Dict[str, int]) -> None:
+    with ConnFactory.poktinfo_conn() as session:
+        cache_set_ids = [
+            cache_set.id for cache_set in PoktInfoRepository.get_cache_sets(session)
+        ]
+    logger.info(f"Scheduling {jobs} for {len(cache_set_ids)} cache sets")
+    with Pool(max_workers=len(jobs)) as tp:
+        futures = [
+            tp.submit(run_job, service, cache_set_ids, last_height)
+            for service, last_height in jobs.items()
+        ]
+        for future in as_completed(futures):
+            future.result()
+
+
+def record_price(height: int) -> None:
+    coin, currency = "pokt", "usd"
+    try:
+        record_pocket_price(coin, currency, height)
+    except Exception as e:
+        logger.error(f"Failed recording price for {coin} at {height}, {e}")
+
+
+def run_scheduler() -> None:
+    scheduled_heights = {}
+    connection = None
+    while True:
+        try:
+            if connection is None:
+                try:
+                    connection = listen(SCHEDULER_CHANNEL)
+                    with ConnFactory.poktinfo_conn() as session:
+                        check_notify_triggers(session, SCHEDULER_CHANNEL)
+                except Exception as e:
+                    logger.error(f"LISTEN {SCHEDULER_CHANNEL} failed, polling, {e}")
+            source_heights = {}
+            # Nothing scheduled yet, catch up right away from the state tables
+            if scheduled_heights and connection is not None:
+                source_heights = wait_for_notifies(connection, SCHEDULER_POLL_SECONDS)
+            elif scheduled_heights:
+                sleep(SCHEDULER_POLL_SECONDS)
+            if not source_heights:
+                with ConnFactory.poktinfo_conn() as session:
+                    source_heights = get_source_heights(session)
+
+            jobs = get_due_jobs(source_heights, scheduled_heights)
+            if jobs:
+                if "rewards" in jobs:
+                    record_price(jobs["rewards"])
+                run_jobs(jobs)
+                scheduled_heights.update(jobs)
+        except Exception as e:
+            logger.error(f"Scheduler failed, {e}")
+            if connection is not None:
+                connection.close()
+            connection = None
@@ -0,0 +1,15 @@
+-- Add the mergeable latency aggregates to latency_cache_set, set LATENCY_SUMS
+-- = True in definitions.py once this is applied. The sums of existing rows are
+-- derived from their averages, their p90 sketches stay NULL.
+
+ALTER TABLE public.latency_cache_set
+    ADD COLUMN IF NOT EXISTS latency_sum          double precision,
+    ADD COLUMN IF NOT EXISTS p90_latency_sum      double precision,
+    ADD COLUMN IF NOT EXISTS weighted_latency_sum double precision,
+    ADD COLUMN IF NOT EXISTS p90_latency_sketch   text;
+
+UPDATE public.latency_cache_set
+SET latency_sum          = avg_latency * total_relays,
+    p90_latency_sum      = avg_p90_latency * total_relays,
+    weighted_latency_sum = avg_weighted_latency * total_relays
+WHERE latency_sum IS NULL;
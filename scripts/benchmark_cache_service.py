@@ -0,0 +1,519 @@
+import asyncio
+import sys
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor as Pool, as_completed
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+from common.db_utils import ConnFactory
+from common.orm.repository import PoktInfoRepository
+from common.orm.schema import (
+    CacheSetStateRangeEntry,
+    RewardsCacheSet,
+    LatencyCacheSet,
+    ErrorsCacheSet,
+)
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from async_cache_service import ASYNC_SERVICES, create_engine_async, run_windows_async
+from bulk_writer import save_cache_sets
+from cache_aggregations import (
+    aggregate_locations,
+    expand_to_sets,
+    fold_latency,
+    fold_rewards,
+    sum_latency,
+    sum_rewards,
+)
+from cache_queries import (
+    get_errors_counts,
+    get_latency_frame,
+    get_node_counts,
+    get_rewards_frame,
+    stream_latency,
+    stream_rewards,
+)
+from check_query_plans import capture_statements
+from definitions import ASYNC_JOBS, WORKER_POOL_SIZE, get_blocks_interval
+from error_grouping import (
+    MODE,
+    create_msg_groups,
+    create_msg_groups_frame,
+    filter_error_msg,
+)
+from membership_snapshot import (
+    build_snapshot_arrays,
+    expand_to_snapshot_sets,
+    get_snapshot_addresses,
+)
+from param_cache import get_supported_chains
+from scripts.parity_utils import (
+    legacy_aggregate_locations,
+    legacy_set_addresses,
+    synthetic_locations_frame,
+    synthetic_membership_frame,
+)
+from worker_pool import init_worker, run_window_job
+
+"""
+Benchmarks of the cache service hot paths, printing query count and wall time
+
+Usage: python3 benchmark_cache_service.py node_count
+    <cache_set_id> <from_height> <to_height>
+Usage: python3 benchmark_cache_service.py bulk_write <rows>
+Usage: python3 benchmark_cache_service.py error_grouping <rows>
+Usage: python3 benchmark_cache_service.py worker_pool <cache_sets> <cycles>
+Usage: python3 benchmark_cache_service.py async
+    <cache_set_ids> <from_height> <to_height>
+Usage: python3 benchmark_cache_service.py locations <nodes>
+Usage: python3 benchmark_cache_service.py membership <cache_sets> <rows>
+Usage: python3 benchmark_cache_service.py address_filter
+    <cache_set_id> <from_height> <to_height>
+Usage: python3 benchmark_cache_service.py stream_reads
+    <cache_set_id> <from_height> <to_height> [<chunk_rows>]
+"""
+
+# Synthetic rows are written with this cache_set_id and deleted afterwards
+BENCHMARK_CACHE_SET_ID = -1
+
+
+@contextmanager
+def count_queries(session: Session):
+    counter = {"queries": 0, "started": pd.Timestamp.now()}
+
+    def before_cursor_execute(*args):
+        counter["queries"] += 1
+
+    engine = session.get_bind()
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield counter
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+        counter["took"] = pd.Timestamp.now() - counter["started"]
+
+
+def benchmark_node_count(cache_set_id: int, from_height: int, to_height: int) -> None:
+    chains = get_supported_chains(from_height)
+    with ConnFactory.poktinfo_conn() as session:
+        addresses = PoktInfoRepository.get_cache_set_addresses(session, cache_set_id)
+
+        with count_queries(session) as loop_counter:
+            loop_counts = {
+                None: PoktInfoRepository.get_node_count(
+                    session, from_height, to_height, addresses
+                )
+            }
+            for chain in chains:
+                loop_counts[chain] = PoktInfoRepository.get_node_count(
+                    session, from_height, to_height, addresses, chain=chain
+                )
+
+        with count_queries(session) as grouped_counter:
+            grouped_counts = get_node_counts(session, from_height, to_height, addresses)
+
+    mismatches = [
+        chain
+        for chain, node_count in loop_counts.items()
+        if (node_count or 0) != grouped_counts.get(chain, 0)
+    ]
+    print(f"Per chain loop: {loop_counter['queries']} queries, {loop_counter['took']}")
+    print(
+        f"Grouped query: {grouped_counter['queries']} queries, "
+        f"{grouped_counter['took']}"
+    )
+    print(f"Chains with different counts: {mismatches}")
+
+
+def synthetic_rewards_frame(rows: int) -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    start_heights = 4 * np.arange(rows)
+    return pd.DataFrame(
+        {
+            "cache_set_id": BENCHMARK_CACHE_SET_ID,
+            "rewards_total": rng.random(rows) * 1000,
+            "normalized_rewards_total": rng.random(rows) * 1000,
+            "relays_total": rng.integers(0, 100000, rows),
+            "chain": rng.choice(["0001", "0021", "0009", "0004"], rows),
+            "start_height": start_heights,
+            "end_height": start_heights + 4,
+            "interval": 4,
+        }
+    )
+
+
+def benchmark_bulk_write(rows: int) -> None:
+    frame = synthetic_rewards_frame(rows)
+    with ConnFactory.poktinfo_conn() as session:
+        for mode in ["orm", "copy"]:
+            with count_queries(session) as counter:
+                has_added = save_cache_sets(session, RewardsCacheSet, frame, mode=mode)
+            print(
+                f"{mode}: {rows} rows, added {has_added}, "
+                f"{counter['queries']} queries, {counter['took']}"
+            )
+            session.query(RewardsCacheSet).filter(
+                RewardsCacheSet.cache_set_id == BENCHMARK_CACHE_SET_ID
+            ).delete()
+            session.commit()
+
+
+def synthetic_errors_dict(rows: int) -> list:
+    """
+    (errors_count, chain, msg) groups shaped like errors_cache, messages differ
+    mostly by the numbers in them so many of them normalize the same way.
+    """
+    rng = np.random.default_rng(0)
+    templates = [
+        "Missing trie node {} (path ): not found",
+        "execution Reverted: {}",
+        "{} Bad Gateway",
+        "Block {} could not be found",
+        "rpc error: code = {} desc = timeout",
+        "dial tcp 10.0.0.{}:8081: connect: connection refused",
+        "context deadline exceeded after {}ms",
+    ]
+    return [
+        (
+            int(rng.integers(1, 100)),
+            str(rng.choice(["0001", "0021", "0009"])),
+            templates[rng.integers(len(templates))].format(rng.integers(0, 5000)),
+        )
+        for _ in range(rows)
+    ]
+
+
+def benchmark_error_grouping(rows: int) -> None:
+    errors_dict = synthetic_errors_dict(rows)
+    filter_error_msg.cache_clear()
+    for run in ["cold", "warm"]:
+        started = pd.Timestamp.now()
+        create_msg_groups(errors_dict)
+        print(
+            f"create_msg_groups {run} cache: {rows} rows, "
+            f"{pd.Timestamp.now() - started}"
+        )
+    errors_df = pd.DataFrame(errors_dict, columns=["errors_count", "chain", "msg"])
+    filter_error_msg.cache_clear()
+    started = pd.Timestamp.now()
+    create_msg_groups_frame(errors_df)
+    print(f"create_msg_groups_frame: {rows} rows, {pd.Timestamp.now() - started}")
+    started = pd.Timestamp.now()
+    for _, _, msg in errors_dict:
+        filter_error_msg.__wrapped__(msg, MODE)
+    print(
+        f"filter_error_msg without cache: {rows} rows, {pd.Timestamp.now() - started}"
+    )
+    print(filter_error_msg.cache_info())
+
+
+def run_noop_job(*args) -> bool:
+    return True
+
+
+def run_noop_cache_set(cache_set_id: int) -> None:
+    with Pool(max_workers=5) as tp:
+        futures = [tp.submit(run_noop_job, cache_set_id, i) for i in range(5)]
+        for future in as_completed(futures):
+            future.result()
+
+
+def benchmark_worker_pool(cache_sets: int, cycles: int) -> None:
+    """
+    Per cycle overhead of the process pools alone, jobs don't do anything. The
+    nested pools of the legacy live loop against the long lived worker pool.
+    """
+    started = pd.Timestamp.now()
+    for _ in range(cycles):
+        with Pool(max_workers=8) as tp:
+            futures = [tp.submit(run_noop_cache_set, i) for i in range(cache_sets)]
+            for future in as_completed(futures):
+                future.result()
+    took = (pd.Timestamp.now() - started) / cycles
+    print(f"Nested pools: {cache_sets} cache sets, {took} per cycle")
+
+    started = pd.Timestamp.now()
+    with Pool(max_workers=WORKER_POOL_SIZE) as tp:
+        for _ in range(cycles):
+            futures = [
+                tp.submit(run_noop_job, i, service)
+                for i in range(cache_sets)
+                for service in range(5)
+            ]
+            for future in as_completed(futures):
+                future.result()
+    took = (pd.Timestamp.now() - started) / cycles
+    print(
+        f"Worker pool of {WORKER_POOL_SIZE}: {cache_sets} cache sets, {took} per cycle"
+    )
+
+
+def delete_windows(cache_set_ids: list, from_height: int, to_height: int) -> None:
+    with ConnFactory.poktinfo_conn() as session:
+        for table_obj in [RewardsCacheSet, LatencyCacheSet, ErrorsCacheSet]:
+            session.query(table_obj).filter(
+                table_obj.cache_set_id.in_(cache_set_ids),
+                table_obj.start_height >= from_height,
+                table_obj.end_height <= to_height,
+            ).delete(synchronize_session=False)
+        session.query(CacheSetStateRangeEntry).filter(
+            CacheSetStateRangeEntry.cache_set_id.in_(cache_set_ids),
+            CacheSetStateRangeEntry.service.in_(
+                [table_obj.__tablename__ for table_obj, _, _ in ASYNC_SERVICES.values()]
+            ),
+            CacheSetStateRangeEntry.start_height >= from_height,
+            CacheSetStateRangeEntry.end_height <= to_height,
+        ).delete(synchronize_session=False)
+        session.commit()
+
+
+async def run_async_windows(windows: list) -> None:
+    engine = create_engine_async()
+    semaphore = asyncio.Semaphore(ASYNC_JOBS)
+    try:
+        await asyncio.gather(
+            *[
+                run_windows_async(engine, semaphore, cache_set_id, service, [height])
+                for cache_set_id, service, height in windows
+            ]
+        )
+    finally:
+        await engine.dispose()
+
+
+def benchmark_async(cache_set_ids: list, from_height: int, to_height: int) -> None:
+    """
+    Windows per second of rewards, latency and errors between from_height and
+    to_height, worker pool processes against the asyncio mode. Meant for a local
+    Postgres, the cached windows of cache_set_ids in the range are deleted
+    before and after each mode.
+    """
+    windows = [
+        (cache_set_id, service, height)
+        for cache_set_id in cache_set_ids
+        for service in ASYNC_SERVICES
+        for height in range(
+            from_height, to_height - get_blocks_interval() + 1, get_blocks_interval()
+        )
+    ]
+    delete_windows(cache_set_ids, from_height, to_height)
+    started = pd.Timestamp.now()
+    with Pool(
+        max_workers=WORKER_POOL_SIZE,
+        initializer=init_worker,
+        initargs=(get_blocks_interval(),),
+    ) as tp:
+        futures = [
+            tp.submit(
+                run_window_job,
+                cache_set_id,
+                service,
+                height,
+                height + get_blocks_interval(),
+            )
+            for cache_set_id, service, height in windows
+        ]
+        for future in as_completed(futures):
+            future.result()
+    took = (pd.Timestamp.now() - started).total_seconds()
+    print(
+        f"Worker pool of {WORKER_POOL_SIZE}: {len(windows)} windows, {took}s, "
+        f"{len(windows) / took:.1f} windows/s"
+    )
+    delete_windows(cache_set_ids, from_height, to_height)
+
+    started = pd.Timestamp.now()
+    asyncio.run(run_async_windows(windows))
+    took = (pd.Timestamp.now() - started).total_seconds()
+    print(
+        f"asyncio, {ASYNC_JOBS} jobs: {len(windows)} windows, {took}s, "
+        f"{len(windows) / took:.1f} windows/s"
+    )
+    delete_windows(cache_set_ids, from_height, to_height)
+
+
+def benchmark_locations(nodes: int) -> None:
+    locations_df = synthetic_locations_frame(nodes)
+    for name, func in [
+        ("Nested groupby", legacy_aggregate_locations),
+        ("aggregate_locations", aggregate_locations),
+    ]:
+        started = pd.Timestamp.now()
+        locations = func(locations_df)
+        print(
+            f"{name}: {nodes} nodes, {len(locations_df)} rows, {len(locations)} "
+            f"locations, {pd.Timestamp.now() - started}"
+        )
+
+
+def benchmark_membership(cache_sets: int, rows: int) -> None:
+    """
+    Resolving the addresses of every set and expanding rows source rows to all
+    sets, from the cache_set_node frames against the membership snapshot.
+    """
+    nodes = synthetic_membership_frame(cache_sets, 20000)
+    set_nodes = dict(list(nodes.groupby("cache_set_id")))
+    started = pd.Timestamp.now()
+    arrays = build_snapshot_arrays(nodes)
+    print(
+        f"Snapshot of {cache_sets} cache sets, {len(nodes)} rows built in "
+        f"{pd.Timestamp.now() - started}"
+    )
+
+    started = pd.Timestamp.now()
+    membership = pd.DataFrame(
+        [
+            (cache_set_id, address)
+            for cache_set_id, frame in set_nodes.items()
+            for address in legacy_set_addresses(frame)
+        ],
+        columns=["cache_set_id", "address"],
+    )
+    print(f"Frame addresses of {cache_sets} sets: {pd.Timestamp.now() - started}")
+    started = pd.Timestamp.now()
+    for cache_set_id in set_nodes:
+        get_snapshot_addresses(arrays, cache_set_id)
+    print(f"Snapshot addresses of {cache_sets} sets: {pd.Timestamp.now() - started}")
+
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(
+        {
+            "address": [f"{address:040x}" for address in rng.integers(0, 20000, rows)],
+            "relays": rng.integers(0, 1000, rows),
+        }
+    )
+    for name, func in [
+        ("Merge on address", lambda: expand_to_sets(df, membership)),
+        (
+            "Snapshot gather",
+            lambda: expand_to_snapshot_sets(arrays, df, list(set_nodes)),
+        ),
+    ]:
+        started = pd.Timestamp.now()
+        expanded = func()
+        print(
+            f"{name}: {rows} rows to {len(expanded)} rows, "
+            f"{pd.Timestamp.now() - started}"
+        )
+
+
+def explain_analyze(session: Session, statement: str, parameters) -> dict:
+    cursor = session.connection().connection.cursor()
+    cursor.execute(f"EXPLAIN (ANALYZE, FORMAT JSON) {statement}", parameters)
+    return cursor.fetchone()[0][0]
+
+
+def benchmark_address_filter(
+    cache_set_id: int, from_height: int, to_height: int
+) -> None:
+    """
+    Source reads of a set in every ADDRESS_FILTER_MODE, meant for a local
+    Postgres and a set of the whole network (~20k addresses). Prints the wall
+    time, the size of the statements sent and the planning and execution time of
+    each of them.
+    """
+    with ConnFactory.poktinfo_conn() as session:
+        addresses = PoktInfoRepository.get_cache_set_addresses(session, cache_set_id)
+        print(f"{len(addresses)} addresses")
+        reads = {
+            "rewards": get_rewards_frame,
+            "latency": get_latency_frame,
+            "errors": get_errors_counts,
+            "node_count": get_node_counts,
+        }
+        for name, read in reads.items():
+            for mode in ["in", "any", "join"]:
+                started = pd.Timestamp.now()
+                with capture_statements(session) as statements:
+                    read(
+                        session,
+                        from_height,
+                        to_height,
+                        addresses,
+                        [cache_set_id],
+                        mode=mode,
+                    )
+                took = pd.Timestamp.now() - started
+                sent = sum(
+                    len(statement) + len(str(parameters))
+                    for statement, parameters in statements
+                )
+                plans = [
+                    explain_analyze(session, statement, parameters)
+                    for statement, parameters in statements
+                ]
+                planning = sum(plan["Planning Time"] for plan in plans)
+                execution = sum(plan["Execution Time"] for plan in plans)
+                print(
+                    f"{name} {mode}: {took}, {len(statements)} queries, {sent} bytes "
+                    f"sent, planning {planning:.1f}ms, execution {execution:.1f}ms"
+                )
+
+
+def benchmark_stream_reads(
+    cache_set_id: int, from_height: int, to_height: int, chunk_rows: int = 10000
+) -> None:
+    """
+    Wall time and peak Python memory of summing the rewards and latency of a
+    window read through the ORM against folding streamed chunks of chunk_rows.
+    """
+    with ConnFactory.poktinfo_conn() as session:
+        addresses = PoktInfoRepository.get_cache_set_addresses(session, cache_set_id)
+        args = (session, from_height, to_height, addresses, [cache_set_id])
+        reads = [
+            ("rewards ORM", lambda: sum_rewards(get_rewards_frame(*args), ["chain"])),
+            (
+                "rewards streamed",
+                lambda: fold_rewards(
+                    stream_rewards(*args, chunk_rows=chunk_rows), ["chain"]
+                ),
+            ),
+            (
+                "latency ORM",
+                lambda: sum_latency(get_latency_frame(*args), ["region", "chain"]),
+            ),
+            (
+                "latency streamed",
+                lambda: fold_latency(
+                    stream_latency(*args, chunk_rows=chunk_rows), ["region", "chain"]
+                ),
+            ),
+        ]
+        for name, read in reads:
+            tracemalloc.start()
+            started = pd.Timestamp.now()
+            totals = read()
+            took = pd.Timestamp.now() - started
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(f"{name}: {len(totals)} rows, {took}, peak {peak / 2**20:.1f} MiB")
+
+
+if __name__ == "__main__":
+    benchmark = sys.argv[1]
+    if benchmark == "node_count":
+        benchmark_node_count(int(sys.argv[2]), int(sys.argv[3]), int(sys.argv[4]))
+    elif benchmark == "bulk_write":
+        benchmark_bulk_write(int(sys.argv[2]) if len(sys.argv) > 2 else 100000)
+    elif benchmark == "error_grouping":
+        benchmark_error_grouping(int(sys.argv[2]) if len(sys.argv) > 2 else 1000000)
+    elif benchmark == "worker_pool":
+        benchmark_worker_pool(int(sys.argv[2]), int(sys.argv[3]))
+    elif benchmark == "locations":
+        benchmark_locations(int(sys.argv[2]) if len(sys.argv) > 2 else 50000)
+    elif benchmark == "stream_reads":
+        benchmark_stream_reads(*[int(arg) for arg in sys.argv[2:6]])
+    elif benchmark == "address_filter":
+        benchmark_address_filter(int(sys.argv[2]), int(sys.argv[3]), int(sys.argv[4]))
+    elif benchmark == "membership":
+        benchmark_membership(int(sys.argv[2]), int(sys.argv[3]))
+    elif benchmark == "async":
+        benchmark_async(
+            [int(cache_set_id) for cache_set_id in sys.argv[2].split(",")],
+            int(sys.argv[3]),
+            int(sys.argv[4]),
+        )
+    else:
+        raise ValueError(f"Unknown benchmark {benchmark}")
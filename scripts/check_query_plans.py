@@ -0,0 +1,160 @@
+import sys
+from contextlib import contextmanager
+
+from common.db_utils import ConnFactory
+from common.orm.repository import PoktInfoRepository
+from common.orm.schema import (
+    RewardsCacheSet,
+    LatencyCacheSet,
+    ErrorsCacheSet,
+    NodeCountCacheSet,
+    LocationCacheSet,
+    LatencyCache,
+    RewardsInfo,
+    ErrorsCache,
+)
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+
+from address_cache import get_cache_set_addresses
+from cache_queries import (
+    get_cache_set_nodes,
+    get_errors_counts,
+    get_errors_frame,
+    get_latency_frame,
+    get_node_counts,
+    get_rewards_frame,
+)
+from definitions import get_blocks_interval
+
+"""
+EXPLAIN based regression check of the queries used by the cache service, every
+scan of a table must go through an index (see scripts/create_indexes.sql).
+Sequential scans are disabled for the check so the result doesn't depend on the
+size of the tables, a query still planned with a Seq Scan has no usable index.
+
+Usage: python3 check_query_plans.py <cache_set_id> <from_height> <to_height>
+"""
+
+INDEX_SCANS = {"Index Scan", "Index Only Scan", "Bitmap Index Scan"}
+
+
+@contextmanager
+def capture_statements(session: Session):
+    statements = []
+
+    def before_cursor_execute(
+        conn, cursor, statement, parameters, context, executemany
+    ):
+        statements.append((statement, parameters))
+
+    engine = session.get_bind()
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
+def get_scans(plan: dict):
+    if "Relation Name" in plan or plan["Node Type"] in INDEX_SCANS:
+        yield plan
+    for child in plan.get("Plans", []):
+        yield from get_scans(child)
+
+
+def explain(session: Session, statement: str, parameters) -> dict:
+    cursor = session.connection().connection.cursor()
+    cursor.execute(f"EXPLAIN (FORMAT JSON) {statement}", parameters)
+    return cursor.fetchone()[0][0]["Plan"]
+
+
+def check_query_plans(cache_set_id: int, from_height: int, to_height: int) -> bool:
+    interval = get_blocks_interval()
+    with ConnFactory.poktinfo_conn() as session:
+        addresses = get_cache_set_addresses(session, cache_set_id)
+        queries = {
+            "get_cache_set_nodes": lambda: get_cache_set_nodes(session, cache_set_id),
+            "get_rewards_info": lambda: PoktInfoRepository.get_rewards_info(
+                session, from_height, to_height, addresses
+            ),
+            "get_latency_cache": lambda: PoktInfoRepository.get_latency_cache(
+                session, from_height, to_height, addresses
+            ),
+            "get_errors_dict": lambda: PoktInfoRepository.get_errors_dict(
+                session, from_height, to_height, addresses
+            ),
+            "get_errors_frame": lambda: get_errors_frame(
+                session, from_height, to_height, addresses, [cache_set_id]
+            ),
+            "get_node_counts": lambda: get_node_counts(
+                session, from_height, to_height, addresses, [cache_set_id]
+            ),
+        }
+        # The address filters of ADDRESS_FILTER_MODE other than "in"
+        for mode in ["any", "join"]:
+            for read in [
+                get_rewards_frame,
+                get_latency_frame,
+                get_errors_counts,
+                get_node_counts,
+            ]:
+                queries[f"{read.__name__} {mode}"] = lambda read=read, mode=mode: read(
+                    session,
+                    from_height,
+                    to_height,
+                    addresses,
+                    [cache_set_id],
+                    mode=mode,
+                )
+        for table_obj in [RewardsInfo, LatencyCache, ErrorsCache]:
+            queries[
+                f"does_height_exist {table_obj.__tablename__}"
+            ] = lambda table_obj=table_obj: PoktInfoRepository.does_height_exist(
+                session, to_height, table_obj, is_range=table_obj != RewardsInfo
+            )
+        for table_obj in [
+            RewardsCacheSet,
+            LatencyCacheSet,
+            ErrorsCacheSet,
+            NodeCountCacheSet,
+            LocationCacheSet,
+        ]:
+            queries[
+                f"get_last_recorded_service_height {table_obj.__tablename__}"
+            ] = lambda table_obj=table_obj: (
+                PoktInfoRepository.get_last_recorded_service_height(
+                    session,
+                    table_obj,
+                    is_range=True,
+                    cache_set_id=cache_set_id,
+                    interval=interval,
+                )
+            )
+
+        session.execute(text("SET enable_seqscan = off"))
+        is_indexed = True
+        for name, query in queries.items():
+            with capture_statements(session) as statements:
+                query()
+            for statement, parameters in statements:
+                scans = list(get_scans(explain(session, statement, parameters)))
+                seq_scans = [
+                    scan["Relation Name"]
+                    for scan in scans
+                    if scan["Node Type"] not in INDEX_SCANS
+                    and scan["Node Type"] != "Bitmap Heap Scan"
+                    and "Relation Name" in scan
+                ]
+                is_indexed &= not seq_scans
+                print(
+                    f"{'FAIL' if seq_scans else 'OK'} {name}: "
+                    f"{[(scan['Node Type'], scan.get('Index Name')) for scan in scans]}"
+                )
+        session.execute(text("RESET enable_seqscan"))
+    return is_indexed
+
+
+if __name__ == "__main__":
+    is_indexed = check_query_plans(int(sys.argv[1]), int(sys.argv[2]), int(sys.argv[3]))
+    sys.exit(0 if is_indexed else 1)
@@ -49,20 +49,38 @@ CREATE TABLE public.latency_cache_set
     avg_latency          double precision,
     avg_p90_latency      double precision,
     avg_weighted_latency double precision,
-    chain                character varying NOT NULL
+    chain                character varying NOT NULL,
+    -- Relay weighted sums and p90 sketch (latency_sketch.py), LATENCY_SUMS
+    latency_sum          double precision,
+    p90_latency_sum      double precision,
+    weighted_latency_sum double precision,
+    p90_latency_sketch   text
 );
 
 ALTER TABLE IF EXISTS public.latency_cache_set
     OWNER to postgres;
 
+CREATE TABLE public.error_group
+(
+    id                serial  NOT NULL PRIMARY KEY,
+    msg               text    NOT NULL,
+    first_seen_height integer NOT NULL
+);
+
+ALTER TABLE IF EXISTS public.error_group
+    OWNER to postgres;
+
+-- msg is NULL for rows written with ERROR_GROUPS (definitions.py), their message
+-- is the one of error_group_id
 CREATE TABLE public.errors_cache_set
 (
     cache_set_id integer NOT NULL,
     errors_count integer NOT NULL,
-    msg text NOT NULL,
+    msg text,
     start_height integer NOT NULL,
     end_height integer NOT NULL,
-    chain character varying NOT NULL
+    chain character varying NOT NULL,
+    error_group_id integer REFERENCES public.error_group (id)
 );
 
 ALTER TABLE IF EXISTS public.errors_cache_set
@@ -100,7 +118,7 @@ CREATE TABLE IF NOT EXISTS public.location_info
     org character varying(255) COLLATE pg_catalog."default",
     as_ character varying(255) COLLATE pg_catalog."default",
     CONSTRAINT location_info_pkey PRIMARY KEY (id)
-)
+);
 
 CREATE TABLE IF NOT EXISTS public.latency_cache
 (
@@ -113,7 +131,10 @@ CREATE TABLE IF NOT EXISTS public.latency_cache
     avg_p90_latency double precision,
     avg_weighted_latency double precision,
     chain character varying NOT NULL
-)
+) PARTITION BY RANGE (start_height);
+
+CREATE TABLE IF NOT EXISTS public.latency_cache_default
+    PARTITION OF public.latency_cache DEFAULT;
 
 -- Table: public.rewards_info
 
@@ -130,8 +151,11 @@ CREATE TABLE IF NOT EXISTS public.rewards_info
     token_multiplier integer NOT NULL,
     percentage double precision,
     stake_weight double precision,
-    CONSTRAINT rewards_info_pkey PRIMARY KEY (tx_hash)
-)
+    CONSTRAINT rewards_info_pkey PRIMARY KEY (tx_hash, height)
+) PARTITION BY RANGE (height);
+
+CREATE TABLE IF NOT EXISTS public.rewards_info_default
+    PARTITION OF public.rewards_info DEFAULT;
 
 -- Table: public.anomaly_tracked_cache_sets
 
@@ -264,10 +288,21 @@ CREATE TABLE IF NOT EXISTS public.errors_cache
     msg text COLLATE pg_catalog."default" NOT NULL,
     date_created timestamp with time zone,
     chain character varying(255) COLLATE pg_catalog."default",
-    CONSTRAINT errors_cache_pkey PRIMARY KEY (id)
-)
+    CONSTRAINT errors_cache_pkey PRIMARY KEY (id, start_height)
+) PARTITION BY RANGE (start_height);
 
-TABLESPACE pg_default;
+CREATE TABLE IF NOT EXISTS public.errors_cache_default
+    PARTITION OF public.errors_cache DEFAULT;
 
 ALTER TABLE IF EXISTS public.errors_cache
     OWNER to postgres;
+
+-- rewards_info, latency_cache and errors_cache are range partitioned by height,
+-- rows outside of the height partitions land in <table>_default so writes never
+-- fail, even with MANAGE_PARTITIONS off. Height partitions are PARTITION_BLOCKS
+-- wide (definitions.py) and named <table>_p<from_height>, they are created ahead
+-- of the chain tip (moving the rows of their range out of the default partition)
+-- and expired by partitions.py, e.g. the first ones:
+-- CREATE TABLE IF NOT EXISTS public.rewards_info_p0
+--     PARTITION OF public.rewards_info FOR VALUES FROM (0) TO (1000);
+-- Existing tables are converted with scripts/manage_partitions.py migrate.
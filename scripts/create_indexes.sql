@@ -1,143 +1,154 @@
 --- cache_set ---
-CREATE INDEX IF NOT EXISTS cache_set_id_idx ON public.cache_set (id DESC NULLS LAST)
-CREATE INDEX IF NOT EXISTS cache_set_set_name_idx ON public.cache_set (set_name DESC NULLS LAST)
+CREATE INDEX IF NOT EXISTS cache_set_id_idx ON public.cache_set (id DESC NULLS LAST);
+CREATE INDEX IF NOT EXISTS cache_set_set_name_idx ON public.cache_set (set_name DESC NULLS LAST);
 
 --- cache_set_node ---
-CREATE INDEX IF NOT EXISTS cache_set_node_id_idx ON public.cache_set_node (cache_set_id DESC NULLS LAST)
-CREATE INDEX IF NOT EXISTS cache_set_node_address_idx ON public.cache_set_node (address DESC NULLS LAST)
+CREATE INDEX IF NOT EXISTS cache_set_node_id_idx ON public.cache_set_node (cache_set_id DESC NULLS LAST);
+CREATE INDEX IF NOT EXISTS cache_set_node_address_idx ON public.cache_set_node (address DESC NULLS LAST);
 
 --- cache_set_state_range_entry ---
 CREATE INDEX IF NOT EXISTS cache_set_state_range_entry_service_idx
-ON public.cache_set_state_range_entry (service DESC NULLS LAST)
+ON public.cache_set_state_range_entry (service DESC NULLS LAST);
 
 --- services_state ---
 CREATE INDEX IF NOT EXISTS services_state_service_idx
-ON public.services_state (service DESC NULLS LAST)
+ON public.services_state (service DESC NULLS LAST);
 
 --- services_state_range ---
 CREATE INDEX IF NOT EXISTS services_state_range_service_idx
-ON public.services_state_range (service DESC NULLS LAST)
+ON public.services_state_range (service DESC NULLS LAST);
+
+--- error_group ---
+CREATE UNIQUE INDEX IF NOT EXISTS error_group_msg_idx
+ON public.error_group ((md5(msg)));
 
 --- errors_cache_set ---
+-- Keyed on both msg and error_group_id, only one of them is set depending on
+-- ERROR_GROUPS (definitions.py)
+CREATE UNIQUE INDEX IF NOT EXISTS errors_cache_set_key_idx
+ON public.errors_cache_set (cache_set_id, "interval", start_height, end_height, (COALESCE(chain, '')), (md5(COALESCE(msg, ''))), (COALESCE(error_group_id, 0)));
+
 CREATE INDEX IF NOT EXISTS errors_cache_set_start_height_idx
-ON public.errors_cache_set (start_height DESC NULLS LAST)
+ON public.errors_cache_set (start_height DESC NULLS LAST);
 
 CREATE INDEX IF NOT EXISTS errors_cache_set_end_height_idx
-ON public.errors_cache_set (end_height DESC NULLS LAST)
+ON public.errors_cache_set (end_height DESC NULLS LAST);
 
 CREATE INDEX IF NOT EXISTS errors_cache_set_msg_idx
-ON public.errors_cache_set (msg DESC NULLS LAST)
+ON public.errors_cache_set (msg DESC NULLS LAST);
 
 --- latency_cache_set ---
+CREATE UNIQUE INDEX IF NOT EXISTS latency_cache_set_key_idx
+ON public.latency_cache_set (cache_set_id, "interval", start_height, end_height, region, chain);
+
 CREATE INDEX IF NOT EXISTS latency_cache_set_start_height_idx
-ON public.latency_cache_set (start_height DESC NULLS LAST)
+ON public.latency_cache_set (start_height DESC NULLS LAST);
 
 CREATE INDEX IF NOT EXISTS latency_cache_set_end_height_idx
-ON public.latency_cache_set (end_height DESC NULLS LAST)
+ON public.latency_cache_set (end_height DESC NULLS LAST);
 
 CREATE INDEX IF NOT EXISTS latency_cache_set_region_idx
-ON public.latency_cache_set (region DESC NULLS LAST)
+ON public.latency_cache_set (region DESC NULLS LAST);
 
 CREATE INDEX IF NOT EXISTS latency_cache_set_avg_latency_idx
-ON public.latency_cache_set (avg_latency DESC NULLS LAST)
+ON public.latency_cache_set (avg_latency DESC NULLS LAST);
 
 --- location_cache_set ---
+CREATE UNIQUE INDEX IF NOT EXISTS location_cache_set_key_idx
+ON public.location_cache_set (cache_set_id, "interval", start_height, end_height, continent, country, city, ip, isp);
+
+-- Snapshot of a set at a height with LOCATION_SNAPSHOTS, rows are extended by end_height
+CREATE INDEX IF NOT EXISTS location_cache_set_snapshot_idx
+ON public.location_cache_set (cache_set_id, "interval", end_height);
+
 CREATE INDEX IF NOT EXISTS location_cache_set_start_height_idx
-ON public.location_cache_set (start_height DESC NULLS LAST)
+ON public.location_cache_set (start_height DESC NULLS LAST);
 
 CREATE INDEX IF NOT EXISTS location_cache_set_end_height_idx
-ON public.location_cache_set (end_height DESC NULLS LAST)
+ON public.location_cache_set (end_height DESC NULLS LAST);
 
 CREATE INDEX IF NOT EXISTS location_cache_set_region_idx
-ON public.location_cache_set (region DESC NULLS LAST)
+ON public.location_cache_set (region DESC NULLS LAST);
 
 --- rewards_cache_set ---
+CREATE UNIQUE INDEX IF NOT EXISTS rewards_cache_set_key_idx
+ON public.rewards_cache_set (cache_set_id, "interval", start_height, end_height, chain);
+
 CREATE INDEX IF NOT EXISTS rewards_cache_set_start_height_idx
-ON public.rewards_cache_set (start_height DESC NULLS LAST)
+ON public.rewards_cache_set (start_height DESC NULLS LAST);
 
 CREATE INDEX IF NOT EXISTS rewards_cache_set_end_height_idx
-ON public.rewards_cache_set (end_height DESC NULLS LAST)
+ON public.rewards_cache_set (end_height DESC NULLS LAST);
 
 --- node_count_cache_set ---
+CREATE UNIQUE INDEX IF NOT EXISTS node_count_cache_set_key_idx
+ON public.node_count_cache_set (cache_set_id, "interval", start_height, end_height, (COALESCE(chain, '')));
+
 CREATE INDEX IF NOT EXISTS node_count_cache_set_start_height_idx
-ON public.node_count_cache_set (start_height DESC NULLS LAST)
+ON public.node_count_cache_set (start_height DESC NULLS LAST);
 
 CREATE INDEX IF NOT EXISTS node_count_cache_set_end_height_idx
-ON public.node_count_cache_set (end_height DESC NULLS LAST)
+ON public.node_count_cache_set (end_height DESC NULLS LAST);
 
 --- nodes_info ---
 CREATE INDEX IF NOT EXISTS nodes_info_height_idx
-ON public.nodes_info (height DESC NULLS LAST)
+ON public.nodes_info (height DESC NULLS LAST);
 
 CREATE INDEX IF NOT EXISTS nodes_info_start_height_idx
-ON public.nodes_info (start_height DESC NULLS LAST)
+ON public.nodes_info (start_height DESC NULLS LAST);
 
 CREATE INDEX IF NOT EXISTS nodes_info_end_height_idx
-ON public.nodes_info (end_height DESC NULLS LAST)
+ON public.nodes_info (end_height DESC NULLS LAST);
 
 CREATE INDEX IF NOT EXISTS nodes_info_address_idx
-ON public.nodes_info (address DESC NULLS LAST)
+ON public.nodes_info (address DESC NULLS LAST);
 
 CREATE INDEX IF NOT EXISTS nodes_info_url_idx
-ON public.nodes_info (url DESC NULLS LAST)
+ON public.nodes_info (url DESC NULLS LAST);
 
 --- location_info ---
 CREATE INDEX IF NOT EXISTS location_info_height_idx
-ON public.location_info (height DESC NULLS LAST)
+ON public.location_info (height DESC NULLS LAST);
 
 CREATE INDEX IF NOT EXISTS location_info_start_height_idx
-ON public.location_info (start_height DESC NULLS LAST)
+ON public.location_info (start_height DESC NULLS LAST);
 
 CREATE INDEX IF NOT EXISTS location_info_end_height_idx
-ON public.location_info (end_height DESC NULLS LAST)
+ON public.location_info (end_height DESC NULLS LAST);
 
 CREATE INDEX IF NOT EXISTS location_info_address_idx
-ON public.location_info (address DESC NULLS LAST)
+ON public.location_info (address DESC NULLS LAST);
 
 CREATE INDEX IF NOT EXISTS location_info_continent_idx
-ON public.location_info (continent DESC NULLS LAST)
+ON public.location_info (continent DESC NULLS LAST);
 
 --- errors_cache ---
 CREATE INDEX IF NOT EXISTS errors_cache_start_height_idx
-ON public.errors_cache (start_height DESC NULLS LAST)
+ON public.errors_cache (start_height DESC NULLS LAST);
 
 CREATE INDEX IF NOT EXISTS errors_cache_end_height_idx
-ON public.errors_cache (end_height DESC NULLS LAST)
+ON public.errors_cache (end_height DESC NULLS LAST);
 
 --- latency_cache ---
 CREATE INDEX IF NOT EXISTS latency_cache_address_idx
-ON public.latency_cache (address DESC NULLS LAST)
+ON public.latency_cache (address DESC NULLS LAST);
 
 CREATE INDEX IF NOT EXISTS latency_cache_start_height_idx
-ON public.latency_cache (start_height DESC NULLS LAST)
+ON public.latency_cache (start_height DESC NULLS LAST);
 
 CREATE INDEX IF NOT EXISTS latency_cache_end_height_idx
-ON public.latency_cache (end_height DESC NULLS LAST)
+ON public.latency_cache (end_height DESC NULLS LAST);
 
 CREATE INDEX IF NOT EXISTS latency_cache_region_idx
-ON public.latency_cache (region DESC NULLS LAST)
+ON public.latency_cache (region DESC NULLS LAST);
 
 CREATE INDEX IF NOT EXISTS latency_cache_avg_latency_idx
-ON public.latency_cache (avg_latency DESC NULLS LAST)
+ON public.latency_cache (avg_latency DESC NULLS LAST);
 
 CREATE INDEX IF NOT EXISTS latency_cache_chain_idx
-ON public.latency_cache (chain DESC NULLS LAST)
+ON public.latency_cache (chain DESC NULLS LAST);
 
 --- rewards_info ---
--- Index: idx_height_rewards_info
-
--- DROP INDEX IF EXISTS public.idx_height_rewards_info;
-
-CREATE INDEX IF NOT EXISTS idx_height_rewards_info
-    ON public.rewards_info USING btree
-    (height ASC NULLS LAST);
--- Index: idx_tx_hash_rewards_info
-
--- DROP INDEX IF EXISTS public.idx_tx_hash_rewards_info;
-
-CREATE INDEX IF NOT EXISTS idx_tx_hash_rewards_info
-    ON public.rewards_info USING btree
-    (tx_hash ASC NULLS LAST);
 -- Index: rewards_info_address_idx
 
 -- DROP INDEX IF EXISTS public.rewards_info_address_idx;
@@ -152,3 +163,69 @@ CREATE INDEX IF NOT EXISTS rewards_info_address_idx
 CREATE INDEX IF NOT EXISTS rewards_info_height_idx
     ON public.rewards_info USING btree
     (height DESC NULLS LAST);
+
+--- access path indexes ---
+-- Composite/covering indexes for the queries of the cache service, checked by
+-- scripts/check_query_plans.py. Cache set reads filter on
+-- cache_set_id + interval + height range (the *_cache_set_key_idx unique indexes
+-- serve start_height ranges, the indexes below serve last recorded height lookups).
+
+CREATE INDEX IF NOT EXISTS rewards_cache_set_last_height_idx
+ON public.rewards_cache_set (cache_set_id, "interval", end_height DESC);
+
+CREATE INDEX IF NOT EXISTS latency_cache_set_last_height_idx
+ON public.latency_cache_set (cache_set_id, "interval", end_height DESC);
+
+CREATE INDEX IF NOT EXISTS errors_cache_set_last_height_idx
+ON public.errors_cache_set (cache_set_id, "interval", end_height DESC);
+
+CREATE INDEX IF NOT EXISTS node_count_cache_set_last_height_idx
+ON public.node_count_cache_set (cache_set_id, "interval", end_height DESC);
+
+CREATE INDEX IF NOT EXISTS location_cache_set_last_height_idx
+ON public.location_cache_set (cache_set_id, "interval", end_height DESC);
+
+CREATE INDEX IF NOT EXISTS cache_set_state_range_entry_set_idx
+ON public.cache_set_state_range_entry (cache_set_id, service, "interval", end_height DESC);
+
+CREATE INDEX IF NOT EXISTS cache_set_node_members_idx
+ON public.cache_set_node (cache_set_id) INCLUDE (address, start_height, end_height);
+
+CREATE INDEX IF NOT EXISTS services_state_height_idx
+ON public.services_state (service, height DESC);
+
+CREATE INDEX IF NOT EXISTS services_state_range_height_idx
+ON public.services_state_range (service, end_height DESC);
+
+-- address + height range reads of the source tables, covering so they can be
+-- answered with index only scans (errors_cache.msg is left out, long messages
+-- don't fit in a btree tuple)
+CREATE INDEX IF NOT EXISTS rewards_info_address_height_idx
+ON public.rewards_info (address, height)
+INCLUDE (chain_id, reward, relays, token_multiplier, percentage, stake_weight, tx_hash);
+
+CREATE INDEX IF NOT EXISTS latency_cache_address_height_idx
+ON public.latency_cache (address, start_height)
+INCLUDE (end_height, region, chain, total_relays, avg_latency, avg_p90_latency, avg_weighted_latency);
+
+CREATE INDEX IF NOT EXISTS errors_cache_provider_height_idx
+ON public.errors_cache (provider, start_height)
+INCLUDE (end_height, chain, errors_count);
+
+CREATE INDEX IF NOT EXISTS location_info_address_height_idx
+ON public.location_info (address, start_height, end_height);
+
+-- Heights of the append only source tables grow with the physical row order,
+-- BRIN indexes serve whole network height range scans at a fraction of the size
+CREATE INDEX IF NOT EXISTS rewards_info_height_brin_idx
+ON public.rewards_info USING brin (height) WITH (pages_per_range = 32);
+
+CREATE INDEX IF NOT EXISTS errors_cache_height_brin_idx
+ON public.errors_cache USING brin (start_height, end_height) WITH (pages_per_range = 32);
+
+CREATE INDEX IF NOT EXISTS latency_cache_height_brin_idx
+ON public.latency_cache USING brin (start_height, end_height) WITH (pages_per_range = 32);
+
+-- Duplicates of rewards_info_height_idx and of the rewards_info primary key
+DROP INDEX IF EXISTS public.idx_height_rewards_info;
+DROP INDEX IF EXISTS public.idx_tx_hash_rewards_info;
@@ -0,0 +1,39 @@
+-- NOTIFY the cache service scheduler (scheduler.py) whenever an upstream service
+-- records progress, the payload is {"service", "height", "status"}. The channel
+-- is the argument of the triggers and must be SCHEDULER_CHANNEL (definitions.py),
+-- the scheduler logs an error on start when it isn't.
+
+CREATE OR REPLACE FUNCTION public.notify_services_state()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    height integer;
+BEGIN
+    -- NEW fields are resolved when a statement runs, each table only has one of them
+    IF TG_TABLE_NAME = 'services_state_range' THEN
+        height := NEW.end_height;
+    ELSE
+        height := NEW.height;
+    END IF;
+    PERFORM pg_notify(
+        TG_ARGV[0],
+        json_build_object(
+            'service', NEW.service,
+            'height', height,
+            'status', NEW.status
+        )::text
+    );
+    RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS services_state_notify ON public.services_state;
+CREATE TRIGGER services_state_notify
+AFTER INSERT OR UPDATE ON public.services_state
+FOR EACH ROW EXECUTE FUNCTION public.notify_services_state('services_state');
+
+DROP TRIGGER IF EXISTS services_state_range_notify ON public.services_state_range;
+CREATE TRIGGER services_state_range_notify
+AFTER INSERT OR UPDATE ON public.services_state_range
+FOR EACH ROW EXECUTE FUNCTION public.notify_services_state('services_state');
@@ -0,0 +1,108 @@
+-- One-shot migration: remove duplicated cache set rows (left by retries of stuck
+-- heights or by the live loop overlapping with cache_set_historical) and add the
+-- unique natural keys used by the "upsert" BULK_WRITE_MODE (the default), run it
+-- on existing tables before deploying that mode.
+-- The most recently written copy of every duplicated row is kept.
+
+BEGIN;
+
+--- rewards_cache_set ---
+DELETE FROM public.rewards_cache_set
+WHERE ctid IN (
+    SELECT ctid FROM (
+        SELECT ctid, ROW_NUMBER() OVER (
+            PARTITION BY cache_set_id, "interval", start_height, end_height, chain
+            ORDER BY ctid DESC
+        ) AS copy_number
+        FROM public.rewards_cache_set
+    ) copies
+    WHERE copy_number > 1
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS rewards_cache_set_key_idx
+ON public.rewards_cache_set (cache_set_id, "interval", start_height, end_height, chain);
+
+--- latency_cache_set ---
+DELETE FROM public.latency_cache_set
+WHERE ctid IN (
+    SELECT ctid FROM (
+        SELECT ctid, ROW_NUMBER() OVER (
+            PARTITION BY cache_set_id, "interval", start_height, end_height, region, chain
+            ORDER BY ctid DESC
+        ) AS copy_number
+        FROM public.latency_cache_set
+    ) copies
+    WHERE copy_number > 1
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS latency_cache_set_key_idx
+ON public.latency_cache_set (cache_set_id, "interval", start_height, end_height, region, chain);
+
+--- errors_cache_set ---
+-- The key covers error_group_id too, added here if scripts/migrate_error_groups.sql
+-- wasn't applied yet
+CREATE TABLE IF NOT EXISTS public.error_group
+(
+    id                serial  NOT NULL PRIMARY KEY,
+    msg               text    NOT NULL,
+    first_seen_height integer NOT NULL
+);
+
+ALTER TABLE public.errors_cache_set
+    ADD COLUMN IF NOT EXISTS error_group_id integer REFERENCES public.error_group (id);
+
+DELETE FROM public.errors_cache_set
+WHERE ctid IN (
+    SELECT ctid FROM (
+        SELECT ctid, ROW_NUMBER() OVER (
+            PARTITION BY cache_set_id, "interval", start_height, end_height,
+                COALESCE(chain, ''), md5(COALESCE(msg, '')), COALESCE(error_group_id, 0)
+            ORDER BY ctid DESC
+        ) AS copy_number
+        FROM public.errors_cache_set
+    ) copies
+    WHERE copy_number > 1
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS errors_cache_set_key_idx
+ON public.errors_cache_set (cache_set_id, "interval", start_height, end_height, (COALESCE(chain, '')), (md5(COALESCE(msg, ''))), (COALESCE(error_group_id, 0)));
+
+--- node_count_cache_set ---
+DELETE FROM public.node_count_cache_set
+WHERE ctid IN (
+    SELECT ctid FROM (
+        SELECT ctid, ROW_NUMBER() OVER (
+            PARTITION BY cache_set_id, "interval", start_height, end_height, COALESCE(chain, '')
+            ORDER BY ctid DESC
+        ) AS copy_number
+        FROM public.node_count_cache_set
+    ) copies
+    WHERE copy_number > 1
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS node_count_cache_set_key_idx
+ON public.node_count_cache_set (cache_set_id, "interval", start_height, end_height, (COALESCE(chain, '')));
+
+--- location_cache_set ---
+DELETE FROM public.location_cache_set
+WHERE ctid IN (
+    SELECT ctid FROM (
+        SELECT ctid, ROW_NUMBER() OVER (
+            PARTITION BY cache_set_id, "interval", start_height, end_height, continent, country, city, ip, isp
+            ORDER BY ctid DESC
+        ) AS copy_number
+        FROM public.location_cache_set
+    ) copies
+    WHERE copy_number > 1
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS location_cache_set_key_idx
+ON public.location_cache_set (cache_set_id, "interval", start_height, end_height, continent, country, city, ip, isp);
+
+COMMIT;
+
+VACUUM ANALYZE public.rewards_cache_set;
+VACUUM ANALYZE public.latency_cache_set;
+VACUUM ANALYZE public.errors_cache_set;
+VACUUM ANALYZE public.node_count_cache_set;
+VACUUM ANALYZE public.location_cache_set;
@@ -0,0 +1,43 @@
+import sys
+
+from common.db_utils import ConnFactory
+from common.utils import get_last_block_height
+
+from partitions import (
+    PARTITIONED_TABLES,
+    get_partitions,
+    maintain_partitions,
+    migrate_to_partitioned,
+)
+
+"""
+Manage the height partitions of rewards_info, latency_cache and errors_cache,
+maintain is also run by run_cache_service.py when MANAGE_PARTITIONS is set.
+
+Usage: python3 manage_partitions.py maintain [height]
+Usage: python3 manage_partitions.py list
+Usage: python3 manage_partitions.py migrate <table_name> [height]
+
+maintain creates partitions ahead of height (default current height) and drops
+the ones past retention. migrate converts an existing heap table, run it once
+per table then rerun scripts/create_indexes.sql.
+"""
+
+if __name__ == "__main__":
+    command = sys.argv[1]
+    with ConnFactory.poktinfo_conn() as session:
+        if command == "maintain":
+            height = int(sys.argv[2]) if len(sys.argv) > 2 else get_last_block_height()
+            maintain_partitions(session, height)
+        elif command == "list":
+            for table_name in PARTITIONED_TABLES:
+                for name, from_height, to_height in get_partitions(session, table_name):
+                    print(f"{table_name} {name} [{from_height}, {to_height})")
+        elif command == "migrate":
+            table_name = sys.argv[2]
+            height = int(sys.argv[3]) if len(sys.argv) > 3 else get_last_block_height()
+            migrate_to_partitioned(session, table_name, height)
+            maintain_partitions(session, height)
+        else:
+            print(f"Unknown command {command}")
+            sys.exit(1)
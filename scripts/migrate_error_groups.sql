@@ -0,0 +1,52 @@
+-- Move the messages of errors_cache_set to the error_group dictionary table,
+-- set ERROR_GROUPS = True in definitions.py once this is applied. Rows written
+-- before keep working through the errors_cache_set_msg view.
+
+CREATE TABLE IF NOT EXISTS public.error_group
+(
+    id                serial  NOT NULL PRIMARY KEY,
+    msg               text    NOT NULL,
+    first_seen_height integer NOT NULL
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS error_group_msg_idx
+ON public.error_group ((md5(msg)));
+
+INSERT INTO public.error_group (msg, first_seen_height)
+SELECT msg, MIN(start_height)
+FROM public.errors_cache_set
+WHERE msg IS NOT NULL
+GROUP BY msg
+ON CONFLICT ((md5(msg))) DO NOTHING;
+
+ALTER TABLE public.errors_cache_set
+    ADD COLUMN IF NOT EXISTS error_group_id integer REFERENCES public.error_group (id);
+ALTER TABLE public.errors_cache_set
+    ALTER COLUMN msg DROP NOT NULL;
+
+UPDATE public.errors_cache_set
+SET error_group_id = error_group.id, msg = NULL
+FROM public.error_group
+WHERE md5(errors_cache_set.msg) = md5(error_group.msg)
+  AND errors_cache_set.error_group_id IS NULL;
+
+-- errors_cache_set_key_idx (scripts/create_indexes.sql) covers error_group_id
+-- already, the rows keep their key
+DROP INDEX IF EXISTS public.errors_cache_set_msg_idx;
+
+-- errors_cache_set rows with their message text, for readers of msg
+CREATE OR REPLACE VIEW public.errors_cache_set_msg AS
+SELECT errors_cache_set.cache_set_id,
+       errors_cache_set.errors_count,
+       COALESCE(errors_cache_set.msg, error_group.msg) AS msg,
+       errors_cache_set.start_height,
+       errors_cache_set.end_height,
+       errors_cache_set.chain,
+       errors_cache_set."interval",
+       errors_cache_set.error_group_id
+FROM public.errors_cache_set
+LEFT JOIN public.error_group ON error_group.id = errors_cache_set.error_group_id;
+
+-- Rewrites the table to give the space of the messages back, takes an
+-- exclusive lock for the duration
+VACUUM FULL ANALYZE public.errors_cache_set;
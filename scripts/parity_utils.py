@@ -0,0 +1,232 @@
+import math
+import re
+
+import numpy as np
+import pandas as pd
+
+from cache_aggregations import CONTINENT_MAP, LOCATION_COLUMNS, LOCATION_KEYS
+from error_grouping import MODE, SAVED_PHRASES
+
+"""
+Reference implementations, synthetic frames and helpers of the parity checks,
+shared by the scripts/verify_*_parity.py scripts, the benchmarks and the tests.
+"""
+
+# Messages covering every saved phrase mode, the fallback and the cut_middle
+# edge cases, checked on top of the ones read from errors_cache
+GOLDEN_ERROR_MSGS = [
+    "Missing trie node 0x1234abcd (path ): not found",
+    "No state available for block 0x8f2e",
+    "execution Reverted: 0x08c379a0",
+    "502 Bad Gateway",
+    "request failed: 503 Service Unavailable",
+    "400 Bad Request: invalid json",
+    "Method Not Found",
+    "Method Not Allowed: eth_sign",
+    "504 Gateway Time-out",
+    "Internal Server Error: upstream",
+    "Service Temporarily Unavailable",
+    "the block height passed is invalid: 1234",
+    "rpc error: code = 14",
+    "Block 1234567 could not be found",
+    "Block could not be found",
+    "tx.origin 0xabc is not authorized to deploy a contract",
+    "getDeleteStateObject (0xabc) error: missing",
+    'Relay {"response": "timeout"}',
+    '{"response": {"code": 1}}',
+    "Block",
+    "",
+    ":",
+    "context deadline exceeded",
+    "dial tcp 10.0.0.1:8081: connect: connection refused",
+    "UNKNOWN 123 MESSAGE: with: many: colons",
+    "  leading spaces: x",
+    "ÉRROR Ünicode 42: x",
+]
+
+
+def legacy_filter_error_msg(msg: str, mode: str = "first"):
+    """
+    filter_error_msg before it was compiled and memoized, the reference of the
+    error_groups check.
+    """
+
+    def filter_msg_for_mode(msg: str, mode: str, phrase: str = None):
+        split_msg = msg.split(":")
+        if phrase is not None:
+            split_msg[0] = phrase
+        if mode == "first":
+            return split_msg[0]
+        elif mode == "first_last":
+            return f"{split_msg[0]}:{split_msg[-1]}"
+        return None
+
+    def is_saved_phrase_in_msg(saved_phrase: str, msg: str, mode: str):
+        if mode == "cut_middle":
+            split_msg = msg.split(" ")
+            split_msg = [split_msg[0]] + split_msg[2:]
+            return saved_phrase in " ".join(split_msg)
+        return saved_phrase in msg
+
+    msg = re.sub(r"[0-9]", "", msg).lower()
+    for saved_phrase in SAVED_PHRASES:
+        phrase_mode = SAVED_PHRASES[saved_phrase]
+        saved_phrase = saved_phrase.lower()
+        if is_saved_phrase_in_msg(saved_phrase, msg.split(":")[0], phrase_mode):
+            return filter_msg_for_mode(msg, phrase_mode, saved_phrase)
+    return filter_msg_for_mode(msg, mode)
+
+
+def legacy_create_msg_groups(errors_dict):
+    chain_msg_groups = {}
+    for errors_count, chain, msg in errors_dict:
+        error_msg = legacy_filter_error_msg(msg, MODE)
+        chain_msg_groups.setdefault(chain, {})
+        if error_msg is not None:
+            chain_msg_groups[chain][error_msg] = (
+                chain_msg_groups[chain].get(error_msg, 0) + errors_count
+            )
+    return chain_msg_groups
+
+
+def legacy_aggregate_locations(locations_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    The nested groupby cache_locations() used before aggregate_locations().
+    """
+    location_cache_sets = []
+    continent_groups = locations_df.groupby([locations_df["continent"]])
+    for continent, continent_group in continent_groups:
+        country_groups = continent_group.groupby([continent_group["country"]])
+        for country, country_group in country_groups:
+            city_groups = country_group.groupby([country_group["city"]])
+            for city, city_group in city_groups:
+                ip_groups = city_group.groupby([city_group["ip"]])
+                for ip, ip_group in ip_groups:
+                    ran_froms = ip_group["ran_from"].tolist()
+                    for ran_from in ran_froms:
+                        continent_id = (
+                            CONTINENT_MAP[continent]
+                            if continent in CONTINENT_MAP
+                            else "na"
+                        )
+                        if continent_id == ran_from:
+                            ip_group = ip_group[ip_group["ran_from"] == ran_from]
+
+                    isp_groups = ip_group.groupby([ip_group["isp"]])
+                    for isp, isp_group in isp_groups:
+                        node_count = isp_group["address"].count()
+                        lat, lon = isp_group["lat"].iloc[0], isp_group["lon"].iloc[0]
+                        location_cache_sets.append(
+                            dict(
+                                continent=str(continent),
+                                country=str(country),
+                                city=str(city),
+                                ip=str(ip),
+                                isp=str(isp),
+                                node_count=int(node_count),
+                                lat=str(lat),
+                                lon=str(lon),
+                            )
+                        )
+    return pd.DataFrame(
+        location_cache_sets, columns=LOCATION_KEYS + ["node_count", "lat", "lon"]
+    )
+
+
+def synthetic_locations_frame(nodes: int, seed: int = 0) -> pd.DataFrame:
+    """
+    location_info rows of nodes addresses, some ips are located from several
+    ran_from instances with different coordinates and some values are missing.
+    """
+    rng = np.random.default_rng(seed)
+    places = [
+        ("North America", "US", "Ashburn"),
+        ("North America", "CA", "Toronto"),
+        ("Europe", "DE", "Frankfurt"),
+        ("Europe", "FI", "Helsinki"),
+        ("Asia", "SG", "Singapore"),
+        ("Oceania", "AU", "Sydney"),
+    ]
+    rows = []
+    for node in range(nodes):
+        continent, country, city = places[rng.integers(len(places))]
+        ip = f"10.{rng.integers(4)}.{rng.integers(256)}.{rng.integers(256)}"
+        isp = str(rng.choice(["Hetzner", "OVH", "AWS", "DigitalOcean"]))
+        for ran_from in rng.choice(["na", "eu", "sg"], rng.integers(1, 4), False):
+            rows.append(
+                dict(
+                    address=f"{node:040x}",
+                    ip=ip,
+                    continent=continent,
+                    country=country,
+                    city=city if rng.random() > 0.01 else None,
+                    isp=isp if rng.random() > 0.01 else None,
+                    lat=str(round(rng.uniform(-90, 90), 4)),
+                    lon=str(round(rng.uniform(-180, 180), 4)),
+                    ran_from=str(ran_from),
+                )
+            )
+    return pd.DataFrame(rows).reindex(columns=LOCATION_COLUMNS)
+
+
+def synthetic_membership_frame(
+    cache_sets: int, addresses: int, seed: int = 0
+) -> pd.DataFrame:
+    """
+    cache_set_node rows of cache_sets sets over a pool of addresses, sets share
+    addresses and some rows start or end at a height.
+    """
+    rng = np.random.default_rng(seed)
+    frames = []
+    for cache_set_id in range(1, cache_sets + 1):
+        members = rng.choice(addresses, rng.integers(1, addresses // 4), False)
+        start_heights = np.where(
+            rng.random(len(members)) < 0.2, rng.integers(0, 1000, len(members)), np.nan
+        )
+        end_heights = np.where(
+            rng.random(len(members)) < 0.2,
+            rng.integers(1000, 2000, len(members)),
+            np.nan,
+        )
+        frames.append(
+            pd.DataFrame(
+                {
+                    "cache_set_id": cache_set_id,
+                    "address": [f"{member:040x}" for member in members],
+                    "start_height": start_heights,
+                    "end_height": end_heights,
+                }
+            )
+        )
+    return pd.concat(frames, ignore_index=True)
+
+
+def legacy_set_addresses(nodes: pd.DataFrame, height: int = None) -> list:
+    has_ended = nodes["end_height"].notna()
+    if height is None:
+        return nodes["address"][~has_ended].tolist()
+    has_started = nodes["start_height"].isna() | (nodes["start_height"] <= height)
+    has_ended &= nodes["end_height"] <= height
+    return nodes["address"][has_started & ~has_ended].tolist()
+
+
+def compare_frames(
+    name: str, actual: pd.DataFrame, expected: pd.DataFrame, keys: list, values: list
+) -> bool:
+    merged = actual.merge(
+        expected, on=keys, how="outer", suffixes=("", "_expected"), indicator=True
+    )
+    is_equal = True
+    for row in merged.itertuples(index=False):
+        row = row._asdict()
+        is_row_equal = row["_merge"] == "both" and all(
+            math.isclose(
+                row[value], row[f"{value}_expected"], rel_tol=1e-9, abs_tol=1e-6
+            )
+            for value in values
+        )
+        if not is_row_equal:
+            is_equal = False
+            print(f"MISMATCH {name} {row}")
+    print(f"{'OK' if is_equal else 'MISMATCH'} {name}, {len(merged)} rows")
+    return is_equal
@@ -0,0 +1,78 @@
+import sys
+
+import pandas as pd
+from common.db_utils import ConnFactory
+from common.orm.repository import PoktInfoRepository
+
+from error_grouping import create_msg_groups, create_msg_groups_frame, filter_error_msg
+from scripts.parity_utils import (
+    GOLDEN_ERROR_MSGS,
+    legacy_create_msg_groups,
+    legacy_filter_error_msg,
+)
+
+"""
+Check the compiled error grouping against the original implementation on the
+errors of a cache set, tests/test_error_grouping.py checks GOLDEN_ERROR_MSGS
+without a database
+
+Usage: python3 -m scripts.verify_error_groups_parity
+    <cache_set_id> <from_height> <to_height>
+"""
+
+
+def verify_error_groups(cache_set_id: int, from_height: int, to_height: int) -> bool:
+    """
+    Compare filter_error_msg and create_msg_groups with the legacy
+    implementations on GOLDEN_ERROR_MSGS and the errors of the set between the
+    heights.
+    """
+    errors_dict = [(1, "0021", msg) for msg in GOLDEN_ERROR_MSGS]
+    errors_dict += [(2, None, msg) for msg in GOLDEN_ERROR_MSGS]
+    with ConnFactory.poktinfo_conn() as session:
+        addresses = PoktInfoRepository.get_cache_set_addresses(session, cache_set_id)
+        errors_dict += PoktInfoRepository.get_errors_dict(
+            session, from_height, to_height, addresses
+        )
+
+    is_equal = True
+    for mode in ["first", "first_last", "second"]:
+        for msg in {msg for _, _, msg in errors_dict}:
+            expected = legacy_filter_error_msg(msg, mode)
+            # Twice, the second call is answered by the LRU cache
+            for actual in [filter_error_msg(msg, mode), filter_error_msg(msg, mode)]:
+                if actual != expected:
+                    is_equal = False
+                    print(f"MISMATCH {mode} {msg!r}: {actual!r} vs {expected!r}")
+    is_groups_equal = create_msg_groups(errors_dict) == legacy_create_msg_groups(
+        errors_dict
+    )
+    is_equal &= is_groups_equal
+    print(
+        f"{'OK' if is_groups_equal else 'MISMATCH'} create_msg_groups of "
+        f"{len(errors_dict)} error groups"
+    )
+
+    frame_groups = {}
+    errors_df = pd.DataFrame(errors_dict, columns=["errors_count", "chain", "msg"])
+    for row in create_msg_groups_frame(errors_df).itertuples(index=False):
+        chain = row.chain if pd.notna(row.chain) else None
+        frame_groups.setdefault(chain, {})[row.msg] = row.errors_count
+    # The frame has no rows for chains without any grouped message
+    expected_groups = {
+        chain: msg_groups
+        for chain, msg_groups in legacy_create_msg_groups(errors_dict).items()
+        if msg_groups
+    }
+    is_frame_equal = frame_groups == expected_groups
+    is_equal &= is_frame_equal
+    print(
+        f"{'OK' if is_frame_equal else 'MISMATCH'} create_msg_groups_frame of "
+        f"{len(errors_dict)} error groups"
+    )
+    return is_equal
+
+
+if __name__ == "__main__":
+    is_equal = verify_error_groups(*[int(arg) for arg in sys.argv[1:4]])
+    sys.exit(0 if is_equal else 1)
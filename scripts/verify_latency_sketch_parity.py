@@ -0,0 +1,64 @@
+import math
+import sys
+
+import pandas as pd
+from common.db_utils import ConnFactory
+from common.orm.repository import PoktInfoRepository
+
+from cache_aggregations import LATENCY_COLUMNS
+from latency_sketch import SKETCH_RELATIVE_ACCURACY, get_quantile, sketch_frame
+
+"""
+Check the quantiles of the p90 latency sketches of a cache set against the
+exact relay weighted quantiles of its latency_cache rows
+
+Usage: python3 -m scripts.verify_latency_sketch_parity
+    <cache_set_id> <from_height> <to_height>
+"""
+
+
+def verify_latency_sketch(cache_set_id: int, from_height: int, to_height: int) -> bool:
+    """
+    Compare the quantiles of the relay weighted p90 latency sketches of a set
+    with the exact ones, they have to be within SKETCH_RELATIVE_ACCURACY.
+    """
+    keys = ["region", "chain"]
+    with ConnFactory.poktinfo_conn() as session:
+        addresses = PoktInfoRepository.get_cache_set_addresses(session, cache_set_id)
+        latency_cache = PoktInfoRepository.get_latency_cache(
+            session, from_height, to_height, addresses
+        )
+    latency_df = pd.DataFrame(
+        data=[latency.__to_dict__() for latency in latency_cache],
+        columns=LATENCY_COLUMNS,
+    )
+    latency_df = latency_df[latency_df["avg_p90_latency"].notna()]
+    sketches = sketch_frame(
+        latency_df, keys, "avg_p90_latency", "total_relays", "sketch"
+    ).set_index(keys)
+    is_equal = True
+    for group, rows in latency_df.groupby(keys):
+        rows = rows.sort_values("avg_p90_latency")
+        cumulative = rows["total_relays"].cumsum().to_numpy()
+        if not len(cumulative) or cumulative[-1] <= 0:
+            continue
+        for quantile in [0.5, 0.9, 0.99]:
+            rank = cumulative.searchsorted(quantile * cumulative[-1])
+            expected = rows["avg_p90_latency"].iloc[rank]
+            actual = get_quantile(sketches.loc[group, "sketch"], quantile)
+            is_close = math.isclose(
+                actual, expected, rel_tol=SKETCH_RELATIVE_ACCURACY + 1e-6
+            )
+            is_equal &= is_close
+            print(
+                f"{'OK' if is_close else 'MISMATCH'} {group} q{quantile}: "
+                f"{actual} vs {expected}"
+            )
+    return is_equal
+
+
+if __name__ == "__main__":
+    is_equal = verify_latency_sketch(
+        int(sys.argv[1]), int(sys.argv[2]), int(sys.argv[3])
+    )
+    sys.exit(0 if is_equal else 1)
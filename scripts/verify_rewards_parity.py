@@ -0,0 +1,56 @@
+import math
+import sys
+
+import pandas as pd
+from common.db_utils import ConnFactory
+from common.orm.repository import PoktInfoRepository
+from common.utils import POKT_MULTIPLIER
+
+from cache_aggregations import REWARDS_COLUMNS, sum_rewards
+
+"""
+Check the per 15k normalized rewards of sum_rewards() against
+PoktInfoRepository.get_rewards_total_per15k()
+
+Usage: python3 -m scripts.verify_rewards_parity
+    <cache_set_id> <from_height> <to_height>
+"""
+
+
+def verify_rewards(cache_set_id: int, from_height: int, to_height: int) -> bool:
+    """
+    Compare the per 15k normalized rewards of every chain with
+    PoktInfoRepository.get_rewards_total_per15k.
+    """
+    with ConnFactory.poktinfo_conn() as session:
+        addresses = PoktInfoRepository.get_cache_set_addresses(session, cache_set_id)
+        rewards_info = PoktInfoRepository.get_rewards_info(
+            session, from_height, to_height, addresses
+        )
+        rewards_df = pd.DataFrame(
+            data=[reward.__to_dict__() for reward in rewards_info],
+            columns=REWARDS_COLUMNS,
+        )
+        totals = sum_rewards(rewards_df, ["chain"])
+        is_equal = True
+        for row in totals.itertuples(index=False):
+            expected = (
+                PoktInfoRepository.get_rewards_total_per15k(
+                    session, from_height, to_height, addresses, chain=str(row.chain)
+                )
+                / POKT_MULTIPLIER
+            )
+            is_chain_equal = math.isclose(
+                row.normalized_rewards_total, expected, rel_tol=1e-9, abs_tol=1e-6
+            )
+            is_equal &= is_chain_equal
+            print(
+                f"{'OK' if is_chain_equal else 'MISMATCH'} chain {row.chain}: "
+                f"{row.normalized_rewards_total} vs {expected}"
+            )
+    return is_equal
+
+
+if __name__ == "__main__":
+    is_equal = verify_rewards(int(sys.argv[1]), int(sys.argv[2]), int(sys.argv[3]))
+    sys.exit(0 if is_equal else 1)
@@ -0,0 +1,97 @@
+import sys
+
+import pandas as pd
+from common.db_utils import ConnFactory
+from common.orm.repository import PoktInfoRepository
+
+from cache_aggregations import (
+    LATENCY_COLUMNS,
+    REWARDS_COLUMNS,
+    finalize_latency,
+    sum_latency,
+    sum_rewards,
+)
+from cache_queries import get_rollup_frame
+from error_grouping import create_msg_groups_frame
+from scripts.parity_utils import compare_frames
+
+"""
+Check the roll-up of the cache set rows of a finer interval against caching
+the coarse window from the source tables
+
+Usage: python3 -m scripts.verify_rollup_parity
+    <cache_set_id> <from_height> <interval> <fine_interval>
+"""
+
+
+def verify_rollup(
+    cache_set_id: int, from_height: int, interval: int, fine_interval: int
+) -> bool:
+    """
+    Compare the roll-up of the fine_interval rows of a set between from_height
+    and from_height + interval with caching the window from the source tables.
+    Source rows crossing the end of a finer window are only in the latter.
+    """
+    to_height = from_height + interval
+    with ConnFactory.poktinfo_conn() as session:
+        addresses = PoktInfoRepository.get_cache_set_addresses(session, cache_set_id)
+
+        def get_rollup(table_name: str) -> pd.DataFrame:
+            return get_rollup_frame(
+                session,
+                table_name,
+                [cache_set_id],
+                fine_interval,
+                from_height,
+                to_height,
+            ).drop(columns="cache_set_id")
+
+        rewards_info = PoktInfoRepository.get_rewards_info(
+            session, from_height, to_height, addresses
+        )
+        rewards_df = pd.DataFrame(
+            data=[reward.__to_dict__() for reward in rewards_info],
+            columns=REWARDS_COLUMNS,
+        )
+        is_equal = compare_frames(
+            "rewards",
+            get_rollup("rewards_cache_set"),
+            sum_rewards(rewards_df, ["chain"]),
+            ["chain"],
+            ["rewards_total", "normalized_rewards_total", "relays_total"],
+        )
+
+        latency_cache = PoktInfoRepository.get_latency_cache(
+            session, from_height, to_height, addresses
+        )
+        latency_df = pd.DataFrame(
+            data=[latency.__to_dict__() for latency in latency_cache],
+            columns=LATENCY_COLUMNS,
+        )
+        is_equal &= compare_frames(
+            "latency",
+            finalize_latency(get_rollup("latency_cache_set")),
+            finalize_latency(sum_latency(latency_df, ["region", "chain"])),
+            ["region", "chain"],
+            ["total_relays", "avg_latency", "avg_p90_latency", "avg_weighted_latency"],
+        )
+
+        errors_df = pd.DataFrame(
+            PoktInfoRepository.get_errors_dict(
+                session, from_height, to_height, addresses
+            ),
+            columns=["errors_count", "chain", "msg"],
+        )
+        is_equal &= compare_frames(
+            "errors",
+            get_rollup("errors_cache_set").fillna({"chain": ""}),
+            create_msg_groups_frame(errors_df).fillna({"chain": ""}),
+            ["chain", "msg"],
+            ["errors_count"],
+        )
+    return is_equal
+
+
+if __name__ == "__main__":
+    is_equal = verify_rollup(*[int(arg) for arg in sys.argv[1:5]])
+    sys.exit(0 if is_equal else 1)
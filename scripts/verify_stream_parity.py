@@ -0,0 +1,62 @@
+import sys
+
+from common.db_utils import ConnFactory
+from common.orm.repository import PoktInfoRepository
+
+from cache_aggregations import (
+    LATENCY_TOTALS,
+    REWARDS_TOTALS,
+    fold_latency,
+    fold_rewards,
+    sum_latency,
+    sum_rewards,
+)
+from cache_queries import (
+    get_latency_frame,
+    get_rewards_frame,
+    stream_latency,
+    stream_rewards,
+)
+from scripts.parity_utils import compare_frames
+
+"""
+Check the rewards and latency folded from streamed chunks against the sums of
+the whole window read through the ORM
+
+Usage: python3 -m scripts.verify_stream_parity
+    <cache_set_id> <from_height> <to_height> [<chunk_rows>]
+"""
+
+
+def verify_stream(
+    cache_set_id: int, from_height: int, to_height: int, chunk_rows: int = 10000
+) -> bool:
+    """
+    Compare the rewards and latency folded from streamed chunks of chunk_rows
+    with the sums of the whole window read through the ORM.
+    """
+    with ConnFactory.poktinfo_conn() as session:
+        addresses = PoktInfoRepository.get_cache_set_addresses(session, cache_set_id)
+        args = (session, from_height, to_height, addresses, [cache_set_id])
+        rewards_keys = ["chain"]
+        is_equal = compare_frames(
+            "streamed rewards",
+            fold_rewards(stream_rewards(*args, chunk_rows=chunk_rows), rewards_keys),
+            sum_rewards(get_rewards_frame(*args), rewards_keys),
+            rewards_keys,
+            REWARDS_TOTALS,
+        )
+        latency_keys = ["region", "chain"]
+        is_equal &= compare_frames(
+            "streamed latency",
+            fold_latency(stream_latency(*args, chunk_rows=chunk_rows), latency_keys),
+            sum_latency(get_latency_frame(*args), latency_keys),
+            latency_keys,
+            LATENCY_TOTALS,
+        )
+    return is_equal
+
+
+if __name__ == "__main__":
+    is_equal = verify_stream(*[int(arg) for arg in sys.argv[1:5]])
+    sys.exit(0 if is_equal else 1)
@@ -0,0 +1,157 @@
+import numpy as np
+import pandas as pd
+import pytest
+from common.utils import POKT_MULTIPLIER
+
+from cache_aggregations import (
+    LATENCY_TOTALS,
+    LOCATION_KEYS,
+    REWARDS_TOTALS,
+    aggregate_locations,
+    assign_source_windows,
+    finalize_latency,
+    fold_latency,
+    fold_rewards,
+    sum_latency,
+    sum_rewards,
+)
+from scripts.parity_utils import legacy_aggregate_locations, synthetic_locations_frame
+
+
+def rewards_frame(rows: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame(
+        {
+            "height": rng.integers(0, 100, rows),
+            "address": [f"{address:040x}" for address in rng.integers(0, 50, rows)],
+            "rewards": rng.integers(0, 10**8, rows).astype("float64"),
+            "chain": rng.choice(["0001", "0021", "0040"], rows),
+            "relays": rng.integers(0, 1000, rows),
+            "token_multiplier": rng.choice([1.0, 2.0, 4.0], rows),
+            "percentage": 100,
+            "stake_weight": rng.choice([1.0, 2.0, 3.0, 4.0], rows),
+        }
+    )
+
+
+def latency_frame(rows: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame(
+        {
+            "address": [f"{address:040x}" for address in rng.integers(0, 50, rows)],
+            "total_relays": rng.integers(0, 1000, rows),
+            "region": rng.choice(["us-east-2", "eu-central-1"], rows),
+            "start_height": 0,
+            "end_height": 4,
+            "avg_latency": rng.uniform(0.01, 2, rows),
+            "avg_p90_latency": rng.uniform(0.01, 4, rows),
+            "avg_weighted_latency": rng.uniform(0.01, 2, rows),
+            "chain": rng.choice(["0001", "0021"], rows),
+        }
+    )
+
+
+def sort_frame(df: pd.DataFrame, keys: list) -> pd.DataFrame:
+    return df.sort_values(keys).reset_index(drop=True)
+
+
+def test_sum_rewards_normalizes_by_stake_weight_over_token_multiplier():
+    rewards_df = pd.DataFrame(
+        {
+            "chain": ["0001", "0001", "0021"],
+            "rewards": [6.0, 4.0, 9.0],
+            "relays": [10, 20, 30],
+            "stake_weight": [3.0, 4.0, 3.0],
+            "token_multiplier": [1.0, 2.0, 1.0],
+        }
+    )
+    totals = sum_rewards(rewards_df, ["chain"]).set_index("chain")
+    assert totals.loc["0001", "rewards_total"] == pytest.approx(10 / POKT_MULTIPLIER)
+    assert totals.loc["0001", "normalized_rewards_total"] == pytest.approx(
+        (6 / 3 + 4 / 2) / POKT_MULTIPLIER
+    )
+    assert totals.loc["0001", "relays_total"] == 30
+    assert totals.loc["0021", "normalized_rewards_total"] == pytest.approx(
+        3 / POKT_MULTIPLIER
+    )
+
+
+def test_sum_rewards_counts_rows_without_a_usable_weight_as_is():
+    rewards_df = pd.DataFrame(
+        {
+            "chain": ["0001"] * 4,
+            "rewards": [1.0, 2.0, 4.0, 8.0],
+            "relays": [1, 1, 1, 1],
+            "stake_weight": [0.0, np.nan, 2.0, -1.0],
+            "token_multiplier": [1.0, 1.0, 0.0, 1.0],
+        }
+    )
+    totals = sum_rewards(rewards_df, ["chain"])
+    assert totals["normalized_rewards_total"].iloc[0] == pytest.approx(
+        15 / POKT_MULTIPLIER
+    )
+
+
+def test_fold_rewards_matches_sum_rewards_of_the_whole_frame():
+    rewards_df = rewards_frame(5000)
+    chunks = [rewards_df.iloc[start : start + 700] for start in range(0, 5000, 700)]
+    keys = ["chain"]
+    actual = sort_frame(fold_rewards(iter(chunks), keys), keys)
+    expected = sort_frame(sum_rewards(rewards_df, keys), keys)
+    pd.testing.assert_frame_equal(actual[keys], expected[keys])
+    np.testing.assert_allclose(
+        actual[REWARDS_TOTALS].to_numpy(dtype="float64"),
+        expected[REWARDS_TOTALS].to_numpy(dtype="float64"),
+    )
+
+
+def test_fold_rewards_of_no_chunks_is_empty():
+    totals = fold_rewards(iter([]), ["chain"])
+    assert totals.empty
+    assert set(REWARDS_TOTALS) <= set(totals.columns)
+
+
+def test_fold_latency_matches_sum_latency_of_the_whole_frame():
+    latency_df = latency_frame(3000)
+    chunks = [latency_df.iloc[start : start + 400] for start in range(0, 3000, 400)]
+    keys = ["region", "chain"]
+    actual = sort_frame(fold_latency(iter(chunks), keys), keys)
+    expected = sort_frame(sum_latency(latency_df, keys), keys)
+    pd.testing.assert_frame_equal(actual[keys], expected[keys])
+    np.testing.assert_allclose(
+        actual[LATENCY_TOTALS].to_numpy(dtype="float64"),
+        expected[LATENCY_TOTALS].to_numpy(dtype="float64"),
+    )
+
+
+def test_finalize_latency_averages_by_relays_and_drops_groups_without_relays():
+    latency_df = pd.DataFrame(
+        {
+            "total_relays": [1, 3, 0],
+            "region": ["a", "a", "b"],
+            "avg_latency": [1.0, 2.0, 5.0],
+            "avg_p90_latency": [2.0, 4.0, 5.0],
+            "avg_weighted_latency": [1.0, 1.0, 5.0],
+            "chain": ["0001", "0001", "0001"],
+        }
+    )
+    averages = finalize_latency(sum_latency(latency_df, ["region"]))
+    assert averages["region"].tolist() == ["a"]
+    assert averages["avg_latency"].iloc[0] == pytest.approx(1.75)
+    assert averages["avg_p90_latency"].iloc[0] == pytest.approx(3.5)
+
+
+def test_assign_source_windows_drops_rows_crossing_their_window():
+    df = pd.DataFrame({"start_height": [0, 3, 4, 6], "end_height": [4, 5, 8, 8]})
+    windows = assign_source_windows(df, 0, 4)
+    assert windows["start_height"].tolist() == [0, 4, 4]
+    assert windows["end_height"].tolist() == [4, 8, 8]
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_aggregate_locations_matches_the_nested_groupby(seed):
+    locations_df = synthetic_locations_frame(2000, seed)
+    actual = aggregate_locations(locations_df)[
+        LOCATION_KEYS + ["node_count", "lat", "lon"]
+    ].reset_index(drop=True)
+    pd.testing.assert_frame_equal(actual, legacy_aggregate_locations(locations_df))
@@ -0,0 +1,67 @@
+import pandas as pd
+import pytest
+
+from error_grouping import create_msg_groups, create_msg_groups_frame, filter_error_msg
+from scripts.parity_utils import (
+    GOLDEN_ERROR_MSGS,
+    legacy_create_msg_groups,
+    legacy_filter_error_msg,
+)
+
+ERRORS_DICT = [(1, "0021", msg) for msg in GOLDEN_ERROR_MSGS] + [
+    (2, None, msg) for msg in GOLDEN_ERROR_MSGS
+]
+
+
+def frame_groups(groups: pd.DataFrame, keys: list = None) -> dict:
+    """
+    create_msg_groups_frame() output as the dict of create_msg_groups().
+    """
+    keys = keys if keys is not None else []
+    msg_groups = {}
+    for row in groups.itertuples(index=False):
+        chain = row.chain if pd.notna(row.chain) else None
+        key = tuple(getattr(row, key) for key in keys) + (chain,)
+        msg_groups.setdefault(key if keys else chain, {})[row.msg] = row.errors_count
+    return msg_groups
+
+
+@pytest.mark.parametrize("mode", ["first", "first_last", "second"])
+@pytest.mark.parametrize("msg", GOLDEN_ERROR_MSGS)
+def test_filter_error_msg_matches_the_legacy_implementation(msg, mode):
+    expected = legacy_filter_error_msg(msg, mode)
+    # Twice, the second call is answered by the LRU cache
+    assert filter_error_msg(msg, mode) == expected
+    assert filter_error_msg(msg, mode) == expected
+
+
+def test_create_msg_groups_matches_the_legacy_implementation():
+    assert create_msg_groups(ERRORS_DICT) == legacy_create_msg_groups(ERRORS_DICT)
+
+
+def test_create_msg_groups_frame_matches_create_msg_groups():
+    errors_df = pd.DataFrame(ERRORS_DICT, columns=["errors_count", "chain", "msg"])
+    # The frame has no rows for chains without any grouped message
+    expected = {
+        chain: msg_groups
+        for chain, msg_groups in legacy_create_msg_groups(ERRORS_DICT).items()
+        if msg_groups
+    }
+    assert frame_groups(create_msg_groups_frame(errors_df)) == expected
+
+
+def test_create_msg_groups_frame_sums_by_keys_and_skips_missing_messages():
+    errors_df = pd.DataFrame(
+        {
+            "cache_set_id": [1, 1, 2, 2],
+            "errors_count": [1, 2, 4, 8],
+            "chain": ["0021", "0021", "0021", "0021"],
+            "msg": ["502 Bad Gateway", "503 Bad Gateway", "502 Bad Gateway", None],
+        }
+    )
+    groups = create_msg_groups_frame(errors_df, ["cache_set_id"])
+    msg = filter_error_msg("502 Bad Gateway")
+    assert frame_groups(groups, ["cache_set_id"]) == {
+        (1, "0021"): {msg: 3},
+        (2, "0021"): {msg: 4},
+    }
@@ -0,0 +1,102 @@
+import pandas as pd
+
+from definitions import get_blocks_interval
+from errors_stream import PARTIAL_SUMS_KEYS, drop_seen_rows, fold_errors
+
+INTERVAL = get_blocks_interval()
+MEMBERSHIP = pd.DataFrame({"cache_set_id": [1, 2, 2], "address": ["a", "a", "b"]})
+
+
+def empty_partial_sums() -> pd.DataFrame:
+    return pd.DataFrame(columns=PARTIAL_SUMS_KEYS + ["errors_count"])
+
+
+def errors_chunk(ids: list, addresses: list, start_heights: list) -> pd.DataFrame:
+    return pd.DataFrame(
+        {
+            "id": ids,
+            "address": addresses,
+            "errors_count": [1] * len(ids),
+            "chain": ["0021"] * len(ids),
+            "msg": ["502 Bad Gateway"] * len(ids),
+            "start_height": start_heights,
+            "end_height": [height + 1 for height in start_heights],
+        }
+    )
+
+
+def get_counts(partial_sums: pd.DataFrame) -> dict:
+    return {
+        (row.cache_set_id, row.start_height): row.errors_count
+        for row in partial_sums.itertuples(index=False)
+    }
+
+
+def test_drop_seen_rows_skips_the_ids_streamed_before():
+    seen_ids = set()
+    chunk = errors_chunk([1, 2], ["a", "b"], [0, 0])
+    assert len(drop_seen_rows(chunk, seen_ids)) == 2
+    assert seen_ids == {1, 2}
+    overlap = errors_chunk([2, 3], ["b", "b"], [0, 0])
+    assert drop_seen_rows(overlap, seen_ids)["id"].tolist() == [3]
+
+
+def test_fold_errors_sums_rows_per_set_and_window():
+    chunk = errors_chunk([1, 2, 3], ["a", "b", "a"], [0, 1, INTERVAL])
+    partial_sums, late_windows = fold_errors(
+        empty_partial_sums(), chunk, MEMBERSHIP, pd.Series(dtype="int64"), 0
+    )
+    assert get_counts(partial_sums) == {
+        (1, 0): 1,
+        (1, INTERVAL): 1,
+        (2, 0): 2,
+        (2, INTERVAL): 1,
+    }
+    assert late_windows.empty
+
+    # Folding more rows adds them to the partial sums
+    chunk = errors_chunk([4], ["b"], [INTERVAL])
+    partial_sums, _ = fold_errors(
+        partial_sums, chunk, MEMBERSHIP, pd.Series(dtype="int64"), 0
+    )
+    assert get_counts(partial_sums)[(2, INTERVAL)] == 2
+
+
+def test_fold_errors_drops_rows_crossing_their_window():
+    chunk = errors_chunk([1], ["a"], [INTERVAL - 1]).assign(end_height=INTERVAL + 1)
+    partial_sums, late_windows = fold_errors(
+        empty_partial_sums(), chunk, MEMBERSHIP, pd.Series(dtype="int64"), 0
+    )
+    assert partial_sums.empty
+    assert late_windows.empty
+
+
+def test_fold_errors_returns_the_flushed_windows_of_late_rows():
+    chunk = errors_chunk([1, 2], ["a", "a"], [0, INTERVAL])
+    flushed_heights = pd.Series({1: INTERVAL}, dtype="int64")
+    partial_sums, late_windows = fold_errors(
+        empty_partial_sums(), chunk, MEMBERSHIP, flushed_heights, 0
+    )
+    assert get_counts(partial_sums) == {(1, INTERVAL): 1, (2, 0): 1, (2, INTERVAL): 1}
+    assert late_windows.to_dict("records") == [
+        {"cache_set_id": 1, "start_height": 0, "end_height": INTERVAL}
+    ]
+
+
+def test_fold_errors_skips_rows_cached_by_the_catch_up():
+    chunk = errors_chunk([1, 2, 3], ["a", "a", "a"], [0, 0, INTERVAL])
+    caught_up_heights = pd.Series({1: INTERVAL, 2: 0}, dtype="int64")
+    partial_sums, late_windows = fold_errors(
+        empty_partial_sums(),
+        chunk,
+        MEMBERSHIP,
+        caught_up_heights,
+        0,
+        caught_up_heights,
+        catch_up_id=1,
+    )
+    # Row 1 was read by the catch up of set 1, row 2 came after it
+    assert late_windows.to_dict("records") == [
+        {"cache_set_id": 1, "start_height": 0, "end_height": INTERVAL}
+    ]
+    assert get_counts(partial_sums) == {(1, INTERVAL): 1, (2, 0): 2, (2, INTERVAL): 1}
@@ -0,0 +1,101 @@
+import math
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from latency_sketch import (
+    SKETCH_MAX_BUCKETS,
+    SKETCH_RELATIVE_ACCURACY,
+    decode_sketch,
+    get_quantile,
+    merge_sketch_frame,
+    sketch_frame,
+)
+
+
+def latency_frame(rows: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame(
+        {
+            "chain": rng.choice(["0001", "0021"], rows),
+            "latency": rng.lognormal(-1, 1, rows),
+            "relays": rng.integers(1, 1000, rows),
+        }
+    )
+
+
+def get_exact_quantile(rows: pd.DataFrame, quantile: float) -> float:
+    rows = rows.sort_values("latency")
+    cumulative = rows["relays"].cumsum().to_numpy()
+    return rows["latency"].iloc[cumulative.searchsorted(quantile * cumulative[-1])]
+
+
+@pytest.mark.parametrize("quantile", [0.5, 0.9, 0.99])
+def test_quantiles_are_within_the_relative_accuracy(quantile):
+    latency_df = latency_frame(5000)
+    sketches = sketch_frame(latency_df, ["chain"], "latency", "relays", "sketch")
+    for row in sketches.itertuples(index=False):
+        expected = get_exact_quantile(
+            latency_df[latency_df["chain"] == row.chain], quantile
+        )
+        assert math.isclose(
+            get_quantile(row.sketch, quantile),
+            expected,
+            rel_tol=SKETCH_RELATIVE_ACCURACY + 1e-6,
+        )
+
+
+def test_merged_sketches_equal_the_sketch_of_all_rows():
+    latency_df = latency_frame(4000, 1)
+    keys = ["chain"]
+    parts = pd.concat(
+        [
+            sketch_frame(
+                latency_df.iloc[start : start + 500],
+                keys,
+                "latency",
+                "relays",
+                "sketch",
+            )
+            for start in range(0, 4000, 500)
+        ],
+        ignore_index=True,
+    )
+    merged = merge_sketch_frame(parts, keys, "sketch").set_index("chain")
+    whole = sketch_frame(latency_df, keys, "latency", "relays", "sketch").set_index(
+        "chain"
+    )
+    for chain in whole.index:
+        merged_indexes, merged_weights = decode_sketch(merged.loc[chain, "sketch"])
+        indexes, weights = decode_sketch(whole.loc[chain, "sketch"])
+        np.testing.assert_array_equal(merged_indexes, indexes)
+        np.testing.assert_allclose(merged_weights, weights, rtol=1e-5)
+
+
+def test_rows_without_a_value_or_weight_are_skipped():
+    latency_df = pd.DataFrame(
+        {"chain": ["0001"] * 3, "latency": [0.2, np.nan, 5.0], "relays": [1, 9, 0]}
+    )
+    sketch = sketch_frame(latency_df, ["chain"], "latency", "relays", "sketch")
+    assert math.isclose(
+        get_quantile(sketch["sketch"].iloc[0], 1),
+        0.2,
+        rel_tol=SKETCH_RELATIVE_ACCURACY + 1e-6,
+    )
+
+
+def test_sketches_keep_at_most_the_max_buckets():
+    latency_df = pd.DataFrame(
+        {"chain": "0001", "latency": np.geomspace(1e-5, 1e5, 20000), "relays": 1}
+    )
+    sketch = sketch_frame(latency_df, ["chain"], "latency", "relays", "sketch")
+    indexes, weights = decode_sketch(sketch["sketch"].iloc[0])
+    assert len(indexes) <= SKETCH_MAX_BUCKETS
+    assert weights.sum() == pytest.approx(20000)
+    # The high quantiles keep their accuracy
+    assert math.isclose(
+        get_quantile(sketch["sketch"].iloc[0], 0.99),
+        get_exact_quantile(latency_df, 0.99),
+        rel_tol=SKETCH_RELATIVE_ACCURACY + 1e-6,
+    )
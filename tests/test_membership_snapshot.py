@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from cache_aggregations import expand_to_sets
+from membership_snapshot import (
+    build_snapshot_arrays,
+    expand_to_snapshot_sets,
+    get_snapshot_addresses,
+)
+from scripts.parity_utils import legacy_set_addresses, synthetic_membership_frame
+
+CACHE_SETS = 50
+NODES = synthetic_membership_frame(CACHE_SETS, 2000)
+ARRAYS = build_snapshot_arrays(NODES)
+
+
+@pytest.mark.parametrize("height", [None, 500, 1500, 2500])
+def test_snapshot_addresses_match_the_cache_set_node_rows(height):
+    for cache_set_id, set_nodes in NODES.groupby("cache_set_id"):
+        assert sorted(get_snapshot_addresses(ARRAYS, cache_set_id, height)) == sorted(
+            legacy_set_addresses(set_nodes, height)
+        )
+
+
+def test_snapshot_expansion_matches_the_merge_on_addresses():
+    rng = np.random.default_rng(0)
+    # Some rows of addresses outside every set
+    df = pd.DataFrame(
+        {
+            "address": [f"{address:040x}" for address in rng.integers(0, 2500, 20000)],
+            "relays": rng.integers(0, 1000, 20000),
+        }
+    )
+    cache_set_ids = list(range(1, CACHE_SETS + 1, 2))
+    membership = NODES[
+        NODES["end_height"].isna() & NODES["cache_set_id"].isin(cache_set_ids)
+    ][["cache_set_id", "address"]]
+    keys = ["cache_set_id", "address", "relays"]
+    expected = expand_to_sets(df, membership).sort_values(keys)[keys]
+    actual = expand_to_snapshot_sets(ARRAYS, df, cache_set_ids).sort_values(keys)[keys]
+    pd.testing.assert_frame_equal(
+        actual.reset_index(drop=True), expected.reset_index(drop=True)
+    )
@@ -0,0 +1,47 @@
+import pytest
+
+import param_cache
+from definitions import PARAM_CACHE_BLOCKS, get_blocks_interval
+
+
+@pytest.fixture
+def fetched_heights(tmp_path, monkeypatch):
+    """
+    Heights get_param() is called for, the chains change at 2 * PARAM_CACHE_BLOCKS.
+    """
+    heights = []
+
+    def get_param(height: int, key: str) -> str:
+        heights.append(height)
+        return "['0001']" if height < 2 * PARAM_CACHE_BLOCKS else "['0001', '0021']"
+
+    monkeypatch.setattr(param_cache, "PARAM_CACHE_PATH", str(tmp_path / "params.json"))
+    monkeypatch.setattr(param_cache, "get_param", get_param)
+    return heights
+
+
+def test_params_are_fetched_once_per_span(fetched_heights):
+    for height in range(0, 3 * PARAM_CACHE_BLOCKS, get_blocks_interval()):
+        param_cache.get_supported_chains(height)
+    assert fetched_heights == [0, PARAM_CACHE_BLOCKS, 2 * PARAM_CACHE_BLOCKS]
+
+    # Every height of the fetched spans is answered from the segments
+    assert param_cache.get_supported_chains(PARAM_CACHE_BLOCKS + 1) == ["0001"]
+    assert param_cache.get_supported_chains(3 * PARAM_CACHE_BLOCKS - 1) == [
+        "0001",
+        "0021",
+    ]
+    assert len(fetched_heights) == 3
+
+
+def test_add_segment_extends_and_joins_segments_of_the_same_value():
+    segments = []
+    param_cache.add_segment(segments, 0, "a")
+    param_cache.add_segment(segments, 192, "a")
+    param_cache.add_segment(segments, 384, "b")
+    assert segments == [[0, 192, "a"], [384, 384, "b"]]
+    param_cache.add_segment(segments, 288, "b")
+    assert segments == [[0, 192, "a"], [288, 384, "b"]]
+    param_cache.add_segment(segments, 96, "a")
+    assert param_cache.find_segment(segments, 150) == [0, 192, "a"]
+    assert param_cache.find_segment(segments, 250) is None
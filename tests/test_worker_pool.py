@@ -0,0 +1,48 @@
+from collections import defaultdict, deque
+
+from definitions import RECENT_BLOCKS, get_blocks_interval
+from worker_pool import BACKFILL, LIVE, RECENT, get_next_key, get_priority
+
+INTERVAL = get_blocks_interval()
+LAST_HEIGHT = 100 * INTERVAL + RECENT_BLOCKS
+
+
+def test_get_priority_classes_windows_by_how_far_behind_they_end():
+    assert get_priority(LAST_HEIGHT, LAST_HEIGHT) == LIVE
+    assert get_priority(LAST_HEIGHT - INTERVAL + 1, LAST_HEIGHT) == LIVE
+    assert get_priority(LAST_HEIGHT - INTERVAL, LAST_HEIGHT) == RECENT
+    assert get_priority(LAST_HEIGHT - RECENT_BLOCKS + 1, LAST_HEIGHT) == RECENT
+    assert get_priority(LAST_HEIGHT - RECENT_BLOCKS, LAST_HEIGHT) == BACKFILL
+
+
+def test_get_next_key_runs_the_live_window_first():
+    windows = {
+        (1, "rewards"): deque([0, INTERVAL]),
+        (2, "rewards"): deque([LAST_HEIGHT - INTERVAL]),
+        (3, "rewards"): deque([LAST_HEIGHT - 2 * INTERVAL]),
+    }
+    assert get_next_key(windows, windows, defaultdict(int), LAST_HEIGHT) == (
+        (2, "rewards"),
+        LIVE,
+    )
+    windows.pop((2, "rewards"))
+    assert get_next_key(windows, windows, defaultdict(int), LAST_HEIGHT) == (
+        (3, "rewards"),
+        RECENT,
+    )
+
+
+def test_get_next_key_shares_a_class_between_sets():
+    windows = {
+        (1, "latency"): deque([0]),
+        (1, "rewards"): deque([0]),
+        (2, "rewards"): deque([0]),
+    }
+    served = defaultdict(int, {1: 1})
+    assert get_next_key(windows, windows, served, LAST_HEIGHT) == (
+        (2, "rewards"),
+        BACKFILL,
+    )
+    # Ties go by key
+    served[2] = 1
+    assert get_next_key(windows, windows, served, LAST_HEIGHT)[0] == (1, "latency")
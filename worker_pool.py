@@ -0,0 +1,286 @@
+from collections import defaultdict, deque
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    wait,
+)
+from concurrent.futures.process import BrokenProcessPool
+from time import perf_counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import pandas as pd
+from common.orm.repository import PoktInfoRepository
+from common.orm.schema import (
+    RewardsCacheSet,
+    LatencyCacheSet,
+    ErrorsCacheSet,
+    NodeCountCacheSet,
+    LocationCacheSet,
+    LatencyCache,
+    RewardsInfo,
+    ErrorsCache,
+)
+from common.utils import get_last_block_height
+from sqlalchemy.orm import Session
+
+import membership_snapshot
+from address_cache import check_membership_version
+from cache_service import (
+    cache_rewards,
+    cache_latency,
+    cache_errors,
+    cache_node_count,
+    cache_locations,
+    get_last_recorded_height,
+)
+from cache_queries import get_last_cached_heights
+from db_utils import init_engine, poktinfo_conn
+from definitions import (
+    DB_LATENCY_TARGET,
+    RECENT_BLOCKS,
+    WORKER_POOL_SIZE,
+    get_blocks_interval,
+    set_blocks_interval,
+)
+from loggers import logger, perf_logger
+from membership_snapshot import attach_snapshot
+
+"""
+Long lived worker pool of the cache service. Every cycle is planned as a flat
+list of (cache_set_id, service, window) jobs run by the same WORKER_POOL_SIZE
+processes, instead of forking a pool per cycle and another one per cache set.
+Each worker keeps a pooled engine (db_utils.init_engine()) for its jobs.
+
+Windows of one (cache_set_id, service) are run in order, the next one is only
+queued once the previous one is done, and the rest are dropped as soon as the
+source data of a window isn't synced yet, they are planned again next cycle.
+
+Free workers take the ready window of the highest priority class first (the
+live tip, then recent catch-up, then deep backfill of new sets), and within a
+class the cache set that got the fewest windows so far. Backfill and catch-up
+windows are also throttled by the latency of the source sync check, an
+exponential moving average above DB_LATENCY_TARGET halves how many of them may
+run at once, every window under it lets one more run, live windows can always
+use the whole pool.
+
+With MEMBERSHIP_SNAPSHOT the jobs of a cycle carry the path of the membership
+snapshot the service built for it, workers attach it before their first job.
+They also carry the cache_set_node version read when the cycle was planned, a
+worker drops the memberships it cached once the version changes.
+"""
+
+# service -> (cache set table, cache function)
+WINDOW_SERVICES = {
+    "rewards": (RewardsCacheSet, cache_rewards),
+    "latency": (LatencyCacheSet, cache_latency),
+    "errors": (ErrorsCacheSet, cache_errors),
+    "node_count": (NodeCountCacheSet, cache_node_count),
+    "location": (LocationCacheSet, cache_locations),
+}
+# service -> (source table, is_range) checked before running a window
+WINDOW_SOURCES = {
+    "rewards": (RewardsInfo, False),
+    "latency": (LatencyCache, True),
+    "errors": (ErrorsCache, True),
+}
+
+# Priority classes, lower runs first
+LIVE, RECENT, BACKFILL = 0, 1, 2
+PRIORITY_NAMES = {LIVE: "live", RECENT: "recent", BACKFILL: "backfill"}
+# Weight of the newest latency in the moving average
+LATENCY_SMOOTHING = 0.2
+
+pool = None
+
+
+def init_worker(interval: int) -> None:
+    set_blocks_interval(interval)
+    init_engine()
+
+
+def get_pool() -> ProcessPoolExecutor:
+    global pool
+    if pool is None:
+        pool = ProcessPoolExecutor(
+            max_workers=WORKER_POOL_SIZE,
+            initializer=init_worker,
+            initargs=(get_blocks_interval(),),
+        )
+    return pool
+
+
+def run_window_job(
+    cache_set_id: int,
+    service: str,
+    from_height: int,
+    to_height: int,
+    snapshot_path: str = None,
+    membership_version: tuple = None,
+) -> Tuple[bool, Optional[float]]:
+    """
+    Cache one window. Returns False without caching if its source data isn't
+    synced yet, and the seconds the sync check took (None without a check).
+    """
+    if snapshot_path is not None:
+        attach_snapshot(snapshot_path)
+    latency = None
+    with poktinfo_conn() as session:
+        if membership_version is not None:
+            check_membership_version(session, membership_version)
+        if service in WINDOW_SOURCES:
+            table_obj, is_range = WINDOW_SOURCES[service]
+            started = perf_counter()
+            is_synced = PoktInfoRepository.does_height_exist(
+                session, to_height, table_obj, is_range=is_range
+            )
+            latency = perf_counter() - started
+            if not is_synced:
+                return False, latency
+        _, func = WINDOW_SERVICES[service]
+        if service in WINDOW_SOURCES:
+            # Synced already, checked above
+            func(session, cache_set_id, from_height, to_height, check_synced=False)
+        else:
+            func(session, cache_set_id, from_height, to_height)
+    return True, latency
+
+
+def get_priority(to_height: int, last_height: int) -> int:
+    behind = last_height - to_height
+    if behind < get_blocks_interval():
+        return LIVE
+    if behind < RECENT_BLOCKS:
+        return RECENT
+    return BACKFILL
+
+
+def get_next_key(
+    ready: Iterable[Tuple[int, str]],
+    windows: Dict[Tuple[int, str], deque],
+    served: Dict[int, int],
+    last_height: int,
+) -> Tuple[Tuple[int, str], int]:
+    """
+    Ready (cache_set_id, service) whose next window runs first and its priority,
+    the highest priority class first, then the set served the least this cycle.
+    """
+
+    def get_next_priority(key: Tuple[int, str]) -> int:
+        return get_priority(windows[key][0] + get_blocks_interval(), last_height)
+
+    key = min(ready, key=lambda key: (get_next_priority(key), served[key[0]], key))
+    return key, get_next_priority(key)
+
+
+def get_windows(
+    session: Session, cache_set_ids: List[int], services: List[str], last_height: int
+) -> Dict[Tuple[int, str], deque]:
+    """
+    Windows left to cache of every (cache_set_id, service) up to last_height,
+    from the last window recorded in the cache set table or as a successful
+    state range (windows without rows, like a set without errors).
+    """
+    last_cached_heights = get_last_cached_heights(
+        session,
+        cache_set_ids,
+        [WINDOW_SERVICES[service][0].__tablename__ for service in services],
+        get_blocks_interval(),
+    )
+    windows = {}
+    for cache_set_id in cache_set_ids:
+        for service in services:
+            table_obj, _ = WINDOW_SERVICES[service]
+            from_height = max(
+                get_last_recorded_height(session, table_obj, cache_set_id, last_height),
+                last_cached_heights.get((cache_set_id, table_obj.__tablename__), 0),
+            )
+            from_height -= from_height % get_blocks_interval()
+            heights = range(
+                from_height,
+                last_height - get_blocks_interval() + 1,
+                get_blocks_interval(),
+            )
+            if heights:
+                windows[(cache_set_id, service)] = deque(heights)
+    return windows
+
+
+def plan_windows(
+    cache_set_ids: List[int], services: List[str], last_height: int
+) -> Tuple[Dict[Tuple[int, str], deque], tuple]:
+    """
+    Windows of the cycle and the membership version its jobs check against.
+    """
+    with poktinfo_conn() as session:
+        membership_version = check_membership_version(session)
+        windows = get_windows(session, cache_set_ids, services, last_height)
+    return windows, membership_version
+
+
+def run_cycle(
+    cache_set_ids: List[int], services: List[str] = None, last_height: int = None
+) -> int:
+    """
+    Cache every window of services for cache_set_ids up to last_height on the
+    worker pool, returns the number of windows run.
+    """
+    global pool
+    now = pd.Timestamp.now()
+    services = services if services is not None else list(WINDOW_SERVICES)
+    last_height = last_height if last_height is not None else get_last_block_height()
+    windows, membership_version = plan_windows(cache_set_ids, services, last_height)
+    # Keys with windows left and none running
+    ready = set(windows)
+    running = {}
+    served = defaultdict(int)
+    jobs = defaultdict(int)
+    limit, db_latency = WORKER_POOL_SIZE, None
+    while ready or running:
+        while ready and len(running) < WORKER_POOL_SIZE:
+            key, priority = get_next_key(ready, windows, served, last_height)
+            if priority != LIVE and len(running) >= limit:
+                break
+            ready.remove(key)
+            served[key[0]] += 1
+            jobs[PRIORITY_NAMES[priority]] += 1
+            from_height = windows[key].popleft()
+            future = get_pool().submit(
+                run_window_job,
+                *key,
+                from_height,
+                from_height + get_blocks_interval(),
+                membership_snapshot.snapshot_path,
+                membership_version,
+            )
+            running[future] = key
+
+        done, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+            key = running.pop(future)
+            try:
+                is_synced, latency = future.result()
+            except BrokenProcessPool:
+                pool = None
+                raise
+            except Exception as e:
+                logger.error(f"Failed caching window of {key}, {e}")
+                is_synced, latency = True, None
+            if latency is not None:
+                db_latency = (
+                    latency
+                    if db_latency is None
+                    else LATENCY_SMOOTHING * latency
+                    + (1 - LATENCY_SMOOTHING) * db_latency
+                )
+                if db_latency > DB_LATENCY_TARGET:
+                    limit = max(1, limit // 2)
+                else:
+                    limit = min(WORKER_POOL_SIZE, limit + 1)
+            if is_synced and windows[key]:
+                ready.add(key)
+    perf_logger.info(
+        f"Finished cycle of {len(cache_set_ids)} cache sets {services} at "
+        f"{last_height}, windows {dict(jobs)}, db latency {db_latency}, "
+        f"took {pd.Timestamp.now() - now}"
+    )
+    return sum(jobs.values())